@@ -1,11 +1,11 @@
 import ast
-import numpy as np
 import json
 from _ast import *
 from .func_calls_visitor import get_func_calls
 from .vars_visitor import get_vars
 from copy import deepcopy
-import queue
+import time
+from collections import deque, namedtuple
 
 built_in_names = [ 
         "abs","delattr","hash","memoryview",
@@ -58,162 +58,405 @@ def get_fun_ref_id(tree):
                     func_ref_ids += [d['asname']]
     return func_ref_ids
 
+def get_symbol_table(node):
+    '''
+    Producer and consumer sets of symbols (name, kind) of a cell
+    '''
+    if any(isinstance(child, (ast.ClassDef, ast.AugAssign)) for child in ast.walk(node)):
+        node = deepcopy(node)  # the transformer rewrites the tree in place, which may be shared (NotebookIndex)
+    transfomer = FilterTransformer()  # remove classes 
+    node = transfomer.visit(node)
+    func_records = get_func_calls(node)  # function calls (no object's  member included)
+    vars_records = get_vars(node)        # variables / objects 
+    func_ref_ids = get_fun_ref_id(node)  # from import names
+
+    class_ref_ids = transfomer.class_names  # get class names
+    func_records = [(tmp,'def') for tmp in class_ref_ids+func_ref_ids] + func_records # make sure defs are ahead of load
+    vars_records = [(tmp, 'store') for tmp in class_ref_ids+func_ref_ids] + vars_records
+    producer_set = set()
+    consumer_set = set()
+    for e in vars_records:
+        if e[0] in built_in_names:
+            continue
+        if e[1]=='def' or e[1]=='store' and (e[0],'var') not in consumer_set:
+            producer_set.add((e[0], 'var'))
+        elif e[1]=='load':
+            consumer_set.add((e[0], 'var'))
+
+    for e in func_records:
+        if e[0] in built_in_names:
+            continue
+        if e[1]=='def' or e[1]=='store':
+            producer_set.add((e[0], 'fun'))
+            producer_set.add((e[0], 'var'))
+        elif e[1]=='load':
+            consumer_set.add((e[0], 'fun'))
+    return producer_set, consumer_set
+
+OECSearchResult = namedtuple('OECSearchResult', ['paths', 'num_of_paths', 'truncated'])
+
 class CRG:
 
     def __init__(self):
         self.producer_list = []  # a list of producer list 
         self.consumer_list = []   # a list of consumer list
-        self.adj_mat = None
+        self.successors = []      # adjacency list, producer cell -> consumer cells
+        self.predecessors = []    # adjacency list, consumer cell -> producer cells
 
-    def update_symbol_table(self, node):
-        transfomer = FilterTransformer()  # remove classes 
-        node = transfomer.visit(node)
-        func_records = get_func_calls(node)  # function calls (no object's  member included)
-        vars_records = get_vars(node)        # variables / objects 
-        func_ref_ids = get_fun_ref_id(node)  # from import names
-
-        class_ref_ids = transfomer.class_names  # get class names
-        func_records = [(tmp,'def') for tmp in class_ref_ids+func_ref_ids] + func_records # make sure defs are ahead of load
-        vars_records = [(tmp, 'store') for tmp in class_ref_ids+func_ref_ids] + vars_records
-        producer_set = set()
-        consumer_set = set()
-        for e in vars_records:
-            if e[0] in built_in_names:
-                continue
-            if e[1]=='def' or e[1]=='store' and (e[0],'var') not in consumer_set:
-                producer_set.add((e[0], 'var'))
-            elif e[1]=='load':
-                consumer_set.add((e[0], 'var'))
+        # Symbols (name, kind) are interned to integer ids, so that producer/consumer sets are bitsets (python ints)
+        self.symbol_ids = {}
+        self.producer_bits = []
+        self.consumer_bits = []
 
-        for e in func_records:
-            if e[0] in built_in_names:
-                continue
-            if e[1]=='def' or e[1]=='store':
-                producer_set.add((e[0], 'fun'))
-                producer_set.add((e[0], 'var'))
-            elif e[1]=='load':
-                consumer_set.add((e[0], 'fun'))
+    def intern_symbols(self, symbol_set):
+        bits = 0
+        for symbol in symbol_set:
+            symbol_id = self.symbol_ids.setdefault(symbol, len(self.symbol_ids))
+            bits |= 1 << symbol_id
+        return bits
+
+    def update_symbol_table(self, node):
+        self.add_symbol_table(*get_symbol_table(node))
 
+    def add_symbol_table(self, producer_set, consumer_set):
         self.producer_list += [producer_set]
         self.consumer_list  += [consumer_set]
-    def build(self, code_list):
+        self.producer_bits += [self.intern_symbols(producer_set)]
+        self.consumer_bits += [self.intern_symbols(consumer_set)]
+
+    def build(self, code_list, trees=None, symbol_tables=None):
+        '''
+        trees         : parsed code_list (None for cells with syntax errors), if already available
+        symbol_tables : (producer set, consumer set) of every cell (None for cells with syntax errors), if already
+                        available, e.g. from a CellCache
+        '''
         self.N = len(code_list)
-        mat = np.zeros((self.N, self.N))
-        self.adj_mat = np.zeros((self.N, self.N), dtype=int)
         for idx, code in enumerate(code_list):
-            #print(idx)
-            #print(code)
+            if symbol_tables is not None:
+                if symbol_tables[idx] is None:
+                    print('warning!! Synatx Error')
+                self.add_symbol_table(*(symbol_tables[idx] or (set(), set())))
+                continue
             try:
-                tree = ast.parse(code, mode='exec')
+                tree = trees[idx] if trees is not None else ast.parse(code, mode='exec')
+                if tree is None:
+                    raise SyntaxError
                 self.update_symbol_table(tree)
             except(SyntaxError):
                 tree = ast.parse("", mode='exec')
                 self.update_symbol_table(tree)
                 print('warning!! Synatx Error')
-        return self.adj_mat
+        self.build_edges()
+        return self.successors
+
+    def build_edges(self):
+        '''
+        Build producer -> consumer edges with last-writer semantics: a cell consuming a symbol depends on the last
+        cell above it producing the symbol, or, if no cell above produces it (cells executed out of order), on the
+        first cell below producing it.
+        '''
+        writers = {}  # symbol id -> cells producing the symbol, in ascending order
+        for i in range(self.N):
+            for symbol_id in self.iter_symbol_ids(self.producer_bits[i]):
+                writers.setdefault(symbol_id, []).append(i)
+
+        last_writers = {}  # symbol id -> last cell producing the symbol so far
+        self.successors = [[] for _ in range(self.N)]
+        self.predecessors = [[] for _ in range(self.N)]
+        for i in range(self.N):
+            producers = set()
+            for symbol_id in self.iter_symbol_ids(self.consumer_bits[i]):
+                if symbol_id in last_writers:
+                    producers.add(last_writers[symbol_id])
+                elif symbol_id in writers:
+                    later_writers = [j for j in writers[symbol_id][:2] if j != i]
+                    if len(later_writers) > 0:
+                        producers.add(later_writers[0])
+            for j in sorted(producers):
+                self.successors[j].append(i)
+                self.predecessors[i].append(j)
+            for symbol_id in self.iter_symbol_ids(self.producer_bits[i]):
+                last_writers[symbol_id] = i
+
+    @staticmethod
+    def iter_symbol_ids(bits):
+        while bits:
+            lowest_bit = bits & -bits
+            yield lowest_bit.bit_length()-1
+            bits ^= lowest_bit
 
     def get_topological_order(self):
-        self.build_adj_mat()
-        adj_mat = deepcopy(self.adj_mat)
+        '''
+        Kahn's algorithm in O(V+E). Cells without pending producers are executed in notebook order; if the
+        remaining cells form a cycle (out-of-order notebooks), the first remaining cell is executed to break it.
+        '''
+        in_degrees = [len(producers) for producers in self.predecessors]
+        todo_cells = deque(i for i in range(self.N) if in_degrees[i] == 0)
+        visited = [False]*self.N
         exec_order = []
-        n = adj_mat.shape[0]
-        in_degrees = np.sum(self.adj_mat, axis=0)
-        todo_node_idx = (in_degrees==0).nonzero()[0].tolist()# in-degree=0 
-        while len(exec_order)<n:
-            for i in todo_node_idx:
-                if i not in exec_order:
-                    exec_order += [i]
-                    adj_mat[i] = np.zeros(n)
-            in_degrees = np.sum(adj_mat, axis=0)
-            todo_node_idx = (in_degrees==0).nonzero()[0].tolist()# in-degree=0
-
+        next_cell = 0  # lowest cell which may not be visited yet, to break cycles
+        while len(exec_order) < self.N:
+            if len(todo_cells) == 0:
+                while visited[next_cell]:
+                    next_cell += 1
+                todo_cells.append(next_cell)
+            i = todo_cells.popleft()
+            if visited[i]:
+                continue
+            visited[i] = True
+            exec_order.append(i)
+            for j in self.successors[i]:
+                in_degrees[j] -= 1
+                if in_degrees[j] == 0 and not visited[j]:
+                    todo_cells.append(j)
         return exec_order
 
-    def all_topo_util(self,all_paths, res, visited, in_degrees):
-        if len(all_paths)>=self.max_size:
-            return 
-        flag = False
-        for i in range(self.N):
-            if in_degrees[i] ==0 and visited[i]==False:
-                adj_nodes = self.adj_mat[i].nonzero()[0].tolist()
-                in_degrees[adj_nodes] = in_degrees[adj_nodes]-1
-                res.append(i)
-                visited[i] = True
-                self.all_topo_util(all_paths, res, visited, in_degrees)
-                # backtracking 
-                visited[i] = False
-                res.pop()
-                in_degrees[adj_nodes] += 1
-                flag = True
-        if not flag:
-            all_paths.append(deepcopy(res))
-
-    def alltopologicalSort(self, all_paths):
+    def get_ancestors(self, cell_idx):
+        '''
+        Cells on which cell_idx depends, directly or transitively, in ascending order
+        '''
+        return self._reachable_cells(cell_idx, self.predecessors)
+
+    def get_descendants(self, cell_idx):
+        '''
+        Cells depending on cell_idx, directly or transitively, in ascending order
+        '''
+        return self._reachable_cells(cell_idx, self.successors)
+
+    def _reachable_cells(self, cell_idx, adjacency):
         visited = [False]*self.N
-        in_degrees = np.sum(self.adj_mat, axis=0)
+        visited[cell_idx] = True
+        stack = [cell_idx]
+        while len(stack) > 0:
+            for j in adjacency[stack.pop()]:
+                if not visited[j]:
+                    visited[j] = True
+                    stack.append(j)
+        visited[cell_idx] = False
+        return [i for i in range(self.N) if visited[i]]
+
+    def search_oec_orders(self, oec, max_paths=None, max_nodes=None, timeout=None, count_only=False):
+        '''
+        Search orders whose positions match the original execution counts (oec): the cell with execution count k is
+        executed k-th and never after, while positions matching no execution count may execute any cell which is
+        executed again later. A cell is executable once its consumers are produced by the preceding cells or by
+        itself.
+
+        Whether an order can be completed only depends on its length and on the producers accumulated so far, so the
+        number of completions of every such state is memoised: feasible orders are counted without materialising
+        them, and orders are then enumerated (ascending) through states having completions only.
+
+        max_paths : maximal number of orders materialised, None for all of them
+        max_nodes : maximal number of states searched, None for no limit
+        timeout   : maximal search time in seconds, None for no limit
+        count_only: only count orders
+
+        Returns an OECSearchResult. If the budget runs out, truncated is set, num_of_paths is a lower bound and paths
+        only hold orders found so far.
+        '''
+        self.oec = oec
+        self.max_oec = max(self.oec) if len(self.oec) > 0 else 0
+        self.oec_cells = {}  # position -> cell executed at this position for the last time
+        for (i, execution_count) in enumerate(self.oec):
+            if execution_count in self.oec_cells:
+                # two cells cannot be executed at the same position
+                return OECSearchResult([], 0, False)
+            self.oec_cells[execution_count] = i
+
+        deadline = time.time()+timeout if timeout is not None else None
+        memo = {}
+        paths = []
+        num_of_paths, truncated = self._count_oec_orders(memo, paths, 0 if count_only else max_paths, max_nodes, deadline)
+        if not count_only and not truncated:
+            paths = []
+            self._enumerate_oec_orders(memo, paths, max_paths)
+        return OECSearchResult(paths, num_of_paths, truncated)
+
+    def _oec_candidates(self, position, accum_producers):
+        if position in self.oec_cells:
+            cells = [self.oec_cells[position]]
+        else:
+            cells = [i for i in range(self.N) if self.oec[i] > position]
+        return [i for i in cells if not (self.consumer_bits[i] & ~(accum_producers | self.producer_bits[i]))]
+
+    def _count_oec_orders(self, memo, all_paths, max_paths, max_nodes, deadline):
+        '''
+        Iterative depth-first search filling memo[(length, accumulated producers)] with the number of completions.
+        Orders reaching the end without going through a memoised state are kept in all_paths, which are the orders
+        found so far if the budget runs out.
+        '''
+        num_of_nodes = 0
+        frames = [[0, 0, None, 0, None]]  # [length, accumulated producers, remaining candidate cells, completions, cell] per state
+        while len(frames) > 0:
+            frame = frames[-1]
+            position, accum = frame[0], frame[1]
+            if position >= self.max_oec:
+                frame[3] = 1
+                frame[2] = []
+                if max_paths is None or len(all_paths) < max_paths:
+                    all_paths.append([f[4] for f in frames[1:]])
+            elif frame[2] is None:
+                frame[2] = self._oec_candidates(position+1, accum)
+                frame[2].reverse()
+
+            if len(frame[2]) == 0:
+                memo[(position, accum)] = frame[3]
+                frames.pop()
+                if len(frames) > 0:
+                    frames[-1][3] += frame[3]
+                continue
+
+            i = frame[2].pop()
+            state = (position+1, accum | self.producer_bits[i])
+            if state in memo:
+                frame[3] += memo[state]
+                continue
+
+            num_of_nodes += 1
+            if (max_nodes is not None and num_of_nodes > max_nodes) or (deadline is not None and num_of_nodes % 1024 == 0 and time.time() > deadline):
+                # Budget runs out, completions found so far are a lower bound
+                return sum(frame[3] for frame in frames), True
+            frames.append([state[0], state[1], None, 0, i])
+
+        return memo[(0, 0)], False
+
+    def _enumerate_oec_orders(self, memo, all_paths, max_paths):
         res = []
-        self.all_topo_util(all_paths, res, visited, in_degrees)
-
-    def all_topo_with_oec_util(self, all_paths, res, accum_producer_set):
-        oec_tmp = [0]*self.N
-        counter = 0
-        for i in res:
-            counter += 1
-            oec_tmp[i] = counter
-            if counter > self.oec[i]:
-                return
-        if len(res) >= self.max_oec:
-            if oec_tmp == self.oec:
-                all_paths.append(deepcopy(res))
-            return
+        accum_producers = [0]
+        frames = [None]  # remaining candidate cells per position
+        while len(frames) > 0:
+            position, accum = len(res), accum_producers[-1]
+            if position >= self.max_oec:
+                all_paths.append(list(res))
+                if max_paths is not None and len(all_paths) >= max_paths:
+                    return
+                frames[-1] = []
+            elif frames[-1] is None:
+                frames[-1] = [i for i in self._oec_candidates(position+1, accum) if memo.get((position+1, accum | self.producer_bits[i]), 0) > 0]
+                frames[-1].reverse()
 
-        for i in range(self.N):
-                accum_producer_set_tmp = accum_producer_set.union(self.producer_list[i])
-                if self.consumer_list[i].issubset(accum_producer_set_tmp):
-                    accum_producer_set = accum_producer_set_tmp
-                    res.append(i)
-                    accum_producer_set_bk = deepcopy(accum_producer_set)  # to be checked
-                    self.all_topo_with_oec_util(all_paths, res, accum_producer_set)
-                    accum_producer_set = accum_producer_set_bk
+            if len(frames[-1]) == 0:
+                # Backtracking
+                frames.pop()
+                if len(res) > 0:
                     res.pop()
+                    accum_producers.pop()
+                continue
+
+            i = frames[-1].pop()
+            res.append(i)
+            accum_producers.append(accum | self.producer_bits[i])
+            frames.append(None)
+
+    def all_topo(self, all_paths, max_size=200):
+        '''
+        Enumerate up to max_size orders depth-first, where a cell is executable once its consumers are produced by
+        the preceding cells or by itself. An order stops once no remaining cell is executable.
+
+        The search is iterative: every frame holds the next candidate cell of its position, and the state of the
+        current order (visited cells, accumulated producers) is pushed and popped incrementally.
+        '''
+        self.max_size = max_size
+        if len(all_paths) >= self.max_size:
+            return
 
-    def all_topo_with_oec(self, all_paths, oec):
-        in_degrees = np.sum(self.adj_mat, axis=0)
         res = []
-        self.oec = oec
-        self.max_oec = max(self.oec)
-        oec_tmp = [0]*self.N
-        counter = 0
-        accum_producer_set = set()
-        self.all_topo_with_oec_util(all_paths, res, accum_producer_set)
-
-    def all_topo_util(self, all_paths, res, accum_producer_set, visited):
-        flag = False
-        if len(all_paths)>=self.max_size:
-            return 
+        visited = 0
+        accum_producers = [0]       # accumulated producers before each position
+        frames = [[0, False]]       # [next candidate cell, whether any cell was executable] per position
+
+        while len(frames) > 0:
+            frame = frames[-1]
+            accum = accum_producers[-1]
+            i = frame[0]
+            while i < self.N and ((visited >> i) & 1 or (self.consumer_bits[i] & ~(accum | self.producer_bits[i]))):
+                i += 1
+
+            if i == self.N:
+                if not frame[1]:
+                    all_paths.append(list(res))
+                    if len(all_paths) >= self.max_size:
+                        return
+                # Backtracking
+                frames.pop()
+                if len(res) > 0:
+                    visited &= ~(1 << res.pop())
+                    accum_producers.pop()
+                continue
+
+            frame[0], frame[1] = i+1, True
+            res.append(i)
+            visited |= 1 << i
+            accum_producers.append(accum | self.producer_bits[i])
+            frames.append([0, False])
+
+    def get_dependent_cells(self):
+        '''
+        Bitset of the cells sharing at least one symbol with each cell. Cells sharing no symbol commute: executing
+        them in either order gives the same results.
+        '''
+        cells_by_symbol = {}
         for i in range(self.N):
-            accum_producer_set_tmp = accum_producer_set.union(self.producer_list[i])
-            if self.consumer_list[i].issubset(accum_producer_set_tmp) and visited[i]==False:
-                accum_producer_set_bk = deepcopy(accum_producer_set)
-                accum_producer_set = accum_producer_set_tmp
-                res.append(i)
-                visited[i]=True
-
-                self.all_topo_util(all_paths, res, accum_producer_set, visited)
-                accum_producer_set = accum_producer_set_bk
-                res.pop()
-                visited[i]=False
-                flag = True
-        if not flag:
-            all_paths.append(deepcopy(res))
+            for symbol_id in self.iter_symbol_ids(self.producer_bits[i] | self.consumer_bits[i]):
+                cells_by_symbol[symbol_id] = cells_by_symbol.get(symbol_id, 0) | (1 << i)
 
+        dependent_cells = []
+        for i in range(self.N):
+            cells = 0
+            for symbol_id in self.iter_symbol_ids(self.producer_bits[i] | self.consumer_bits[i]):
+                cells |= cells_by_symbol[symbol_id]
+            dependent_cells.append(cells & ~(1 << i))
+        return dependent_cells
 
-    def all_topo(self, all_paths, max_size=200):
+    def all_topo_reduced(self):
+        '''
+        Lazily yield the orders of all_topo (without max_size), but only one order per equivalence class of orders
+        differing by swapping adjacent commuting cells. The yielded order is the lexicographically smallest one of
+        its class: appending cell i is rejected if i could be moved before a greater cell b, i.e. i commutes with b
+        and with every cell after b (Anisimov & Knuth). Prefixes of such orders are such orders as well, so
+        rejected prefixes are pruned.
+        '''
+        dependent_cells = self.get_dependent_cells()
         res = []
-        visited = [False]*self.N
-        accum_producer_set = set()
-        self.max_size=max_size
-        self.all_topo_util(all_paths, res, accum_producer_set, visited)
+        visited = 0
+        accum_producers = [0]       # accumulated producers before each position
+        frames = [[0, False]]       # [next candidate cell, whether any cell was executable] per position
+
+        while len(frames) > 0:
+            frame = frames[-1]
+            accum = accum_producers[-1]
+            i = frame[0]
+            while i < self.N:
+                if not (visited >> i) & 1 and not (self.consumer_bits[i] & ~(accum | self.producer_bits[i])):
+                    frame[1] = True
+                    if self._is_lexicographically_smallest(res, i, dependent_cells[i]):
+                        break
+                i += 1
+
+            if i == self.N:
+                if not frame[1]:
+                    yield list(res)
+                # Backtracking
+                frames.pop()
+                if len(res) > 0:
+                    visited &= ~(1 << res.pop())
+                    accum_producers.pop()
+                continue
+
+            frame[0] = i+1
+            res.append(i)
+            visited |= 1 << i
+            accum_producers.append(accum | self.producer_bits[i])
+            frames.append([0, False])
+
+    @staticmethod
+    def _is_lexicographically_smallest(res, cell_idx, dependent_cells):
+        for j in reversed(res):
+            if (dependent_cells >> j) & 1:
+                return True
+            if j > cell_idx:
+                return False
+        return True
 
     def gen_exec_path(self, mode='single', oec=[]):
         if mode == 'single':
@@ -226,6 +469,7 @@ class CRG:
             self.all_topo(all_paths)
             return all_paths
         if mode == 'oec':
-            all_paths = []
-            self.all_topo_with_oec(all_paths, oec)
-            return all_paths
+            return self.search_oec_orders(oec, max_paths=200).paths
+        if mode == 'reduced':
+            # a generator, orders are generated as they are consumed
+            return self.all_topo_reduced()
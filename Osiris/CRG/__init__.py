@@ -1,3 +1,6 @@
-from .CRG import CRG
-from .dependency_graph_utils import get_code_list, get_path_by_extension, find_local_modules, get_oec
-from .risk_detector import detect, get_antidote
+from .CRG import CRG, OECSearchResult
+from .dependency_graph_utils import get_code_list, get_path_by_extension, find_local_modules, find_local_modules_many, get_oec
+from .module_index import ModuleIndex, DEFAULT_MODULE_INDEX_PATH
+from .notebook_index import NotebookIndex
+from .cell_cache import CellCache
+from .risk_detector import detect, detect_many, get_antidote, APIPatternIndex, compile_rules
@@ -0,0 +1,108 @@
+import ast
+import sys
+import json
+import sqlite3
+import hashlib
+import threading
+
+from .CRG import get_symbol_table
+from .func_calls_visitor import get_func_calls
+from .dependency_graph_utils import get_api_ref_entries
+
+# Bump whenever analyse_cell changes, so that records of older versions are not used anymore
+CELL_RECORD_VERSION = 1
+
+# Maximal number of keys per SELECT, below the SQLite limit of host parameters
+MAX_KEYS_PER_QUERY = 500
+
+def get_cell_key(code):
+    '''
+    Content address of the static analyses of a cell. ASTs depend on the python version as well.
+    '''
+    key = '{}\x00{}.{}\x00{}'.format(CELL_RECORD_VERSION, sys.version_info[0], sys.version_info[1], code)
+    return hashlib.sha1(key.encode('utf-8', 'surrogatepass')).hexdigest()
+
+def analyse_cell(code, tree=None):
+    '''
+    Static analyses of a cell needed by CRG and risk detection, as a JSON serialisable dict:
+    producers/consumers (symbol table), func_calls (names of function calls, including member calls) and
+    api_refs (imports, see get_api_ref_entries). Cells with syntax errors only have syntax_error set.
+    '''
+    if tree is None:
+        try:
+            tree = ast.parse(code, mode='exec')
+        except SyntaxError:
+            return {'syntax_error': True}
+
+    func_calls = [name for (name, _) in get_func_calls(tree, extended=True)]
+    api_refs = get_api_ref_entries(tree)
+    producer_set, consumer_set = get_symbol_table(tree)
+    return {
+        'syntax_error': False,
+        'producers': sorted(producer_set),
+        'consumers': sorted(consumer_set),
+        'func_calls': func_calls,
+        'api_refs': api_refs,
+    }
+
+class CellCache():
+    '''
+    Persistent content-addressed cache of analyse_cell records (SQLite), keyed by a hash of the cell source. A
+    cache file may be shared by notebooks, threads and processes, e.g. workers of analyse_corpus.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL') # readers do not wait for writers
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cells (key TEXT PRIMARY KEY, record TEXT NOT NULL)')
+        self._conn.commit()
+
+    def get_records(self, keys):
+        '''
+        Records of the given keys, None for keys not cached
+        '''
+        found_records = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            for i in range(0, len(unique_keys), MAX_KEYS_PER_QUERY):
+                chunk = unique_keys[i:i+MAX_KEYS_PER_QUERY]
+                rows = self._conn.execute('SELECT key, record FROM cells WHERE key IN ({})'.format(','.join('?'*len(chunk))), chunk)
+                for (key, record) in rows:
+                    found_records[key] = json.loads(record)
+        return [found_records.get(key) for key in keys]
+
+    def put_records(self, keys, records):
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO cells (key, record) VALUES (?, ?)',
+                [(key, json.dumps(record)) for (key, record) in zip(keys, records)])
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def get_cell_records(code_list, cell_cache=None, trees=None):
+    '''
+    analyse_cell records of every cell, looked up in cell_cache first if given. Identical cells are analysed
+    once, and records of analysed cells are added to cell_cache.
+    trees: parsed code_list (None for cells with syntax errors), if already available
+    '''
+    keys = [get_cell_key(code) for code in code_list]
+    records = cell_cache.get_records(keys) if cell_cache is not None else [None]*len(keys)
+
+    analysed_records = {}
+    for (idx, code) in enumerate(code_list):
+        if records[idx] is not None:
+            continue
+        if keys[idx] not in analysed_records:
+            if trees is not None and trees[idx] is None:
+                analysed_records[keys[idx]] = {'syntax_error': True}
+            else:
+                analysed_records[keys[idx]] = analyse_cell(code, trees[idx] if trees is not None else None)
+        records[idx] = analysed_records[keys[idx]]
+
+    if cell_cache is not None and len(analysed_records) > 0:
+        cell_cache.put_records(list(analysed_records.keys()), list(analysed_records.values()))
+    return records
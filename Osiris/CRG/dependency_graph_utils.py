@@ -1,8 +1,10 @@
 import ast
 from  _ast import *
-import json
 import sys, os
 import pkgutil
+from collections import deque
+
+from .notebook_loader import load_notebook
 
 def iter_fields(node):
     """
@@ -28,9 +30,39 @@ def iter_child_nodes(node):
                 if isinstance(item, AST):
                     yield item
 
-def get_code_list(path):
-    content = open(path).read()
-    content = json.loads(content)
+def get_api_ref_entries(tree):
+    '''
+    (depth, imported name, full name) of every import in breadth-first order (as ast.walk), so that the imports
+    of several cells can be merged in the order of walking the concatenated cells
+    '''
+    entries = []
+    todo = deque([(tree, 0)])
+    while todo:
+        node, depth = todo.popleft()
+        if isinstance(node, ast.Import) :
+            for d in node.names:
+                entries.append((depth, d.name if d.asname is None else d.asname, d.name))
+        if isinstance(node, ast.ImportFrom):
+            # relative imports keep their leading dots, the module is None for 'from . import x'
+            module = '.'*node.level + (node.module+'.' if node.module is not None else '')
+            for d in node.names:
+                entries.append((depth, d.name if d.asname is None else d.asname, module+d.name))
+        todo.extend((child, depth+1) for child in ast.iter_child_nodes(node))
+    return entries
+
+def merge_api_ref_entries(lst_of_entries):
+    id2fullname = {}  # key is the imported module while the value is the prefix
+    for (_, name, full_name) in sorted((entry for entries in lst_of_entries for entry in entries), key=lambda entry: entry[0]):
+        id2fullname[name] = full_name
+    return id2fullname
+
+def get_api_ref_id(tree):
+    return merge_api_ref_entries([get_api_ref_entries(tree)])
+
+def get_code_cells(content):
+    '''
+    Code cells of a loaded notebook (JSON), and the key of their sources ('input' for nbformat 3)
+    '''
     if 'worksheets' in content:
         cells = content['worksheets'][0]['cells']
         source_flag = 'input'
@@ -38,6 +70,10 @@ def get_code_list(path):
         cells = content['cells']
         source_flag = 'source'
     cells = list(filter(lambda x:x['cell_type']=='code', cells))
+    return cells, source_flag
+
+def extract_code_list(content):
+    cells, source_flag = get_code_cells(content)
     sources = []
     for cell in cells:
         # filter out cells without execution count
@@ -48,16 +84,8 @@ def get_code_list(path):
             sources.append(s)
     return sources
 
-def get_oec(path):
-    content = open(path).read()
-    content = json.loads(content)
-    if 'worksheets' in content:
-        cells = content['worksheets'][0]['cells']
-        source_flag = 'input'
-    else:
-        cells = content['cells']
-        source_flag = 'source'
-    cells = list(filter(lambda x:x['cell_type']=='code', cells))
+def extract_oec(content):
+    cells, source_flag = get_code_cells(content)
     oec = []
     for cell in cells:
         # filter out cells without execution count
@@ -65,7 +93,16 @@ def get_oec(path):
             oec += [cell['execution_count']]
     return oec
 
-def find_local_modules(import_smts):
+def get_code_list(path):
+    return extract_code_list(load_notebook(path))
+
+def get_oec(path):
+    return extract_oec(load_notebook(path))
+
+def get_imported_modules(import_smts):
+    '''
+    Top-level names of the modules imported by import_smts, and the directories searched for local modules
+    '''
     smts = "\n".join(import_smts)
     tree = ast.parse(smts, mode='exec')
     search_path = ['.']
@@ -82,15 +119,44 @@ def find_local_modules(import_smts):
             else:
                 for nn in node.names:
                     module_names.add(nn.name)
-    module_name_plus = ['random', 'unittest', 'warning', 'os', 'pandas', 'IPython', 'seaborn', 'matplotlib', 'sklearn', 'numpy', 'scipy', 'math', 'matplotlib']
     search_path = list(set(search_path))
-    all_modules = [x[1] for x in pkgutil.iter_modules(path=search_path)]
-    all_modules += list(sys.builtin_module_names) + module_name_plus
-    result = []
-    for m_name in module_names:
-        if m_name not in all_modules:
-            result  += [m_name]
-    return result
+    return module_names, search_path
+
+def find_local_modules(import_smts, module_index=None, directory=None):
+    '''
+    module_index: ModuleIndex of the modules of search paths, which are scanned by pkgutil if not given
+    directory: directory of the notebook, against which search paths are resolved, the working directory if not given
+    '''
+    directories = None if directory is None else [directory]
+    return find_local_modules_many([import_smts], module_index, directories)[0]
+
+def find_local_modules_many(lst_of_import_smts, module_index=None, directories=None):
+    '''
+    find_local_modules of every list of import statements, scanning every search path at most once
+    directories: directory of the notebook of every list of import statements, the working directory if not given
+    '''
+    lst_of_imported_modules = [get_imported_modules(import_smts) for import_smts in lst_of_import_smts]
+    if directories is not None:
+        # search paths are relative to the notebook importing the modules
+        lst_of_imported_modules = [(module_names, [os.path.normpath(os.path.join(directory, path)) for path in search_path])
+                                   for ((module_names, search_path), directory) in zip(lst_of_imported_modules, directories)]
+    search_paths = set(directory for (_, search_path) in lst_of_imported_modules for directory in search_path)
+    if module_index is None:
+        modules_of_directories = {directory: set(x[1] for x in pkgutil.iter_modules(path=[directory])) for directory in search_paths}
+    else:
+        modules_of_directories = {directory: module_index.get_modules([directory]) for directory in search_paths}
+    module_name_plus = ['random', 'unittest', 'warning', 'os', 'pandas', 'IPython', 'seaborn', 'matplotlib', 'sklearn', 'numpy', 'scipy', 'math', 'matplotlib']
+    common_modules = set(sys.builtin_module_names) | set(module_name_plus)
+
+    results = []
+    for (module_names, search_path) in lst_of_imported_modules:
+        all_modules = common_modules.union(*(modules_of_directories[directory] for directory in search_path))
+        result = []
+        for m_name in module_names:
+            if m_name not in all_modules:
+                result  += [m_name]
+        results.append(result)
+    return results
 
 
 def get_path_by_extension(root_dir, num_of_required_paths, flag='.ipynb'):
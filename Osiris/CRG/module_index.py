@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import pkgutil
+import tempfile
+import threading
+
+'''
+Index of the top-level modules found in directories, as listed by pkgutil.iter_modules, for resolving
+import statements of many notebooks without scanning the same directories again. The index is kept in a
+JSON file per python environment, and the modules of a directory are listed again whenever the directory
+or one of its subdirectories (a package gaining or losing its __init__.py) was modified.
+'''
+
+DEFAULT_MODULE_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'osiris_modules.json')
+
+def get_directory_stamp(directory):
+    '''
+    Modification times of the directory and its subdirectories, None if the directory does not exist
+    '''
+    try:
+        stamp = [['.', os.stat(directory).st_mtime_ns]]
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # pkgutil skips names with dots, e.g. .git, and caches of compiled modules change often
+                if entry.is_dir() and '.' not in entry.name and entry.name != '__pycache__':
+                    stamp.append([entry.name, entry.stat().st_mtime_ns])
+    except OSError:
+        return None
+    return sorted(stamp)
+
+class ModuleIndex():
+
+    def __init__(self, path=None):
+        '''
+        path: JSON file of the index, None to keep the index in memory only
+        '''
+        self.path = path
+        self._lock = threading.Lock()
+        # extension modules of other python versions are not modules of this environment
+        self._environment = [sys.executable, sys.version]
+        self._directories = {} # absolute path -> {'stamp', 'modules'}
+        self._is_modified = False
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(content, dict) and content.get('environment') == self._environment:
+            self._directories = content.get('directories', {})
+
+    def save(self):
+        '''
+        Write the index to path if it was updated
+        '''
+        with self._lock:
+            if self.path is None or not self._is_modified:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump({'environment': self._environment, 'directories': self._directories}, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._is_modified = False
+
+    def get_modules(self, search_path):
+        '''
+        Names of top-level modules in the directories of search_path
+        '''
+        modules = set()
+        for directory in search_path:
+            directory = os.path.abspath(directory)
+            stamp = get_directory_stamp(directory)
+            with self._lock:
+                entry = self._directories.get(directory)
+                if entry is None or entry['stamp'] != stamp:
+                    entry = {'stamp': stamp, 'modules': sorted(set(x[1] for x in pkgutil.iter_modules(path=[directory])))}
+                    self._directories[directory] = entry
+                    self._is_modified = True
+            modules.update(entry['modules'])
+        return modules
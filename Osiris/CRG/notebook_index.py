@@ -0,0 +1,149 @@
+import os
+import ast
+import threading
+
+import nbformat
+from nbformat import ValidationError
+
+from .CRG import CRG
+from ..profiler import span
+from .cell_cache import get_cell_records
+from .notebook_loader import load_notebook, decode_lazy_values, get_file_hash
+from .dependency_graph_utils import get_code_cells, extract_code_list, extract_oec
+
+class NotebookIndex():
+    '''
+    Index of a notebook shared by the analyses of a session. The notebook JSON is loaded once, and code lists,
+    execution counts, import statements, cell ASTs, the Cell-Dependency Graph (symbol tables) and execution
+    orders are computed on first use and then cached. Cached values are shared, callers must not modify them.
+    Static analyses of cells (symbol tables, function calls, imports) are looked up in cell_cache if given.
+    '''
+
+    def __init__(self, path, cell_cache=None):
+        self.path = path
+        self.cell_cache = cell_cache # CellCache shared by notebooks
+        with span('load notebook', category='notebook', notebook=path, bytes=os.path.getsize(path)):
+            self.content_hash = get_file_hash(path) # identifies the notebook content, e.g. for ResultCache
+            self.content = load_notebook(path) # outputs are only decoded by get_nb
+        self._lock = threading.Lock() # execution orders may be requested by concurrent analyses
+        self._code_list = None
+        self._oec = None
+        self._import_statements = None
+        self._trees = None
+        self._cell_records = None
+        self._graph = None
+        self._execution_order = None
+        self._all_potential_execution_orders = None
+
+    def get_nb(self):
+        '''
+        A new NotebookNode (nbformat 4) of the notebook, as read by nbformat.read
+        '''
+        with span('decode notebook', category='notebook', notebook=self.path):
+            content = decode_lazy_values(self.content)
+            (major, minor) = nbformat.reader.get_version(content)
+            nb = nbformat.versions[major].to_notebook_json(content, minor=minor)
+            nb = nbformat.convert(nb, 4)
+            try:
+                nbformat.validate(nb)
+            except ValidationError as e:
+                nbformat.get_logger().error("Notebook JSON is invalid: %s", e)
+        return nb
+
+    def get_py_version(self):
+        '''
+        major.minor python version of the notebook metadata, None if unknown
+        '''
+        try:
+            py_version_lst = self.content['metadata']['language_info']['version'].split('.')
+            return py_version_lst[0]+'.'+py_version_lst[1]
+        except:
+            return None
+
+    def get_code_list(self):
+        if self._code_list is None:
+            self._code_list = extract_code_list(self.content)
+        return self._code_list
+
+    def get_oec(self):
+        if self._oec is None:
+            self._oec = extract_oec(self.content)
+        return self._oec
+
+    def get_import_statements(self):
+        '''
+        Lines of executed code cells which look like import statements
+        '''
+        if self._import_statements is None:
+            cells, source_flag = get_code_cells(self.content)
+            import_statements = []
+            for cell in cells:
+                if cell['execution_count'] is None:
+                    continue
+                source = cell[source_flag]
+                source = ''.join(source) if isinstance(source, list) else source
+                for statement in source.split('\n'):
+                    if any(substr in statement for substr in ['from', 'import']):
+                        import_statements.append(statement)
+            self._import_statements = import_statements
+        return self._import_statements
+
+    def get_trees(self):
+        '''
+        AST of every code cell of get_code_list, None for cells with syntax errors
+        '''
+        if self._trees is None:
+            trees = []
+            for code in self.get_code_list():
+                try:
+                    trees.append(ast.parse(code, mode='exec'))
+                except SyntaxError:
+                    trees.append(None)
+            self._trees = trees
+        return self._trees
+
+    def get_cell_records(self):
+        '''
+        Static analyses of every code cell of get_code_list, see analyse_cell. Cells are only parsed if their
+        records are not in cell_cache.
+        '''
+        if self._cell_records is None:
+            with span('analyse cells', category='static', notebook=self.path, cells=len(self.get_code_list())):
+                self._cell_records = get_cell_records(self.get_code_list(), self.cell_cache, self._trees)
+        return self._cell_records
+
+    def get_graph(self):
+        '''
+        Cell-Dependency Graph built from the symbol tables of the cell records
+        '''
+        with self._lock:
+            if self._graph is None:
+                symbol_tables = []
+                for record in self.get_cell_records():
+                    if record['syntax_error']:
+                        symbol_tables.append(None)
+                    else:
+                        symbol_tables.append((set(map(tuple, record['producers'])), set(map(tuple, record['consumers']))))
+                with span('build CRG', category='static', notebook=self.path, cells=len(symbol_tables)):
+                    graph = CRG()
+                    graph.build(self.get_code_list(), symbol_tables=symbol_tables)
+                self._graph = graph
+        return self._graph
+
+    def get_execution_order(self):
+        if self._execution_order is None:
+            graph = self.get_graph()
+            with span('gen_exec_path', category='static', notebook=self.path, mode='single'):
+                self._execution_order = graph.gen_exec_path(mode='single')
+        return self._execution_order
+
+    def get_all_potential_execution_orders(self):
+        if self._all_potential_execution_orders is None:
+            graph = self.get_graph()
+            with span('gen_exec_path', category='static', notebook=self.path, mode='all') as s:
+                self._all_potential_execution_orders = graph.gen_exec_path(mode='all', oec=self.get_oec())
+                s.set(orders=len(self._all_potential_execution_orders))
+        return self._all_potential_execution_orders
+
+    def iter_reduced_execution_orders(self):
+        return self.get_graph().gen_exec_path(mode='reduced')
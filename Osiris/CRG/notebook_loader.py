@@ -0,0 +1,197 @@
+import os
+import re
+import json
+import mmap
+import hashlib
+
+'''
+Streaming loader of notebook files. Static analyses only need sources, execution counts and metadata, while
+outputs (and attachments), e.g. embedded images, usually make up most of a notebook file. The file is memory
+mapped and scanned without decoding such values: they are loaded as LazyJSON references to their byte spans,
+which are decoded on demand. Other values are decoded as json.load would do.
+'''
+
+# Values of these keys of cells are not decoded by load_notebook
+LAZY_KEYS = ('outputs', 'attachments')
+
+_LAZY = object()
+_CELL_SCHEMA = {key: _LAZY for key in LAZY_KEYS}
+_NOTEBOOK_SCHEMA = {'cells': [_CELL_SCHEMA], 'worksheets': [{'cells': [_CELL_SCHEMA]}]} # nbformat 4 and 3
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_BRACKET = re.compile(rb'[\[\]{}]')
+_PRIMITIVE = re.compile(rb'-?[0-9][0-9.eE+\-]*|true|false|null|NaN|-?Infinity')
+
+class LazyJSON():
+    '''
+    JSON value at the byte span [start, end) of a notebook file, decoded by decode()
+    '''
+
+    def __init__(self, path, start, end, stamp):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.stamp = stamp # (size, modification time) of the file when it was loaded
+
+    def decode(self, f=None):
+        '''
+        f: the notebook file opened in binary mode, if already opened
+        '''
+        if f is None:
+            with open(self.path, 'rb') as f:
+                return self.decode(f)
+        stat = os.fstat(f.fileno())
+        if (stat.st_size, stat.st_mtime_ns) != self.stamp:
+            raise ValueError('{} was modified since it was loaded'.format(self.path))
+        f.seek(self.start)
+        return json.loads(f.read(self.end-self.start))
+
+def _error(idx, expected):
+    return ValueError('Expecting {} at byte {} of the notebook JSON'.format(expected, idx))
+
+def _skip_whitespace(buf, idx):
+    return _WHITESPACE.match(buf, idx).end()
+
+def _skip_string(buf, idx):
+    '''
+    End of the string starting at idx. Strings, e.g. base64 images, are skipped by searching quotes.
+    '''
+    pos = idx+1
+    while True:
+        end = buf.find(b'"', pos)
+        if end < 0:
+            raise _error(idx, 'end of string')
+        num_of_backslashes = 0
+        while buf[end-1-num_of_backslashes] == ord('\\'):
+            num_of_backslashes += 1
+        if num_of_backslashes % 2 == 0:
+            return end+1
+        pos = end+1 # escaped quote
+
+def _skip_value(buf, idx):
+    '''
+    End of the JSON value starting at idx. Containers are only scanned for their brackets and strings.
+    '''
+    if idx >= len(buf):
+        raise _error(idx, 'value')
+    first = buf[idx:idx+1]
+    if first == b'"':
+        return _skip_string(buf, idx)
+    if first in (b'[', b'{'):
+        depth = 0
+        pos = idx
+        while True:
+            quote = buf.find(b'"', pos)
+            for match in _BRACKET.finditer(buf, pos, quote if quote >= 0 else len(buf)):
+                depth += 1 if match.group() in (b'[', b'{') else -1
+                if depth == 0:
+                    return match.end()
+            if quote < 0:
+                raise _error(len(buf), 'end of '+first.decode())
+            pos = _skip_string(buf, quote)
+    match = _PRIMITIVE.match(buf, idx)
+    if match is None:
+        raise _error(idx, 'value')
+    return match.end()
+
+def _load_value(buf, idx, origin, schema):
+    '''
+    (value, end) of the JSON value starting at idx, where values of keys marked lazy by schema are LazyJSON
+    '''
+    first = buf[idx:idx+1]
+    if schema is _LAZY:
+        end = _skip_value(buf, idx)
+        return LazyJSON(origin[0], idx, end, origin[1]), end
+    if isinstance(schema, dict) and first == b'{':
+        return _load_object(buf, idx, origin, schema)
+    if isinstance(schema, list) and first == b'[':
+        return _load_array(buf, idx, origin, schema[0])
+    end = _skip_value(buf, idx)
+    return json.loads(buf[idx:end]), end
+
+def _load_object(buf, idx, origin, schema):
+    obj = {}
+    idx = _skip_whitespace(buf, idx+1)
+    if buf[idx:idx+1] == b'}':
+        return obj, idx+1
+    while True:
+        if buf[idx:idx+1] != b'"':
+            raise _error(idx, 'property name')
+        end = _skip_string(buf, idx)
+        key = json.loads(buf[idx:end])
+        idx = _skip_whitespace(buf, end)
+        if buf[idx:idx+1] != b':':
+            raise _error(idx, "':'")
+        idx = _skip_whitespace(buf, idx+1)
+        obj[key], idx = _load_value(buf, idx, origin, schema.get(key))
+        idx = _skip_whitespace(buf, idx)
+        delimiter = buf[idx:idx+1]
+        if delimiter == b'}':
+            return obj, idx+1
+        if delimiter != b',':
+            raise _error(idx, "',' or '}'")
+        idx = _skip_whitespace(buf, idx+1)
+
+def _load_array(buf, idx, origin, schema):
+    array = []
+    idx = _skip_whitespace(buf, idx+1)
+    if buf[idx:idx+1] == b']':
+        return array, idx+1
+    while True:
+        value, idx = _load_value(buf, idx, origin, schema)
+        array.append(value)
+        idx = _skip_whitespace(buf, idx)
+        delimiter = buf[idx:idx+1]
+        if delimiter == b']':
+            return array, idx+1
+        if delimiter != b',':
+            raise _error(idx, "',' or ']'")
+        idx = _skip_whitespace(buf, idx+1)
+
+def load_notebook(path):
+    '''
+    Notebook JSON as json.load, except for outputs and attachments of cells, which are LazyJSON
+    '''
+    path = os.path.abspath(path) # lazy values may be decoded after changing the working directory
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            raise _error(0, 'value')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            idx = _skip_whitespace(buf, 3 if buf[:3] == b'\xef\xbb\xbf' else 0)
+            origin = (path, (stat.st_size, stat.st_mtime_ns)) # file of LazyJSON values and its stamp
+            content, idx = _load_value(buf, idx, origin, _NOTEBOOK_SCHEMA)
+            if _skip_whitespace(buf, idx) != len(buf):
+                raise _error(idx, 'end of file')
+    return content
+
+def decode_lazy_values(content):
+    '''
+    Copy of a loaded notebook where every LazyJSON is decoded, as loaded by json.load
+    '''
+    files = {}
+    def decode(value):
+        if isinstance(value, LazyJSON):
+            if value.path not in files:
+                files[value.path] = open(value.path, 'rb')
+            return value.decode(files[value.path])
+        if isinstance(value, dict):
+            return {key: decode(item) for (key, item) in value.items()}
+        if isinstance(value, list):
+            return [decode(item) for item in value]
+        return value
+    try:
+        return decode(content)
+    finally:
+        for f in files.values():
+            f.close()
+
+def get_file_hash(path):
+    '''
+    sha1 of the file content, read in chunks
+    '''
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
@@ -1,6 +1,8 @@
 import ast
+import json
 
-from .dependency_graph_utils import get_code_list
+from .notebook_index import NotebookIndex
+from .dependency_graph_utils import get_api_ref_id, merge_api_ref_entries
 from .func_calls_visitor import get_func_calls
 
 whitelist = {
@@ -23,30 +25,98 @@ def match_api(func_call_name, api_name):
             return False
     return True
 
-def match_whitelist(name):
-    for api_name in whitelist.keys():
-        if match_api(name, api_name):
-            return whitelist[api_name]
-    return None
-
-def get_api_ref_id(tree):
-    id2fullname  = {}  # key is the imported module while the value is the prefix
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Import) :
-            items = [nn.__dict__ for nn in node.names]
-            for d in items:
-                if d['asname'] is None:
-                    id2fullname[d['name']] = d['name']
-                else:
-                    id2fullname[d['asname']] = d['name']
-        if isinstance(node, ast.ImportFrom):
-            items = [nn.__dict__ for nn in node.names]
-            for d in items:
-                if d['asname'] is None:
-                    id2fullname[d['name']] = node.module+'.'+d['name']
-                else:
-                    id2fullname[d['asname']] = node.module+'.'+d['name']
-    return id2fullname
+class APIPatternIndex():
+    '''
+    Whitelist rules {dotted API pattern: fix statement} compiled into a prefix trie over name parts, where
+    '*' matches any part. A name matches a pattern as in match_api, and the fix of the first matching rule (in
+    the order rules were added) is returned, so matching does not depend on the number of rules.
+    '''
+
+    def __init__(self, rules=None):
+        self._root = self._new_node()
+        self._fixes = [] # fixes in the order of rules
+        self._patterns = set()
+        if rules is not None:
+            self.update(rules)
+
+    @staticmethod
+    def _new_node():
+        # children, rank of the rule ending at the node, lowest rank of rules ending at or below the node
+        return [{}, None, None]
+
+    def __len__(self):
+        return len(self._fixes)
+
+    def add(self, pattern, fix):
+        if pattern in self._patterns:
+            return # an earlier rule of the same pattern always wins
+        self._patterns.add(pattern)
+        rank = len(self._fixes)
+        self._fixes.append(fix)
+
+        node = self._root
+        for part in pattern.split('.'):
+            node = node[0].setdefault(part, self._new_node())
+            if node[2] is None:
+                node[2] = rank
+        if node[1] is None:
+            node[1] = rank
+
+    def update(self, rules):
+        for (pattern, fix) in rules.items():
+            self.add(pattern, fix)
+
+    def match(self, name):
+        '''
+        Fix of the first rule matching name, None if no rule matches
+        '''
+        best_rank = None
+        nodes = [self._root]
+        for part in name.split('.'):
+            next_nodes = []
+            for node in nodes:
+                # patterns shorter than name
+                if node[1] is not None and (best_rank is None or node[1] < best_rank):
+                    best_rank = node[1]
+                for key in (part, '*'):
+                    child = node[0].get(key)
+                    if child is not None and (best_rank is None or child[2] < best_rank):
+                        next_nodes.append(child)
+            nodes = next_nodes
+            if len(nodes) == 0:
+                break
+        # patterns at least as long as name
+        for node in nodes:
+            if best_rank is None or node[2] < best_rank:
+                best_rank = node[2]
+        return self._fixes[best_rank] if best_rank is not None else None
+
+def load_rules(path):
+    '''
+    Whitelist rules of a JSON file: an object {dotted API pattern: fix statement}, in order of priority
+    '''
+    with open(path, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+    if not isinstance(rules, dict) or not all(isinstance(fix, str) for fix in rules.values()):
+        raise ValueError('{} is not an object of API patterns to fix statements'.format(path))
+    return rules
+
+def compile_rules(rule_files=(), include_default=True):
+    '''
+    APIPatternIndex of the default whitelist followed by the rules of the given files
+    '''
+    index = APIPatternIndex(whitelist if include_default else None)
+    for path in rule_files:
+        index.update(load_rules(path))
+    return index
+
+default_rules = APIPatternIndex(whitelist)
+
+def match_whitelist(name, rules=None):
+    '''
+    rules: APIPatternIndex, default as the whitelist
+    '''
+    return (default_rules if rules is None else rules).match(name)
 
 def func_call_format(func_call_names, id2fullname):
     result = []
@@ -57,25 +127,29 @@ def func_call_format(func_call_names, id2fullname):
             result += [full_name.rstrip('.')]
     return result
 
-def detect(filename):
-    code_list = get_code_list(filename)
-    code = "\n".join(code_list)
-    try:
-        whole_tree = ast.parse(code)
-    except (SyntaxError,):  # to avoid non-python code
+def detect(filename, index=None, rules=None, matched_fixes=None):
+    '''
+    index        : NotebookIndex of the notebook, whose cell records are reused if given
+    rules        : APIPatternIndex of whitelist rules, default as the whitelist
+    matched_fixes: dict memoising match_whitelist of function call names, e.g. shared by notebooks
+    '''
+    index = NotebookIndex(filename) if index is None else index
+    matched_fixes = {} if matched_fixes is None else matched_fixes
+    records = index.get_cell_records()
+    if any(record['syntax_error'] for record in records):  # to avoid non-python code
         return (False, 'SyntaxError')
-    id2fullname = get_api_ref_id(whole_tree)
+    # imports of all cells, as if the concatenated cells were walked
+    id2fullname = merge_api_ref_entries([record['api_refs'] for record in records])
     suspected_func_fullnames = set()
     required_call_names = set()
-    for code in code_list:
-        tree = ast.parse(code, mode='exec')
-        cell_func_calls_names = get_func_calls(tree, extended=True)
-        cell_func_calls_names = [tmp[0] for tmp in cell_func_calls_names]
-        cell_func_calls_names = func_call_format(cell_func_calls_names, id2fullname)
+    for record in records:
+        cell_func_calls_names = func_call_format(record['func_calls'], id2fullname)
         # all relevant function calls
         suspected_func_fullnames.update(cell_func_calls_names)
         for name in cell_func_calls_names:
-            res = match_whitelist(name)
+            if name not in matched_fixes:
+                matched_fixes[name] = match_whitelist(name, rules)
+            res = matched_fixes[name]
             if res is not None:
                 required_call_names.add(res)
     for candidate in required_call_names:
@@ -83,6 +157,24 @@ def detect(filename):
             return (False, 'inadvisable usage')
     return (True, 'ok')
 
+def detect_many(filenames, rules=None, cell_cache=None):
+    '''
+    detect for every notebook of filenames, returned in the same order. The compiled rules and the matches
+    of function call names are shared by notebooks, as well as static analyses of cells if cell_cache is given.
+    Notebooks which cannot be loaded are reported as (False, error type).
+    '''
+    rules = default_rules if rules is None else rules
+    matched_fixes = {}
+    results = []
+    for filename in filenames:
+        try:
+            index = NotebookIndex(filename, cell_cache)
+        except (OSError, ValueError) as e:
+            results.append((False, type(e).__name__))
+            continue
+        results.append(detect(filename, index, rules, matched_fixes))
+    return results
+
 def is_impeded(smt, import_smts):
     try:
         code = "\n".join(import_smts)
@@ -1,4 +1,10 @@
 from .execute_preprocessors import OECPreprocessor
 from .execute_preprocessors import SelfReproducibilityCheckPreprocessor
+from .execute_preprocessors import SnapshotReproducibilityCheckPreprocessor
 from .execute_preprocessors import StatusInspectionPreprocessor
 from .execute_preprocessors import DependencyPreprocessor
+from .execute_preprocessors import PrefixTreePreprocessor
+from .kernel_pool import KernelPool
+from .kernel_manager import ReportingKernelManager, set_kernel_start_listener
+from .budget import BudgetedExecutePreprocessor, ExecutionBudget, CellTimeoutError
+from .streaming import StreamingComparison, PairedComparison, OutputMismatchError
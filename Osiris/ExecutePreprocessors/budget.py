@@ -0,0 +1,181 @@
+from __future__ import absolute_import
+import nbformat
+from datetime import datetime
+from time import monotonic
+from nbconvert.preprocessors import ExecutePreprocessor
+
+from ..profiler import span
+
+'''
+Execution budgets. A cell is granted a wall-clock timeout, either fixed or derived from the duration recorded
+in its timing metadata, and the whole notebook may be granted a wall-clock budget as well. Memory and CPU caps
+are applied to the kernel process itself through rlimits, before the first cell is executed.
+'''
+
+# Applied in the kernel. The CPU cap counts from the time the limits are applied, so that a pooled kernel
+# is not charged for previous leases. Soft limits never exceed the hard ones, which cannot be raised back.
+LIMIT_KERNEL_STR = """try:
+    import resource as _osiris_resource
+except ImportError:
+    _osiris_resource = None
+if _osiris_resource is not None:
+    def _osiris_set_soft_limit(kind, limit):
+        soft, hard = _osiris_resource.getrlimit(kind)
+        if hard != _osiris_resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        _osiris_resource.setrlimit(kind, (limit, hard))
+    if {memory_limit!r} is not None:
+        _osiris_set_soft_limit(_osiris_resource.RLIMIT_AS, {memory_limit!r})
+    if {cpu_limit!r} is not None:
+        _osiris_usage = _osiris_resource.getrusage(_osiris_resource.RUSAGE_SELF)
+        _osiris_set_soft_limit(_osiris_resource.RLIMIT_CPU, int(_osiris_usage.ru_utime+_osiris_usage.ru_stime)+{cpu_limit!r})
+        del _osiris_usage
+    del _osiris_set_soft_limit
+del _osiris_resource"""
+
+def _parse_timestamp(timestamp):
+    try:
+        return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def get_recorded_cell_duration(cell):
+    '''
+    Duration in seconds of the last execution of the cell, as recorded by JupyterLab (metadata.execution) or
+    by the ExecuteTime nbextension (metadata.ExecuteTime), None if the cell has no timing metadata
+    '''
+    metadata = cell.get('metadata', {})
+    execution = metadata.get('execution', {})
+    execute_time = metadata.get('ExecuteTime', {})
+    for (start, end) in [(execution.get('iopub.execute_input'), execution.get('shell.execute_reply')),
+                         (execute_time.get('start_time'), execute_time.get('end_time'))]:
+        start, end = _parse_timestamp(start), _parse_timestamp(end)
+        if start is None or end is None or (start.tzinfo is None) != (end.tzinfo is None):
+            continue
+        duration = (end-start).total_seconds()
+        if duration >= 0:
+            return duration
+    return None
+
+
+class ExecutionBudget():
+    '''
+    cell_timeout     : wall-clock limit in seconds of a cell, None for no limit
+    timing_factor    : if given, a cell with recorded timing metadata is granted this multiple of its recorded
+                       duration instead of cell_timeout, but at least min_cell_timeout
+    notebook_timeout : wall-clock limit in seconds of an execution of the whole notebook, None for no limit
+    memory_limit     : address space limit in MB of the kernel, None for no limit
+    cpu_limit        : CPU time limit in seconds of the kernel, None for no limit. The kernel is killed by the
+                       system when it is exceeded.
+    '''
+
+    def __init__(self, cell_timeout=30, timing_factor=None, min_cell_timeout=10, notebook_timeout=None, memory_limit=None, cpu_limit=None):
+        self.cell_timeout = cell_timeout
+        self.timing_factor = timing_factor
+        self.min_cell_timeout = min_cell_timeout
+        self.notebook_timeout = notebook_timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+
+    def get_cell_timeout(self, cell):
+        if self.timing_factor is not None and cell is not None:
+            duration = get_recorded_cell_duration(cell)
+            if duration is not None:
+                return max(self.timing_factor*duration, self.min_cell_timeout or 0)
+        return self.cell_timeout
+
+    def get_parameters(self):
+        # Every setting which may change analytical results, e.g. for keys of cached results
+        return {'cell_timeout': self.cell_timeout, 'timing_factor': self.timing_factor, 'min_cell_timeout': self.min_cell_timeout,
+                'notebook_timeout': self.notebook_timeout, 'memory_limit': self.memory_limit, 'cpu_limit': self.cpu_limit}
+
+    def get_kernel_limits_code(self):
+        if self.memory_limit is None and self.cpu_limit is None:
+            return None
+        memory_limit = None if self.memory_limit is None else int(self.memory_limit*1024*1024)
+        cpu_limit = None if self.cpu_limit is None else max(int(self.cpu_limit), 1)
+        return LIMIT_KERNEL_STR.format(memory_limit=memory_limit, cpu_limit=cpu_limit)
+
+
+class CellTimeoutError(TimeoutError):
+    '''
+    cell_index : index of the cell in the executed notebook
+    timeout    : seconds granted to the cell when it was executed
+    budget     : 'cell' if the cell exceeded its own timeout, 'notebook' if it exhausted the notebook budget
+    '''
+
+    def __init__(self, cell_index, timeout, budget):
+        super(CellTimeoutError, self).__init__('Timed out at cell {} after {:g}s ({} budget)'.format(cell_index, timeout, budget))
+        self.cell_index = cell_index
+        self.timeout = timeout
+        self.budget = budget
+
+
+class BudgetedExecutePreprocessor(ExecutePreprocessor):
+    '''
+    ExecutePreprocessor which follows an ExecutionBudget, if one is assigned to budget. On timeout the kernel
+    is interrupted, so that a leased kernel can be reset, and a CellTimeoutError is raised.
+    If a StreamingComparison is assigned to comparison, every cell is compared with it once executed.
+    '''
+
+    budget = None
+    comparison = None
+
+    def preprocess(self, nb, resources=None, km=None):
+        self._deadline = None
+        if self.budget is not None and self.budget.notebook_timeout is not None:
+            self._deadline = monotonic()+self.budget.notebook_timeout
+        self._are_limits_applied = False
+        self._current_cell_index = None
+        self._timeout_budget = 'cell'
+        return super(BudgetedExecutePreprocessor, self).preprocess(nb, resources, km=km)
+
+    def start_new_kernel(self, **kwargs):
+        with span('start kernel', category='kernel') as s:
+            km, kc = super(BudgetedExecutePreprocessor, self).start_new_kernel(**kwargs)
+            s.set(kernel_name=self.kernel_name)
+        return km, kc
+
+    def preprocess_cell(self, cell, resources, cell_index, store_history=True):
+        if self.budget is not None and not self._are_limits_applied:
+            self._are_limits_applied = True
+            limits_code = self.budget.get_kernel_limits_code()
+            if limits_code is not None:
+                self.run_cell(nbformat.v4.new_code_cell(limits_code), cell_index, store_history=False)
+        with span('execute cell', category='execution', preprocessor=type(self).__name__, cell_index=cell_index, source_bytes=len(cell.source)) as s:
+            cell, resources = super(BudgetedExecutePreprocessor, self).preprocess_cell(cell, resources, cell_index, store_history)
+            s.set(outputs=len(cell.get('outputs', [])))
+        if self.comparison is not None:
+            with span('compare cell', category='comparison', cell_index=cell_index):
+                self.comparison.compare(cell_index, cell)
+        return cell, resources
+
+    def run_cell(self, cell, cell_index=0, store_history=True):
+        self._current_cell_index = cell_index
+        return super(BudgetedExecutePreprocessor, self).run_cell(cell, cell_index, store_history)
+
+    def _get_cell_timeout(self, cell):
+        if self.budget is None:
+            return super(BudgetedExecutePreprocessor, self)._get_timeout(cell)
+        return self.budget.get_cell_timeout(cell)
+
+    def _get_timeout(self, cell):
+        timeout = self._get_cell_timeout(cell)
+        if timeout is not None and timeout <= 0:
+            timeout = None
+        self._timeout_budget = 'cell'
+        if getattr(self, '_deadline', None) is not None:
+            remaining = max(self._deadline-monotonic(), 1e-3) # 0 would mean no timeout
+            if timeout is None or remaining < timeout:
+                timeout, self._timeout_budget = remaining, 'notebook'
+        self._granted_timeout = timeout
+        return timeout
+
+    def _handle_timeout(self):
+        if self.budget is None:
+            return super(BudgetedExecutePreprocessor, self)._handle_timeout()
+        try:
+            self.km.interrupt_kernel()
+        except Exception:
+            pass
+        raise CellTimeoutError(self._current_cell_index, self._granted_timeout, self._timeout_budget)
@@ -1,14 +1,202 @@
 from __future__ import absolute_import
+import nbformat
 from nbconvert.preprocessors import ExecutePreprocessor
-
-EXTRACT_FUNC_STR = "def extractVars():\n    variables_set = {}\n    tmp = globals().copy()\n    for k, v in tmp.items():\n        con_1 = not k.startswith('_')\n        con_2 = not k in ['In', 'Out', 'get_ipython', 'exit', 'quit']\n        con_3 = type(v) in [int, complex, bool, float, str, list, set, dict, tuple]\n        con_4 = not('<' in str(v) and '>' in str(v) and 'at' in str(v))\n        if con_1 and con_2 and con_4:\n            variables_set[k] = v\n    \n    return variables_set"
-
-class OECPreprocessor(ExecutePreprocessor):
+from .budget import BudgetedExecutePreprocessor
+
+# Status inspection function injected into the kernel. extractVars() returns a compact {name: digest} map of
+# self-defined variables: numpy arrays and pandas objects are hashed at buffer level, any other value is hashed
+# from its IPython pretty() form, which sorts the elements of sets and frozensets so that digests do not depend on
+# the hash seed of each kernel. Values which look like an object address are skipped as they never reproduce.
+STATE_HASH_FUNC_STR = """def extractVars():
+    import sys, hashlib
+    from IPython.lib.pretty import pretty
+    np, pd = sys.modules.get('numpy'), sys.modules.get('pandas')
+    def digest(v):
+        h = hashlib.sha1(type(v).__name__.encode())
+        if (np is not None) and isinstance(v, np.ndarray):
+            h.update(repr((v.dtype.str, v.shape)).encode())
+            if v.dtype.hasobject:
+                h.update(repr(v.tolist()).encode('utf-8', 'backslashreplace'))
+            else:
+                h.update(np.ascontiguousarray(v).view(np.uint8).data)
+            return h.hexdigest()
+        if (pd is not None) and isinstance(v, (pd.DataFrame, pd.Series, pd.Index)):
+            h.update(repr((list(getattr(v, 'columns', [])), str(v.dtypes if isinstance(v, pd.DataFrame) else v.dtype), v.shape)).encode('utf-8', 'backslashreplace'))
+            try:
+                h.update(pd.util.hash_pandas_object(v).values.tobytes())
+            except TypeError:  # unhashable values such as lists inside cells
+                h.update(repr(v.values.tolist()).encode('utf-8', 'backslashreplace'))
+            return h.hexdigest()
+        s = pretty(v)
+        if '<' in s and '>' in s and 'at' in s:
+            return None
+        h.update(s.encode('utf-8', 'backslashreplace'))
+        return h.hexdigest()
+    variables_set = {}
+    for k, v in list(globals().items()):
+        if k.startswith('_') or k in ['In', 'Out', 'get_ipython', 'exit', 'quit']:
+            continue
+        d = digest(v)
+        if d is not None:
+            variables_set[k] = d
+    return variables_set"""
+
+# Mime type used by kernel-side helpers to hand structured results back to Osiris
+OSIRIS_MIME_TYPE = 'application/x-osiris+json'
+
+# Forks the kernel into a copy-on-write snapshot of the current state, executes a cell once and twice in the
+# child and reports the status of variables after each execution. The child must neither talk to the frontend
+# nor touch the parent's sockets, so its output and displays are swallowed.
+FORK_FUNC_STR = """def _osiris_fork_check(source):
+    import os, sys, io, json
+    from IPython.display import display
+    if not hasattr(os, 'fork'):
+        display({'application/x-osiris+json': {'unsupported': True}}, raw=True)
+        return
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        result = {}
+        try:
+            sys.stdout = sys.stderr = io.StringIO()
+            shell = get_ipython()
+            shell.display_pub.publish = lambda *args, **kwargs: None
+            code = compile(shell.transform_cell(source), '<osiris-snapshot>', 'exec')
+            exec(code, shell.user_ns)
+            result['once'] = extractVars()
+            exec(code, shell.user_ns)
+            result['twice'] = extractVars()
+        except BaseException as e:
+            result['error'] = repr(e)
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(result, f)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        result = json.load(f)
+    os.waitpid(pid, 0)
+    display({'application/x-osiris+json': result}, raw=True)"""
+
+# Executes a cell with the status of variables recorded before the cell and after every top-level statement.
+# Statements are located on the AST of the cell, so compound statements (if/for/with/def...) are recorded
+# once they complete, wherever they start and end.
+TRACE_FUNC_STR = """def _osiris_trace_cell(source):
+    import ast
+    from IPython.display import display
+    shell = get_ipython()
+    trace = [[-1, None, extractVars()]]
+    def record(start_line, end_line):
+        trace.append([start_line, end_line, extractVars()])
+    shell.user_ns['_osiris_trace_record'] = record
+    try:
+        tree = ast.parse(shell.transform_cell(source))
+        instrumented_body = []
+        for node in tree.body:
+            end_lineno = getattr(node, 'end_lineno', node.lineno)
+            instrumented_body.append(node)
+            instrumented_body.append(ast.parse('_osiris_trace_record({}, {})'.format(node.lineno-1, end_lineno-1)).body[0])
+        tree.body = instrumented_body
+        exec(compile(tree, '<osiris-trace>', 'exec'), shell.user_ns)
+    finally:
+        del shell.user_ns['_osiris_trace_record']
+        display({'application/x-osiris+json': trace}, raw=True)"""
+
+
+# Executes a prefix trie of execution orders depth-first, so that a prefix shared by several orders is executed
+# only once. At a branch point, every child but the last one runs in a forked copy-on-write snapshot of the kernel,
+# the last child carries on in the kernel itself. Outputs (streams, displays, results and errors) of every trie
+# node are captured instead of being sent to the frontend, and are displayed at the end as {node id: [outputs, ok]}.
+TRIE_FUNC_STR = """def _osiris_run_trie(sources, trie):
+    import os, sys, json
+    from IPython.display import display
+    if not hasattr(os, 'fork'):
+        display({'application/x-osiris+json': {'unsupported': True}}, raw=True)
+        return
+    shell = get_ipython()
+    results = {}
+    current = {'outputs': []}
+
+    class Stream(object):
+        def __init__(self, name):
+            self.name = name
+        def write(self, text):
+            outputs = current['outputs']
+            if len(outputs) > 0 and outputs[-1].get('name') == self.name:
+                outputs[-1]['text'] += text
+            else:
+                outputs.append({'output_type': 'stream', 'name': self.name, 'text': text})
+            return len(text)
+        def flush(self):
+            pass
+        def isatty(self):
+            return False
+
+    def publish(data, metadata=None, *args, **kwargs):
+        current['outputs'].append({'output_type': 'display_data', 'data': data, 'metadata': metadata or {}})
+
+    def displayhook(value):
+        if value is None or current['quiet']:
+            return
+        data, metadata = shell.display_formatter.format(value)
+        current['outputs'].append({'output_type': 'execute_result', 'data': data, 'metadata': metadata, 'execution_count': None})
+
+    def showtraceback(etype, evalue, stb):
+        current['outputs'].append({'output_type': 'error', 'ename': getattr(etype, '__name__', str(etype)), 'evalue': str(evalue), 'traceback': stb})
+
+    def run_node(node):
+        node_id, cell_index, children = node
+        current['outputs'] = []
+        current['quiet'] = sources[cell_index].rstrip().endswith(';')
+        try:
+            ok = shell.run_cell(sources[cell_index], store_history=False).success
+        except BaseException as e:
+            showtraceback(type(e), e, [])
+            ok = False
+        results[str(node_id)] = [current['outputs'], ok]
+        if ok:
+            run_children(children)
+
+    def run_children(children):
+        for (idx, child) in enumerate(children):
+            if idx == len(children)-1:
+                run_node(child)
+                continue
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                try:
+                    results.clear()
+                    run_node(child)
+                    with os.fdopen(write_fd, 'w') as f:
+                        json.dump(results, f)
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            with os.fdopen(read_fd) as f:
+                try:
+                    results.update(json.load(f))
+                except ValueError:
+                    pass # the snapshot crashed, its nodes are left without results
+            os.waitpid(pid, 0)
+
+    saved = (sys.stdout, sys.stderr, sys.displayhook, shell.display_pub.publish, shell._showtraceback)
+    sys.stdout, sys.stderr, sys.displayhook = Stream('stdout'), Stream('stderr'), displayhook
+    shell.display_pub.publish, shell._showtraceback = publish, showtraceback
+    try:
+        run_children(trie)
+    finally:
+        sys.stdout, sys.stderr, sys.displayhook = saved[0], saved[1], saved[2]
+        shell.display_pub.publish, shell._showtraceback = saved[3], saved[4]
+    display({'application/x-osiris+json': results}, raw=True)"""
+
+class OECPreprocessor(BudgetedExecutePreprocessor):
 
     def __init__(self):
         super(ExecutePreprocessor, self).__init__()
 
-    def preprocess(self, nb, resources):
+    def preprocess(self, nb, resources, km=None):
         copy_nb_cells = nb.cells
 
         execution_count_lst = [cell.execution_count for cell in copy_nb_cells]
@@ -19,25 +207,114 @@ class OECPreprocessor(ExecutePreprocessor):
             parsed_nb_cells[0].source = "import warnings\nwarnings.filterwarnings('ignore')\n" + parsed_nb_cells[0].source
 
         nb.cells = parsed_nb_cells
-        return super(OECPreprocessor, self).preprocess(nb, resources)
+        return super(OECPreprocessor, self).preprocess(nb, resources, km=km)
 
 
-class DependencyPreprocessor(ExecutePreprocessor):
+class DependencyPreprocessor(BudgetedExecutePreprocessor):
     def __init__(self, execution_order):
         super(ExecutePreprocessor, self).__init__()
         self._execution_order = execution_order
 
-    def preprocess(self, nb, resources):
+    def preprocess(self, nb, resources, km=None):
         copy_nb_cells = nb.cells
 
         parsed_nb_cells = [copy_nb_cells[idx] for idx in self._execution_order]
         parsed_nb_cells[0].source = "import warnings\nwarnings.filterwarnings('ignore')\n" + parsed_nb_cells[0].source
 
         nb.cells = parsed_nb_cells
-        return super(DependencyPreprocessor, self).preprocess(nb, resources)
+        return super(DependencyPreprocessor, self).preprocess(nb, resources, km=km)
 
 
-class SelfReproducibilityCheckPreprocessor(ExecutePreprocessor):
+class PrefixTreePreprocessor(BudgetedExecutePreprocessor):
+    '''
+    Executes several execution orders (lists of cell indices, e.g. normal, OEC or dependency orders) of the same
+    notebook in a single kernel. Orders are built into a prefix trie, which is executed depth-first in the kernel
+    with a fork at every branch point, so a prefix shared by several orders is executed only once.
+    Note that warnings are filtered for all orders, as in the OEC and dependency strategies. Executed cells carry
+    their source and are numbered in the order of execution.
+    '''
+
+    def __init__(self, execution_orders):
+        super(ExecutePreprocessor, self).__init__()
+        self.execution_orders = execution_orders
+        self.is_supported = True
+        self._sources = []
+        self._trie = []
+        self._paths = [] # node ids along each execution order
+        self._num_of_nodes = 0
+        self._node_results = {}
+
+    def _build_trie(self):
+        self._trie, self._paths, self._num_of_nodes = [], [], 0
+        for execution_order in self.execution_orders:
+            children, path = self._trie, []
+            for cell_index in execution_order:
+                node = next((child for child in children if child[1] == cell_index), None)
+                if node is None:
+                    node = [self._num_of_nodes, cell_index, []]
+                    self._num_of_nodes += 1
+                    children.append(node)
+                path.append(node[0])
+                children = node[2]
+            self._paths.append(path)
+
+    def _get_cell_timeout(self, cell):
+        # The whole trie is executed within a single cell, each node is granted the timeout of a cell
+        timeout = super(PrefixTreePreprocessor, self)._get_cell_timeout(cell)
+        return None if timeout is None else timeout * max(self._num_of_nodes, 1)
+
+    def preprocess(self, nb, resources, km=None):
+        self._build_trie()
+        sources = self._sources = [cell.source for cell in nb.cells]
+
+        helper_cell = nbformat.v4.new_code_cell("import warnings\nwarnings.filterwarnings('ignore')\n" + TRIE_FUNC_STR)
+        trie_cell = nbformat.v4.new_code_cell("_osiris_run_trie({sources!r}, {trie!r})".format(sources=sources, trie=self._trie))
+        nb.cells = [helper_cell, trie_cell]
+        nb, resources = super(PrefixTreePreprocessor, self).preprocess(nb, resources, km=km)
+
+        self._node_results = {}
+        for output in nb.cells[1].outputs:
+            if output.output_type == 'display_data' and OSIRIS_MIME_TYPE in output.data:
+                self._node_results = output.data[OSIRIS_MIME_TYPE]
+        self.is_supported = 'unsupported' not in self._node_results
+        return nb, resources
+
+    def get_executed_cells(self):
+        '''
+        Returns, for each execution order, the executed cells in the order of execution, or None if the
+        execution order is not executable
+        '''
+        executed_cells_of_orders = []
+        for (execution_order, path) in zip(self.execution_orders, self._paths):
+            executed_cells = []
+            for (cell_index, node_id) in zip(execution_order, path):
+                result = self._node_results.get(str(node_id))
+                if result is None or not result[1]:
+                    executed_cells = None
+                    break
+                outputs = [nbformat.from_dict(output) for output in result[0]]
+                executed_cells.append(nbformat.v4.new_code_cell(self._sources[cell_index], execution_count=len(executed_cells)+1, outputs=outputs))
+            executed_cells_of_orders.append(executed_cells)
+        return executed_cells_of_orders
+
+    def get_errors(self):
+        # Returns, for each execution order, the error raised by the first failing cell, or None
+        errors = []
+        for path in self._paths:
+            error = None
+            for node_id in path:
+                result = self._node_results.get(str(node_id))
+                if result is None:
+                    error = 'The snapshot executing this execution order crashed'
+                    break
+                if not result[1]:
+                    error_outputs = [output for output in result[0] if output['output_type'] == 'error']
+                    error = '{}: {}'.format(error_outputs[0]['ename'], error_outputs[0]['evalue']) if len(error_outputs) > 0 else 'Failed to execute a cell'
+                    break
+            errors.append(error)
+        return errors
+
+class SelfReproducibilityCheckPreprocessor(BudgetedExecutePreprocessor):
 
     def __init__(self, check_cell_idx, analyse_strategy, is_duplicate):
         super(ExecutePreprocessor, self).__init__()
@@ -49,7 +326,7 @@ class SelfReproducibilityCheckPreprocessor(ExecutePreprocessor):
     def set_execution_order(self, execution_order):
         self.execution_order = execution_order
 
-    def preprocess(self, nb, resources):
+    def preprocess(self, nb, resources, km=None):
         copy_nb_cells = nb.cells
 
         # Adjust the order of cells for different analyse strategies 
@@ -65,7 +342,7 @@ class SelfReproducibilityCheckPreprocessor(ExecutePreprocessor):
 
         # Insert an function at the beginning of the notebook to inspect the status 
         var_extract_fun_cell = parsed_nb_cells[0].copy()
-        var_extract_fun_cell.source = EXTRACT_FUNC_STR
+        var_extract_fun_cell.source = STATE_HASH_FUNC_STR
         parsed_nb_cells.insert(0, var_extract_fun_cell)
 
         # Modify source code of cells to monitor status of self-defined variables 
@@ -81,16 +358,71 @@ class SelfReproducibilityCheckPreprocessor(ExecutePreprocessor):
             parsed_nb_cells[0].source = "import warnings\nwarnings.filterwarnings('ignore')\n" + parsed_nb_cells[0].source
             nb.cells = parsed_nb_cells[:self.check_cell_idx+1]
 
-        return super(SelfReproducibilityCheckPreprocessor, self).preprocess(nb, resources)
+        return super(SelfReproducibilityCheckPreprocessor, self).preprocess(nb, resources, km=km)
+
+
+class SnapshotReproducibilityCheckPreprocessor(BudgetedExecutePreprocessor):
+    '''
+    Executes the notebook once. Before each cell, the kernel is forked and the cell is executed once and twice
+    in the forked snapshot, so self-reproducibility of every cell is checked within a single run.
+    '''
+
+    def __init__(self, analyse_strategy):
+        super(ExecutePreprocessor, self).__init__()
+        self.analyse_strategy = analyse_strategy
+        self.execution_order = None
+        self.snapshot_results = []
+
+    def set_execution_order(self, execution_order):
+        self.execution_order = execution_order
 
+    def preprocess(self, nb, resources, km=None):
+        copy_nb_cells = nb.cells
 
-class StatusInspectionPreprocessor(ExecutePreprocessor):
+        # Adjust the order of cells for different analyse strategies
+        if self.analyse_strategy == 'normal':
+            parsed_nb_cells = copy_nb_cells.copy()
+        elif self.analyse_strategy == 'OEC':
+            execution_count_lst = [cell.execution_count for cell in copy_nb_cells]
+            OEO = sorted(range(len(execution_count_lst)),
+                        key=lambda k: execution_count_lst[k])
+            parsed_nb_cells = [copy_nb_cells[idx] for idx in OEO]
+        else: # dependency
+            parsed_nb_cells = [copy_nb_cells[idx] for idx in self.execution_order]
+
+        # Insert the status inspection and fork functions at the beginning of the notebook
+        helper_cell = parsed_nb_cells[0].copy()
+        helper_cell.source = STATE_HASH_FUNC_STR + "\n\n" + FORK_FUNC_STR
+        parsed_nb_cells.insert(0, helper_cell)
+        parsed_nb_cells[0].source = "import warnings\nwarnings.filterwarnings('ignore')\n" + parsed_nb_cells[0].source
+
+        nb.cells = parsed_nb_cells
+        self.snapshot_results = [None] * (len(parsed_nb_cells) - 1)
+        return super(SnapshotReproducibilityCheckPreprocessor, self).preprocess(nb, resources, km=km)
+
+    def preprocess_cell(self, cell, resources, cell_index):
+        if cell_index > 0:
+            if cell.source.strip():
+                snapshot_cell = nbformat.v4.new_code_cell("_osiris_fork_check({source!r})".format(source=cell.source))
+                _, outputs = self.run_cell(snapshot_cell, cell_index, store_history=False)
+                for output in outputs:
+                    if output.output_type == 'display_data' and OSIRIS_MIME_TYPE in output.data:
+                        self.snapshot_results[cell_index-1] = output.data[OSIRIS_MIME_TYPE]
+            else:
+                # An empty cell never changes the status of variables
+                self.snapshot_results[cell_index-1] = {'once': '', 'twice': ''}
+
+        return super(SnapshotReproducibilityCheckPreprocessor, self).preprocess_cell(cell, resources, cell_index)
+
+
+class StatusInspectionPreprocessor(BudgetedExecutePreprocessor):
     
     def __init__(self, analyse_strategy, check_cell_idx):
         super(ExecutePreprocessor, self).__init__()
         self.check_cell_idx = check_cell_idx
         self.analyse_strategy = analyse_strategy
         self.execution_order = None
+        self.traced_source = None
         self.whitelist = ['if', 'elif', 'else', 'for', 'while', 'try', 'except', 'finally', 'def', 'with', 'class']
 
     def set_execution_order(self, execution_order):
@@ -113,7 +445,7 @@ class StatusInspectionPreprocessor(ExecutePreprocessor):
 
         # Insert an function at the beginning of the notebook to inspect the status
         var_extract_fun_cell = parsed_nb_cells[0].copy()
-        var_extract_fun_cell.source = EXTRACT_FUNC_STR
+        var_extract_fun_cell.source = STATE_HASH_FUNC_STR
         parsed_nb_cells.insert(0, var_extract_fun_cell)
 
         # Modify source code of cells to monitor status of self-defined variables line by line
@@ -123,7 +455,7 @@ class StatusInspectionPreprocessor(ExecutePreprocessor):
 
         return len(statements)
 
-    def preprocess_for_inspecting_status_of_certain_line(self, nb, resources, target_line_index):
+    def preprocess_for_inspecting_status_of_certain_line(self, nb, resources, target_line_index, km=None):
         copy_nb_cells = nb.cells
 
         # Adjust the order of cells for different analyse strategies 
@@ -141,7 +473,7 @@ class StatusInspectionPreprocessor(ExecutePreprocessor):
 
         # Insert an function at the beginning of the notebook to inspect the status 
         var_extract_fun_cell = parsed_nb_cells[0].copy()
-        var_extract_fun_cell.source = EXTRACT_FUNC_STR
+        var_extract_fun_cell.source = STATE_HASH_FUNC_STR
         parsed_nb_cells.insert(0, var_extract_fun_cell)
 
         # Modify source code of cells to monitor status of self-defined variables line by line 
@@ -175,5 +507,40 @@ class StatusInspectionPreprocessor(ExecutePreprocessor):
         parsed_nb_cells[self.check_cell_idx].source = new_source_code
         parsed_nb_cells[0].source = "import warnings\nwarnings.filterwarnings('ignore')\n" + parsed_nb_cells[0].source
         nb.cells = parsed_nb_cells[:self.check_cell_idx+1]
-        return super(StatusInspectionPreprocessor, self).preprocess(nb, resources)
+        return super(StatusInspectionPreprocessor, self).preprocess(nb, resources, km=km)
+
+    def preprocess_for_tracing_statements(self, nb, resources, km=None):
+        copy_nb_cells = nb.cells
+
+        # Adjust the order of cells for different analyse strategies
+        if self.analyse_strategy == 'normal':
+            parsed_nb_cells = copy_nb_cells.copy()
+        elif self.analyse_strategy == 'OEC':
+            execution_count_lst = [cell.execution_count for cell in copy_nb_cells]
+            OEO = sorted(range(len(execution_count_lst)),
+                        key=lambda k: execution_count_lst[k])
+            parsed_nb_cells = [copy_nb_cells[idx] for idx in OEO]
+        else: # dependency
+            parsed_nb_cells = [copy_nb_cells[idx] for idx in self.execution_order]
+
+        # Insert the status inspection and tracing functions at the beginning of the notebook
+        helper_cell = parsed_nb_cells[0].copy()
+        helper_cell.source = STATE_HASH_FUNC_STR + "\n\n" + TRACE_FUNC_STR
+        parsed_nb_cells.insert(0, helper_cell)
+
+        # Record the status of self-defined variables after every statement of the cell within a single execution
+        traced_cell = parsed_nb_cells[self.check_cell_idx].copy()
+        self.traced_source = traced_cell.source
+        traced_cell.source = "_osiris_trace_cell({source!r})".format(source=traced_cell.source)
+        parsed_nb_cells[self.check_cell_idx] = traced_cell
+        parsed_nb_cells[0].source = "import warnings\nwarnings.filterwarnings('ignore')\n" + parsed_nb_cells[0].source
+        nb.cells = parsed_nb_cells[:self.check_cell_idx+1]
+        return super(StatusInspectionPreprocessor, self).preprocess(nb, resources, km=km)
+
+    def get_statement_trace(self, nb):
+        # The trace is displayed even if the traced cell raises, in which case it stops at the failing statement
+        for output in nb.cells[self.check_cell_idx].outputs:
+            if output.output_type == 'display_data' and OSIRIS_MIME_TYPE in output.data:
+                return output.data[OSIRIS_MIME_TYPE]
+        return None
 
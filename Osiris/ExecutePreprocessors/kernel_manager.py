@@ -0,0 +1,37 @@
+from jupyter_client import KernelManager
+
+'''
+Kernel manager of the kernels started by Osiris. jupyter_client starts every kernel in a session of its own, thus
+outside the process group of the process analysing the notebook, so the pid of every kernel started is handed
+to a listener, e.g. so that the corpus runner can kill the kernels a timed-out job leaves behind.
+'''
+
+_kernel_start_listener = None
+
+def set_kernel_start_listener(listener):
+    '''
+    Call listener(pid) whenever a kernel is started by a ReportingKernelManager. None removes the listener.
+    '''
+    global _kernel_start_listener
+    _kernel_start_listener = listener
+
+def get_kernel_pid(km):
+    # jupyter_client >= 7 launches kernels through a provisioner, older versions keep the Popen as km.kernel
+    provisioner = getattr(km, 'provisioner', None)
+    if getattr(provisioner, 'pid', None) is not None:
+        return provisioner.pid
+    return getattr(getattr(km, 'kernel', None), 'pid', None)
+
+
+class ReportingKernelManager(KernelManager):
+    '''
+    KernelManager which reports the pid of the kernels it starts to the kernel start listener
+    '''
+
+    def start_kernel(self, **kwargs):
+        super(ReportingKernelManager, self).start_kernel(**kwargs)
+        listener = _kernel_start_listener
+        if listener is not None:
+            pid = get_kernel_pid(self)
+            if pid is not None:
+                listener(pid)
@@ -0,0 +1,242 @@
+import os
+import atexit
+import threading
+import collections
+from contextlib import contextmanager
+
+from .kernel_manager import ReportingKernelManager
+
+from ..profiler import span
+
+'''
+Kernel-side snippets. The pool snapshots the interpreter state right after a kernel boots and warms up,
+and restores it every time a kernel is handed back, so that the next notebook sees a clean namespace
+while the modules imported during warm-up stay cached in sys.modules. Modules imported by a notebook are
+removed from sys.modules, so that the next notebook importing them runs (and prints) them again.
+'''
+WARMUP_KERNEL_STR = """import importlib as _osiris_importlib
+_osiris_module = None
+for _osiris_module in {modules!r}:
+    try:
+        _osiris_importlib.import_module(_osiris_module)
+    except Exception:
+        pass
+del _osiris_importlib, _osiris_module"""
+SNAPSHOT_KERNEL_STR = """import sys as _osiris_sys, warnings as _osiris_warnings
+_osiris_snapshot = type(_osiris_sys)('__osiris_pool__')
+_osiris_snapshot.filters = list(_osiris_warnings.filters)
+_osiris_snapshot.path = list(_osiris_sys.path)
+_osiris_snapshot.rc = dict(_osiris_sys.modules['matplotlib'].rcParams) if 'matplotlib' in _osiris_sys.modules else None
+try:
+    import resource as _osiris_resource
+    _osiris_snapshot.rlimits = [(kind, _osiris_resource.getrlimit(kind)[0]) for kind in (_osiris_resource.RLIMIT_AS, _osiris_resource.RLIMIT_CPU)]
+    del _osiris_resource
+except ImportError:
+    _osiris_snapshot.rlimits = []
+_osiris_sys.modules['__osiris_pool__'] = _osiris_snapshot
+_osiris_snapshot.modules = set(_osiris_sys.modules)
+del _osiris_sys, _osiris_warnings, _osiris_snapshot"""
+RESET_KERNEL_STR = """import sys as _osiris_sys, warnings as _osiris_warnings, os as _osiris_os, importlib.machinery as _osiris_machinery
+_osiris_snapshot = _osiris_sys.modules['__osiris_pool__']
+_osiris_modules = [_osiris_name for _osiris_name in list(_osiris_sys.modules) if _osiris_name not in _osiris_snapshot.modules]
+# extension modules imported after the snapshot cannot be imported again, the pool has to recycle this kernel
+assert not any((getattr(_osiris_sys.modules[_osiris_name], '__file__', None) or '').endswith(tuple(_osiris_machinery.EXTENSION_SUFFIXES)) for _osiris_name in _osiris_modules), 'extension modules cannot be reset'
+if 'matplotlib' in _osiris_sys.modules:
+    # matplotlib imported after the snapshot cannot be restored, the pool has to recycle this kernel
+    assert _osiris_snapshot.rc is not None, 'matplotlib state cannot be reset'
+    if 'matplotlib.pyplot' in _osiris_sys.modules:
+        _osiris_sys.modules['matplotlib.pyplot'].close('all')
+    _osiris_sys.modules['matplotlib'].rcParams.update(_osiris_snapshot.rc)
+_osiris_warnings.filters[:] = _osiris_snapshot.filters
+_osiris_sys.path[:] = _osiris_snapshot.path
+for _osiris_name in _osiris_modules:
+    del _osiris_sys.modules[_osiris_name]
+for (_osiris_kind, _osiris_soft) in _osiris_snapshot.rlimits:
+    # soft limits lowered by an execution budget
+    import resource as _osiris_resource
+    _osiris_hard = _osiris_resource.getrlimit(_osiris_kind)[1]
+    if _osiris_hard != _osiris_resource.RLIM_INFINITY and (_osiris_soft == _osiris_resource.RLIM_INFINITY or _osiris_soft > _osiris_hard):
+        _osiris_soft = _osiris_hard
+    _osiris_resource.setrlimit(_osiris_kind, (_osiris_soft, _osiris_hard))
+_osiris_os.chdir({cwd!r})
+get_ipython().reset(new_session=True)"""
+CHDIR_KERNEL_STR = "import os as _osiris_os\n_osiris_os.chdir({cwd!r})\ndel _osiris_os"
+
+# Packages that most notebooks import, so importing them once per kernel hides the cost from every lease
+DEFAULT_WARMUP_MODULES = ['numpy', 'pandas', 'matplotlib', 'matplotlib.pyplot', 'scipy', 'sklearn', 'seaborn']
+
+
+class KernelResetError(RuntimeError):
+    pass
+
+
+class PooledKernelManager(ReportingKernelManager):
+    '''
+    KernelManager which remembers the clients handed out during a lease. nbconvert never stops the
+    channels of a client created from a user-supplied kernel manager, so the pool does it on release.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(PooledKernelManager, self).__init__(*args, **kwargs)
+        self.num_of_uses = 0
+        self._leased_clients = []
+
+    def client(self, **kwargs):
+        kc = super(PooledKernelManager, self).client(**kwargs)
+        self._leased_clients.append(kc)
+        return kc
+
+    def stop_leased_clients(self):
+        for kc in self._leased_clients:
+            try:
+                kc.stop_channels()
+            except Exception:
+                pass
+        self._leased_clients = []
+
+
+class KernelPool():
+    '''
+    A pool of pre-started, pre-warmed kernels keyed by kernelspec name.
+    Osiris maps each python version onto its own kernelspec/environment, so the kernelspec name is
+    also the python version key.
+
+    size         : maximum number of idle kernels kept per kernelspec
+    max_uses     : a kernel is shut down (recycled) after being leased this many times
+    warmup_modules : modules imported once when a kernel boots
+    '''
+
+    def __init__(self, size=2, max_uses=10, warmup_modules=None, startup_timeout=60, reset_timeout=30):
+        assert size >= 1
+        assert max_uses >= 1
+
+        self._size = size
+        self._max_uses = max_uses
+        self._warmup_modules = DEFAULT_WARMUP_MODULES if warmup_modules is None else list(warmup_modules)
+        self._startup_timeout = startup_timeout
+        self._reset_timeout = reset_timeout
+
+        self._idle = collections.defaultdict(collections.deque) # kernel name -> idle kernel managers
+        self._num_of_pending_starts = collections.defaultdict(int)
+        self._lock = threading.Condition()
+        self._is_closed = False
+
+        atexit.register(self.shutdown)
+
+    def prestart(self, kernel_name):
+        # Fill the pool for the given kernelspec in the background
+        with self._lock:
+            num_of_missing = self._size - len(self._idle[kernel_name]) - self._num_of_pending_starts[kernel_name]
+            self._num_of_pending_starts[kernel_name] += max(num_of_missing, 0)
+        for _ in range(num_of_missing):
+            threading.Thread(target=self._start_in_background, args=(kernel_name,), daemon=True).start()
+
+    @contextmanager
+    def lease(self, kernel_name):
+        with span('acquire kernel', category='kernel', kernel_name=kernel_name):
+            km = self._acquire(kernel_name)
+        try:
+            self._run(km, CHDIR_KERNEL_STR.format(cwd=os.getcwd()), self._reset_timeout)
+            yield km
+        finally:
+            with span('release kernel', category='kernel', kernel_name=kernel_name):
+                self._release(kernel_name, km)
+
+    def shutdown(self):
+        with self._lock:
+            self._is_closed = True
+            kernels = [km for idle in self._idle.values() for km in idle]
+            self._idle.clear()
+            self._lock.notify_all()
+
+        for km in kernels:
+            self._shutdown_kernel(km)
+
+    def _acquire(self, kernel_name):
+        with self._lock:
+            if self._is_closed:
+                raise RuntimeError('The kernel pool has been shut down')
+            if len(self._idle[kernel_name]) == 0 and self._num_of_pending_starts[kernel_name] > 0:
+                # A kernel is already booting, waiting for it is cheaper than booting another one
+                self._lock.wait_for(lambda: len(self._idle[kernel_name]) > 0 or self._num_of_pending_starts[kernel_name] == 0)
+            km = self._idle[kernel_name].popleft() if len(self._idle[kernel_name]) > 0 else None
+
+        if km is None:
+            km = self._start_kernel(kernel_name)
+
+        # Keep the pool topped up while this kernel is busy
+        self.prestart(kernel_name)
+        return km
+
+    def _release(self, kernel_name, km):
+        km.stop_leased_clients()
+        km.num_of_uses += 1
+
+        is_recyclable = km.num_of_uses < self._max_uses and km.is_alive()
+        if is_recyclable:
+            try:
+                self._reset_kernel(km)
+            except Exception:
+                is_recyclable = False
+
+        with self._lock:
+            if is_recyclable and (not self._is_closed) and len(self._idle[kernel_name]) < self._size:
+                self._idle[kernel_name].append(km)
+                self._lock.notify_all()
+                return
+
+        self._shutdown_kernel(km)
+        if not self._is_closed:
+            self.prestart(kernel_name)
+
+    def _start_in_background(self, kernel_name):
+        km = None
+        try:
+            km = self._start_kernel(kernel_name)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._num_of_pending_starts[kernel_name] -= 1
+                if (km is not None) and (not self._is_closed):
+                    self._idle[kernel_name].append(km)
+                    km = None
+                self._lock.notify_all()
+
+            # The pool was closed or failed while the kernel was booting
+            if km is not None:
+                self._shutdown_kernel(km)
+
+    def _start_kernel(self, kernel_name):
+        km = PooledKernelManager(kernel_name=kernel_name)
+        km.start_kernel()
+        try:
+            self._run(km, WARMUP_KERNEL_STR.format(modules=self._warmup_modules), self._startup_timeout)
+            self._run(km, SNAPSHOT_KERNEL_STR, self._startup_timeout)
+            self._reset_kernel(km)
+        except Exception:
+            self._shutdown_kernel(km)
+            raise
+        return km
+
+    def _reset_kernel(self, km):
+        self._run(km, RESET_KERNEL_STR.format(cwd=os.getcwd()), self._reset_timeout)
+
+    def _run(self, km, code, timeout):
+        kc = km.blocking_client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=self._startup_timeout)
+            reply = kc.execute_interactive(code, silent=True, store_history=False, timeout=timeout, output_hook=lambda msg: None)
+        finally:
+            kc.stop_channels()
+
+        if reply['content']['status'] != 'ok':
+            raise KernelResetError(reply['content'].get('evalue', 'failed to prepare a pooled kernel'))
+
+    def _shutdown_kernel(self, km):
+        km.stop_leased_clients()
+        try:
+            km.shutdown_kernel(now=True)
+        except Exception:
+            pass
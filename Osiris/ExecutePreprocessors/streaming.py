@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+import threading
+from concurrent.futures import CancelledError
+from ..output_fingerprint import OutputFingerprint
+
+'''
+Streaming comparison of outputs. Each cell is compared with its expected outputs as soon as it finishes,
+instead of once the whole notebook was executed, so that the execution can stop at the first mismatch.
+'''
+
+class OutputMismatchError(Exception):
+    '''
+    Raised to stop the execution at the first cell whose outputs differ from the expected ones
+    '''
+
+    def __init__(self, cell_index):
+        super(OutputMismatchError, self).__init__('Outputs of cell {} do not match'.format(cell_index))
+        self.cell_index = cell_index
+
+
+class StreamingComparison():
+    '''
+    expected_outputs : OutputFingerprint of every cell, in the order of execution
+    stop_on_mismatch : raise OutputMismatchError at the first unmatched cell, so that the kernel is stopped
+    '''
+
+    def __init__(self, expected_outputs, stop_on_mismatch=False):
+        self.expected_outputs = expected_outputs
+        self.stop_on_mismatch = stop_on_mismatch
+        self.matched_cell_idx = []
+        self.unmatched_cell_idx = []
+        self.is_stopped = False
+
+    def get_first_unmatched_cell_idx(self):
+        return self.unmatched_cell_idx[0] if len(self.unmatched_cell_idx) > 0 else None
+
+    def compare(self, cell_index, cell):
+        if cell_index >= len(self.expected_outputs):
+            return # nothing to compare with
+        if self.expected_outputs[cell_index] == OutputFingerprint(cell):
+            self.matched_cell_idx.append(cell_index)
+            return
+        self.unmatched_cell_idx.append(cell_index)
+        if self.stop_on_mismatch:
+            self.is_stopped = True
+            raise OutputMismatchError(cell_index)
+
+
+class PairedComparison():
+    '''
+    Compares the outputs of two runs of the same notebook executed concurrently. A cell is compared as soon as
+    both runs executed it, through the StreamingComparison-like side of each run given by get_side.
+    If stop_on_mismatch, both runs are stopped at the first unmatched cell, the other one once its current cell ends.
+    A run is stopped as well, raising CancelledError, once the other one is cancelled, e.g. as it failed.
+    '''
+
+    def __init__(self, stop_on_mismatch=False):
+        self.stop_on_mismatch = stop_on_mismatch
+        self.matched_cell_idx = []
+        self.unmatched_cell_idx = []
+        self.is_stopped = False
+        self.is_cancelled = False
+        self._pending_outputs = ({}, {}) # cell index -> OutputFingerprint of a cell executed by one run only
+        self._lock = threading.Lock()
+
+    def get_side(self, side):
+        return _PairedComparisonSide(self, side)
+
+    def cancel(self):
+        with self._lock:
+            self.is_cancelled = True
+
+    def get_first_unmatched_cell_idx(self):
+        return min(self.unmatched_cell_idx) if len(self.unmatched_cell_idx) > 0 else None
+
+    def compare(self, side, cell_index, cell):
+        outputs = OutputFingerprint(cell)
+        with self._lock:
+            if self.is_stopped:
+                raise OutputMismatchError(self.get_first_unmatched_cell_idx())
+            if self.is_cancelled:
+                raise CancelledError()
+            other_outputs = self._pending_outputs[1-side].pop(cell_index, None)
+            if other_outputs is None:
+                self._pending_outputs[side][cell_index] = outputs
+                return
+            if outputs == other_outputs:
+                self.matched_cell_idx.append(cell_index)
+                return
+            self.unmatched_cell_idx.append(cell_index)
+            if self.stop_on_mismatch:
+                self.is_stopped = True
+                raise OutputMismatchError(cell_index)
+
+
+class _PairedComparisonSide():
+
+    def __init__(self, pair, side):
+        self._pair = pair
+        self._side = side
+
+    def compare(self, cell_index, cell):
+        self._pair.compare(self._side, cell_index, cell)
@@ -1,2 +1,6 @@
 from .user_interface import UserInterface
-from .analysizer import Analysizer
\ No newline at end of file
+from .analysizer import Analysizer
+from .ExecutePreprocessors import KernelPool, ExecutionBudget, CellTimeoutError
+from .result_cache import ResultCache, DEFAULT_RESULT_CACHE_DIR
+from .batch_runner import analyse_corpus, read_path_list
+from .profiler import Profiler, enable_profiling, disable_profiling, profiling
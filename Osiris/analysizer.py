@@ -1,24 +1,34 @@
 import nbformat
 import copy
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 
-from nbconvert.preprocessors import ExecutePreprocessor
-from .ExecutePreprocessors import OECPreprocessor, SelfReproducibilityCheckPreprocessor, StatusInspectionPreprocessor, DependencyPreprocessor
+from .ExecutePreprocessors import ReportingKernelManager, BudgetedExecutePreprocessor, CellTimeoutError, StreamingComparison, PairedComparison, OutputMismatchError, OECPreprocessor, SelfReproducibilityCheckPreprocessor, SnapshotReproducibilityCheckPreprocessor, StatusInspectionPreprocessor, DependencyPreprocessor, PrefixTreePreprocessor
 
 from .utils import *
+from .profiler import span
+from .constants import MAX_NUM_OF_EXECUTION_ORDERS
 
 class Analysizer():
 
-    def __init__(self, notebook_path, notebook_file):
-        self._nb_path = notebook_path.split('/')[-1]
-        self._nb = nbformat.read(notebook_file, as_version=4)
+    def __init__(self, notebook_path, notebook_index, kernel_pool=None, budget=None, concurrent_runs=False):
+        self._index = notebook_index # NotebookIndex shared by static analyses, e.g. execution orders
+        self._nb = notebook_index.get_nb()
 
         self._ep = None # ep is abbr for instance of ExecutePreprocessors
+        self._kernel_pool = kernel_pool # if given, kernels are leased from the pool instead of being started per execution
+        self._budget = budget # ExecutionBudget of every execution, None for the default timeout of nbconvert
+        self.concurrent_runs = concurrent_runs # execute both runs of weak and best_effort match patterns at the same time
         self._py_version = None
         self._is_executable = None
         self._import_statemnets = None
+        self.num_of_executions = 0 # number of kernel runs of the whole notebook
+        self._num_of_executions_lock = threading.Lock()
 
         self._preceding_preapre()
-        self._deep_copy_nb = copy.deepcopy(self._nb) # store deepcopy of the given notebook to avoid unexpected manipulation
+        with span('deepcopy notebook', category='notebook', notebook=notebook_index.path, cells=len(self._nb.cells)):
+            self._deep_copy_nb = copy.deepcopy(self._nb) # store deepcopy of the given notebook to avoid unexpected manipulation
 
     def _preceding_preapre(self):
         self._py_version = self._extract_py_version() # extract python version 
@@ -36,23 +46,10 @@ class Analysizer():
         self._extract_import_statements()
 
     def _extract_py_version(self):
-        meta_info = self._nb.metadata
-        try:
-            py_version_lst = meta_info['language_info']['version'].split('.')
-            py_version = py_version_lst[0]+'.'+py_version_lst[1]
-            return py_version
-        except:
-            return None
+        return self._index.get_py_version()
 
     def _extract_import_statements(self):
-        import_statements = []
-        for cell in self._nb.cells:
-            statements = (cell.source).split('\n')
-            for statement in statements:
-                if any(substr in statement for substr in ['from', 'import']):
-                    import_statements.append(statement)
-        
-        self._import_statemnets = import_statements
+        self._import_statemnets = self._index.get_import_statements()
 
     def _clean_redundant_cells(self):
         invalid_cells_idx = []
@@ -71,7 +68,7 @@ class Analysizer():
         self._nb.cells = parsed_nb_cells
 
     def _set_ep_as_normal_mode(self):
-        self._ep = ExecutePreprocessor()
+        self._ep = BudgetedExecutePreprocessor()
 
     def _set_ep_as_OEC_mode(self):
         self._ep = OECPreprocessor()
@@ -85,14 +82,34 @@ class Analysizer():
     def _set_execution_order_for_ep_check_repeatablility_mode(self, execution_order):
         self._ep.set_execution_order(execution_order)
 
+    def _set_ep_check_repeatablility_snapshot_mode(self, analyse_strategy):
+        self._ep = SnapshotReproducibilityCheckPreprocessor(analyse_strategy)
+
     def _set_ep_debug_mode(self, analyse_strategy, check_cell_idx):
         self._ep = StatusInspectionPreprocessor(analyse_strategy, check_cell_idx)
 
     def _set_execution_order_for_ep_debug_mode(self, execution_order):
         self._ep.set_execution_order(execution_order)
 
-    def _execute_nb(self):
-        self._ep.preprocess(self._nb, {'metadata': {'path': './'}})
+    def _kernel_name(self):
+        return self._nb.metadata.get('kernelspec', {}).get('name', 'python')
+
+    def _execute_nb(self, ep=None, nb=None, comparison=None):
+        # ep and nb default to the ones of the analysizer, local ones are given when executing concurrently
+        ep = self._ep if ep is None else ep
+        nb = self._nb if nb is None else nb
+        ep.kernel_manager_class = ReportingKernelManager
+        ep.budget = self._budget
+        ep.comparison = comparison
+
+        with self._num_of_executions_lock:
+            self.num_of_executions += 1
+        with span('execute notebook', category='execution', notebook=self._index.path, preprocessor=type(ep).__name__, cells=len(nb.cells)):
+            if self._kernel_pool is None:
+                ep.preprocess(nb, {'metadata': {'path': './'}})
+            else:
+                with self._kernel_pool.lease(self._kernel_name()) as km:
+                    ep.preprocess(nb, {'metadata': {'path': './'}}, km=km)
 
     def _is_pandas_used(self, cells):
         whitelist = ['pandas', 'seaborn']
@@ -112,7 +129,10 @@ class Analysizer():
         '''
         Fix statements, which contain randomness/time
         '''
-        cells = copy.deepcopy(self._nb.cells)
+        self._nb.cells = self._best_effort_repaired_cells(self._nb.cells)
+
+    def _best_effort_repaired_cells(self, cells):
+        cells = copy_on_write_cells(cells)
         if len(cells) > 0:
             first_cell_source_code_lst = cells[0].source.split('\n')
 
@@ -127,214 +147,389 @@ class Analysizer():
             return_source_code = '\n'.join(first_cell_source_code_lst)
             cells[0].source = return_source_code
         
-            self._nb.cells = cells 
+        return cells 
        
     def return_py_version(self):
         return self._py_version
 
+    def return_kernel_name(self):
+        return self._kernel_name()
+
     def return_import_statements(self):
         return self._import_statemnets
 
+    def return_execution_order(self, analyse_strategy):
+        return self._get_execution_order_of_strategy(analyse_strategy)
+
     # This functionality is for experiment purpose
     def check_executability_on_all_potential_execution_paths(self, verbose):
         return True 
 
     # This functionality is for experiment purpose
     # Should not be called from users when Osiris is publicly released 
-    def check_reproducibility_on_all_potential_execution_paths(self, verbose, match_pattern):
-        execution_orders = get_all_potential_execution_orders(self._nb_path)
+    def check_reproducibility_on_all_potential_execution_paths(self, verbose, match_pattern, num_of_workers=1, cancel_event=None, share_prefixes=False, reduce_orders=False):
+        '''
+        Execution orders are independent of each other, hence up to num_of_workers orders are evaluated
+        concurrently, each one in its own kernels. Results are reported in the order of execution orders.
+        Setting cancel_event stops evaluating further orders, orders not evaluated are left out of results.
+        cancel_event is only read, so the same event can be given to later calls.
+        If share_prefixes, all orders are instead executed together on a prefix trie in a single kernel.
+        If reduce_orders, only one order per equivalence class of orders differing by commuting cells is evaluated.
+        '''
+        if reduce_orders:
+            execution_orders = islice(self._index.iter_reduced_execution_orders(), MAX_NUM_OF_EXECUTION_ORDERS)
+        else:
+            execution_orders = self._index.get_all_potential_execution_orders()
+        # Set on failure (e.g. KeyboardInterrupt) to stop the orders already submitted, along with cancel_event
+        stop_event = threading.Event()
+        cancel_events = [stop_event] if cancel_event is None else [cancel_event, stop_event]
+
+        if share_prefixes:
+            execution_orders = list(execution_orders)
+            results = []
+            for (execution_order, result) in zip(execution_orders, self._check_reproducibility_on_execution_orders_sharing_prefixes(verbose, match_pattern, execution_orders)):
+                self._report_execution_order(verbose, execution_order, result)
+                if result['is_executable']:
+                    results.append(result['match_ratio'])
+            return results
 
         results = []
-        for execution_order in execution_orders:
-            print(execution_order)
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            is_executable = False
-            error = None
+        with ThreadPoolExecutor(max_workers=num_of_workers) as executor:
+            # Orders are submitted as they are generated
+            futures = []
+            try:
+                for execution_order in execution_orders:
+                    futures.append((execution_order, executor.submit(self._evaluate_execution_order, match_pattern, execution_order, cancel_events)))
+
+                for execution_order, future in futures:
+                    result = future.result()
+                    if result is None: # cancelled
+                        continue
+
+                    self._report_execution_order(verbose, execution_order, result)
+                    if result['is_executable']:
+                        results.append(result['match_ratio'])
+            except BaseException:
+                # e.g. KeyboardInterrupt, do not start the remaining orders
+                for _, future in futures:
+                    future.cancel()
+                stop_event.set()
+                raise
 
+        return results
+
+    def _evaluate_execution_order(self, match_pattern, execution_order, cancel_events):
+        '''
+        Evaluate an execution order on local copies of the notebook and local preprocessors, so that it can run
+        concurrently with other execution orders. Nothing is printed here, see _report_execution_order.
+        The evaluation stops before its next execution once any of cancel_events is set.
+        '''
+        def execute(ep, is_best_effort=False):
+            if any(cancel_event.is_set() for cancel_event in cancel_events):
+                raise CancelledError()
+            nb = copy_on_write_nb(self._deep_copy_nb)
+            if is_best_effort:
+                nb.cells = self._best_effort_repaired_cells(nb.cells)
+            self._execute_nb(ep, nb)
+            return nb
+
+        result = {'is_executable': False, 'error': None, 'match_ratio': None}
+        try:
             try:
-                self._set_ep_as_dependency_mode(execution_order)
-                self._execute_nb()
-                is_executable = True
+                execute(DependencyPreprocessor(execution_order))
+                result['is_executable'] = True
+            except CancelledError:
+                raise
             except Exception as e:
-                error = e
+                result['error'] = e
+                return result
 
-            print('Executability'.ljust(40), ':', is_executable)
-            self._is_executable = is_executable
+            try:
+                if match_pattern == 'strong':
+                    original_outputs = extract_outputs_based_on_dependency_order(self._deep_copy_nb.cells, execution_order)
+                    original_cells = self._get_original_cells('dependency', execution_order)
+                elif match_pattern == 'weak':
+                    nb = execute(DependencyPreprocessor(execution_order))
+                    original_outputs = extract_outputs_based_on_normal_order(nb.cells)
+                    original_cells = nb.cells
+                else:  # best-effort (PENDING)
+                    nb = execute(OECPreprocessor(), is_best_effort=True)
+                    original_outputs = extract_outputs_based_on_OEC_order(nb.cells)
+                    original_cells = nb.cells
+
+                # Extract the executed outputs
+                nb = execute(DependencyPreprocessor(execution_order), is_best_effort=(match_pattern == 'best_effort'))
+                executed_outputs = extract_outputs_based_on_normal_order(nb.cells)
+
+                result.update(self._match_outputs_of_execution_order(original_outputs, executed_outputs, original_cells, nb.cells))
+            except CancelledError:
+                raise
+            except Exception as e:
+                result['reproducibility_error'] = e
+        except CancelledError:
+            return None
 
-            if verbose and (not is_executable):
-                print(error)
+        return result
 
-            if is_executable:
+    def _match_outputs_of_execution_order(self, original_outputs, executed_outputs, original_cells, executed_cells):
+        # Compare two outputs, only the outputs of unmatched cells are kept (as text) for reporting them
+        result = {'matched_cell_idx': [], 'unmatched_cell_idx': [], 'unmatched_original_outputs': [], 'unmatched_executed_outputs': []}
+        num_of_matched_cells, num_of_cells = 0, len(original_outputs)
+        with span('compare outputs', category='comparison', notebook=self._index.path, cells=num_of_cells):
+            for i in range(num_of_cells):
+                if original_outputs[i] == executed_outputs[i]:
+                    num_of_matched_cells += 1
+                    result['matched_cell_idx'].append(i)
+                else:
+                    result['unmatched_cell_idx'].append(i)
+                    result['unmatched_original_outputs'].append(get_output_text(original_cells[i]))
+                    result['unmatched_executed_outputs'].append(get_output_text(executed_cells[i]))
+
+        result['num_of_matched_cells'] = num_of_matched_cells
+        result['num_of_cells'] = num_of_cells
+        result['match_ratio'] = 1 if num_of_cells == 0 else num_of_matched_cells/num_of_cells
+        return result
+
+    def _check_reproducibility_on_execution_orders_sharing_prefixes(self, verbose, match_pattern, execution_orders):
+        '''
+        Same analyses as _evaluate_execution_order for every execution order, where each run executes all
+        execution orders at once on a prefix trie
+        '''
+        first_executed_cells, errors = self._execute_orders_sharing_prefixes(execution_orders)
+
+        if match_pattern == 'weak':
+            second_executed_cells, _ = self._execute_orders_sharing_prefixes(execution_orders)
+        elif match_pattern == 'best_effort':
+            # (PENDING) the original outputs of best_effort come from the OEC order, shared by every execution order
+            try:
+                best_effort_original_outputs = self._execute_and_extract_outputs('OEC', None, is_best_effort=True)
+                best_effort_original_cells = self._nb.cells
+            except Exception as e:
+                best_effort_original_outputs = e
+            second_executed_cells, _ = self._execute_orders_sharing_prefixes(execution_orders, is_best_effort=True)
+
+        results = []
+        for (idx, execution_order) in enumerate(execution_orders):
+            result = {'is_executable': first_executed_cells[idx] is not None, 'error': errors[idx], 'match_ratio': None}
+            if result['is_executable']:
                 try:
-                    self._nb = copy.deepcopy(self._deep_copy_nb)
                     if match_pattern == 'strong':
-                        original_outputs = extract_outputs_based_on_dependency_order(self._nb.cells, execution_order)
+                        original_outputs = extract_outputs_based_on_dependency_order(self._deep_copy_nb.cells, execution_order)
+                        original_cells = self._get_original_cells('dependency', execution_order)
+                        executed_cells = first_executed_cells[idx]
                     elif match_pattern == 'weak':
-                        self._set_ep_as_dependency_mode(execution_order)
-                        self._execute_nb()
-                        original_outputs = extract_outputs_based_on_normal_order(self._nb.cells)
-                    else:  # best-effort (PENDING)
-                        self._best_effort_repair()
-                        self._set_ep_as_OEC_mode()
-                        self._execute_nb()
-                        original_outputs = extract_outputs_based_on_OEC_order(self._nb.cells)
-
-
-                    # Extract the executed outputs
-                    self._nb = copy.deepcopy(self._deep_copy_nb)
-                    if match_pattern == 'best_effort':
-                        self._best_effort_repair()
-                    self._set_ep_as_dependency_mode(execution_order)
-                    self._execute_nb()
-                    executed_outputs = extract_outputs_based_on_normal_order(self._nb.cells)
-
-                    # Compare two outputs
-                    matched_cell_idx = []
-                    unmatched_cell_idx = []
-                    unmatched_original_outputs = []
-                    unmatched_executed_outputs = []
-                    num_of_matched_cells, num_of_cells = 0, len(original_outputs)
-                    for i in range(num_of_cells):
-                        if original_outputs[i] == executed_outputs[i]:
-                            num_of_matched_cells += 1
-                            matched_cell_idx.append(i)
-                        else:
-                            unmatched_cell_idx.append(i)
-                            unmatched_original_outputs.append(original_outputs[i])
-                            unmatched_executed_outputs.append(executed_outputs[i])
-
-                    # Return (print) the results
-                    match_ratio = 0
-                    if num_of_cells == 0:
-                        match_ratio = 1
+                        original_outputs = extract_outputs_based_on_normal_order(first_executed_cells[idx])
+                        original_cells = first_executed_cells[idx]
+                        executed_cells = second_executed_cells[idx]
                     else:
-                        match_ratio = num_of_matched_cells/num_of_cells
-
-                    _ = extract_source_code_from_unmatched_cells(self._nb.cells, unmatched_cell_idx)
-                    print('Reproducibility'.ljust(40), ':', "number of matched cells: {num_of_matched_cells} ; number of cells: {num_of_cells}".format(
-                      num_of_matched_cells=num_of_matched_cells, num_of_cells=num_of_cells))
-                    print('Reproducibility'.ljust(40), ':', "matched ratio: {match_ratio} ; index of matched cells: {matched_cell_idx}".format(
-                      match_ratio=round(match_ratio, 3), matched_cell_idx=matched_cell_idx))
-
-                    # Debug & Experiment purpose
-                    # Print cells which are unmatched
-                    if verbose:
-                        self._nb = copy.deepcopy(self._deep_copy_nb)
-                        print_source_code_of_unmatched_cells(self._nb.cells, 'dependency', unmatched_cell_idx, unmatched_original_outputs, unmatched_executed_outputs, execution_order)   
+                        if isinstance(best_effort_original_outputs, Exception):
+                            raise best_effort_original_outputs
+                        original_outputs = best_effort_original_outputs
+                        original_cells = best_effort_original_cells
+                        executed_cells = second_executed_cells[idx]
+
+                    if executed_cells is None:
+                        raise RuntimeError('The execution order is not executable in a second execution')
+                    executed_outputs = extract_outputs_based_on_normal_order(executed_cells)
+                    result.update(self._match_outputs_of_execution_order(original_outputs, executed_outputs, original_cells, executed_cells))
                 except Exception as e:
-                    print(e)
-                    match_ratio = None
-                    
-                results.append(match_ratio)
+                    result['reproducibility_error'] = e
+            results.append(result)
 
         return results
 
-    def check_executability(self, verbose, analyse_strategy):
-        self._nb = copy.deepcopy(self._deep_copy_nb)
-        is_executable, error = False, None
-        
-        try:
-            if analyse_strategy == 'normal':
-                self._set_ep_as_normal_mode()
-            elif analyse_strategy == 'dependency':
-                execution_order = get_execution_order(self._nb_path)
-                self._set_ep_as_dependency_mode(execution_order)
-            else:
-                self._set_ep_as_OEC_mode()
-
-            self._execute_nb()
-            is_executable = True
-        except Exception as e:
-            error = e
-
-        print('Executability'.ljust(40), ':', is_executable)
-        self._is_executable = is_executable
+    def _execute_orders_sharing_prefixes(self, execution_orders, is_best_effort=False):
+        '''
+        Execute all execution orders within a single run, sharing common prefixes between them.
+        Returns, for each execution order, the executed cells in the order of execution (None if the order is not
+        executable) and the error (None if the order is executable).
+        '''
+        nb = copy_on_write_nb(self._deep_copy_nb)
+        if is_best_effort:
+            nb.cells = self._best_effort_repaired_cells(nb.cells)
+        ep = PrefixTreePreprocessor(execution_orders)
+        self._execute_nb(ep, nb)
+        if ep.is_supported:
+            return ep.get_executed_cells(), ep.get_errors()
+
+        # Kernels which cannot fork execute every execution order from scratch
+        executed_cells_of_orders, errors = [], []
+        for execution_order in execution_orders:
+            nb = copy_on_write_nb(self._deep_copy_nb)
+            if is_best_effort:
+                nb.cells = self._best_effort_repaired_cells(nb.cells)
+            try:
+                self._execute_nb(DependencyPreprocessor(execution_order), nb)
+                executed_cells_of_orders.append(nb.cells)
+                errors.append(None)
+            except Exception as e:
+                executed_cells_of_orders.append(None)
+                errors.append(e)
+        return executed_cells_of_orders, errors
 
-        if verbose and (not is_executable):
-            print(error)
+    def _execute_strategies_sharing_prefixes(self, analyse_strategies, execution_orders, is_best_effort=False):
+        '''
+        _execute_orders_sharing_prefixes for the execution orders of analyse strategies. Warnings are only filtered
+        by the OEC and dependency strategies, so the normal strategy shares no prefix with them: it is executed on
+        its own, as in check_all, concurrently with the prefix trie of the other strategies.
+        '''
+        executed_cells_of_orders, errors = [None]*len(analyse_strategies), [None]*len(analyse_strategies)
+        shared_idx = [idx for (idx, analyse_strategy) in enumerate(analyse_strategies) if analyse_strategy != 'normal']
+
+        def execute_normal_order():
+            nb = copy_on_write_nb(self._deep_copy_nb)
+            if is_best_effort:
+                nb.cells = self._best_effort_repaired_cells(nb.cells)
+            self._execute_nb(BudgetedExecutePreprocessor(), nb)
+            return nb.cells
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            normal_futures = {idx: executor.submit(execute_normal_order) for (idx, analyse_strategy) in enumerate(analyse_strategies) if analyse_strategy == 'normal'}
+            if len(shared_idx) > 0:
+                shared_cells, shared_errors = self._execute_orders_sharing_prefixes([execution_orders[idx] for idx in shared_idx], is_best_effort)
+                for (idx, executed_cells, error) in zip(shared_idx, shared_cells, shared_errors):
+                    executed_cells_of_orders[idx], errors[idx] = executed_cells, error
+            for (idx, future) in normal_futures.items():
+                try:
+                    executed_cells_of_orders[idx] = future.result()
+                except Exception as e:
+                    errors[idx] = e
+        return executed_cells_of_orders, errors
+
+    def _get_execution_order_of_strategy(self, analyse_strategy):
+        cells = self._deep_copy_nb.cells
+        if analyse_strategy == 'normal':
+            return list(range(len(cells)))
+        elif analyse_strategy == 'OEC':
+            execution_count_lst = [cell.execution_count for cell in cells]
+            return sorted(range(len(execution_count_lst)), key=lambda k: execution_count_lst[k])
+        else:
+            return self._index.get_execution_order()
 
-        return is_executable
+    def _report_execution_order(self, verbose, execution_order, result):
+        print(execution_order)
+        print('Executability'.ljust(40), ':', result['is_executable'])
+        self._is_executable = result['is_executable']
 
-    def check_reproducibility(self, verbose, analyse_strategy, match_pattern):
-        original_outputs, executed_outputs = None, None
+        if not result['is_executable']:
+            if verbose:
+                print(result['error'])
+            return
 
-        # Extract two outputs according to aanalyse_strategy and strong/weak match 
-        if analyse_strategy == 'OEC':
-            # Extract the original outputs 
-            self._nb = copy.deepcopy(self._deep_copy_nb)
+        if 'reproducibility_error' in result:
+            print(result['reproducibility_error'])
+            return
 
-            if match_pattern == 'strong':
-                original_outputs = extract_outputs_based_on_OEC_order(self._nb.cells)
-            elif match_pattern == 'weak': 
-                self._set_ep_as_OEC_mode()
-                self._execute_nb()
-                original_outputs = extract_outputs_based_on_OEC_order(self._nb.cells)
-            else: # best-effort
-                self._best_effort_repair() 
-                self._set_ep_as_OEC_mode()
-                self._execute_nb()
-                original_outputs = extract_outputs_based_on_OEC_order(self._nb.cells)
+        print('Reproducibility'.ljust(40), ':', "number of matched cells: {num_of_matched_cells} ; number of cells: {num_of_cells}".format(
+          num_of_matched_cells=result['num_of_matched_cells'], num_of_cells=result['num_of_cells']))
+        print('Reproducibility'.ljust(40), ':', "matched ratio: {match_ratio} ; index of matched cells: {matched_cell_idx}".format(
+          match_ratio=round(result['match_ratio'], 3), matched_cell_idx=result['matched_cell_idx']))
 
-            # Extract the executed outputs 
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            if match_pattern == 'best_effort':
-                self._best_effort_repair()
+        # Debug & Experiment purpose
+        # Print cells which are unmatched
+        if verbose:
+            cells = copy_on_write_cells(self._deep_copy_nb.cells)
+            print_source_code_of_unmatched_cells(cells, 'dependency', result['unmatched_cell_idx'], result['unmatched_original_outputs'], result['unmatched_executed_outputs'], execution_order)   
 
+    def _set_ep_by_strategy(self, analyse_strategy, execution_order):
+        if analyse_strategy == 'normal':
+            self._set_ep_as_normal_mode()
+        elif analyse_strategy == 'dependency':
+            self._set_ep_as_dependency_mode(execution_order)
+        else:
             self._set_ep_as_OEC_mode()
-            self._execute_nb()
-            executed_outputs = extract_outputs_based_on_OEC_order(self._nb.cells)
-
-        elif analyse_strategy == 'normal':
 
-            # Extract the original outputs
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            if match_pattern == 'strong':
-                original_outputs = extract_outputs_based_on_normal_order(self._nb.cells)
-            elif match_pattern == 'weak':
-                self._set_ep_as_normal_mode()
-                self._execute_nb()
-                original_outputs = extract_outputs_based_on_normal_order(self._nb.cells)
-            else: # best-effort 
-                self._best_effort_repair() 
-                self._set_ep_as_normal_mode()
-                self._execute_nb()
-                original_outputs = extract_outputs_based_on_OEC_order(self._nb.cells)
-
-            # Extract the executed outputs
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            if match_pattern == 'best_effort':
-                self._best_effort_repair()
-            self._set_ep_as_normal_mode()
-            self._execute_nb()
-            executed_outputs = extract_outputs_based_on_normal_order(self._nb.cells)
+    def _new_ep_by_strategy(self, analyse_strategy, execution_order):
+        # A local preprocessor, for executions running concurrently
+        if analyse_strategy == 'normal':
+            return BudgetedExecutePreprocessor()
         elif analyse_strategy == 'dependency':
-            execution_order = get_execution_order(self._nb_path)
-            print('Execution order:', execution_order)
+            return DependencyPreprocessor(execution_order)
+        else:
+            return OECPreprocessor()
 
-            # Extract the original outputs
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            if match_pattern == 'strong':
-                original_outputs = extract_outputs_based_on_dependency_order(self._nb.cells, execution_order)
-            elif match_pattern == 'weak':
-                self._set_ep_as_dependency_mode(execution_order)
-                self._execute_nb()
-                original_outputs = extract_outputs_based_on_normal_order(self._nb.cells)
-            else:  # best-effort 
-                self._best_effort_repair() 
-                self._set_ep_as_dependency_mode(execution_order)
-                self._execute_nb()
-                original_outputs = extract_outputs_based_on_OEC_order(self._nb.cells)
+    def _extract_executed_outputs(self, analyse_strategy, cells):
+        if analyse_strategy == 'OEC':
+            return extract_outputs_based_on_OEC_order(cells)
+        else:
+            return extract_outputs_based_on_normal_order(cells)
+
+    def _execute_and_extract_outputs(self, analyse_strategy, execution_order, is_best_effort=False, comparison=None):
+        # Execute the notebook in the given strategy and extract outputs in the order of execution
+        self._nb = copy_on_write_nb(self._deep_copy_nb)
+        if is_best_effort:
+            self._best_effort_repair()
+        self._set_ep_by_strategy(analyse_strategy, execution_order)
+        self._execute_nb(comparison=comparison)
+        return self._extract_executed_outputs(analyse_strategy, self._nb.cells)
+
+    def _execute_twice(self, analyse_strategy, execution_order, is_best_effort=False, comparison=None):
+        '''
+        Execute the notebook twice, each run in its own kernel on its own copy of the notebook, for the original
+        and executed outputs of weak and best_effort match patterns. Outputs of both runs are compared as they
+        arrive by the given PairedComparison, and a run failing stops the other one.
+        Both runs execute at the same time if concurrent_runs, else the second run starts once the first one ended.
+        Returns, for each run, its outputs in the order of execution or the exception it raised, and, for each run,
+        its executed cells in the order of execution or None. The notebook of the last run which succeeded is kept
+        as the notebook of the analysizer, as after sequential executions.
+        '''
+        comparison = PairedComparison() if comparison is None else comparison
 
-            # Extract the executed outputs
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            if match_pattern == 'best_effort':
-                self._best_effort_repair()
-            self._set_ep_as_dependency_mode(execution_order)
-            self._execute_nb()
-            executed_outputs = extract_outputs_based_on_normal_order(self._nb.cells)
+        def execute(side):
+            # outputs and notebook of a run, or the exception it raised and None
+            nb = copy_on_write_nb(self._deep_copy_nb)
+            if is_best_effort:
+                nb.cells = self._best_effort_repaired_cells(nb.cells)
+            try:
+                self._execute_nb(self._new_ep_by_strategy(analyse_strategy, execution_order), nb, comparison.get_side(side))
+                return self._extract_executed_outputs(analyse_strategy, nb.cells), nb
+            except (OutputMismatchError, CancelledError) as e:
+                return e, None
+            except Exception as e:
+                comparison.cancel()
+                return e, None
+
+        if self.concurrent_runs:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                runs = list(executor.map(execute, range(2)))
         else:
-            pass
+            # Runs share the working directory of the notebook, e.g. files written by a run are read by the other one
+            runs = [execute(0)]
+            runs.append((CancelledError(), None) if comparison.is_cancelled else execute(1))
+
+        results, executed_cells_of_runs = [], []
+        for (outputs, nb) in runs:
+            results.append(outputs)
+            executed_cells_of_runs.append(None if nb is None else nb.cells)
+            if nb is not None:
+                self._nb = nb
+        return results, executed_cells_of_runs
+
+    def _get_error_of_runs(self, outputs_of_runs):
+        # Error of runs executed by _execute_twice, not the one of a run cancelled as the other one failed
+        errors = [outputs for outputs in outputs_of_runs if isinstance(outputs, Exception) and not isinstance(outputs, OutputMismatchError)]
+        errors.sort(key=lambda error: isinstance(error, CancelledError))
+        return errors[0] if len(errors) > 0 else None
+
+    def _get_original_cells(self, analyse_strategy, execution_order):
+        # Cells stored in the notebook file in the order of execution, as their outputs by _extract_original_outputs
+        if analyse_strategy != 'dependency':
+            execution_order = self._get_execution_order_of_strategy(analyse_strategy)
+        return [self._deep_copy_nb.cells[idx] for idx in execution_order]
+
+    def _extract_original_outputs(self, analyse_strategy, execution_order):
+        # Outputs stored in the notebook file, for strong match pattern
+        self._nb = copy_on_write_nb(self._deep_copy_nb)
+        if analyse_strategy == 'OEC':
+            return extract_outputs_based_on_OEC_order(self._nb.cells)
+        elif analyse_strategy == 'normal':
+            return extract_outputs_based_on_normal_order(self._nb.cells)
+        else:
+            return extract_outputs_based_on_dependency_order(self._nb.cells, execution_order)
 
+    def _compare_outputs(self, verbose, analyse_strategy, execution_order, original_outputs, executed_outputs, original_cells, executed_cells):
+        # original_cells, executed_cells: cells of both outputs in the order of execution, for the source code and
+        # the outputs of unmatched cells
         assert not (original_outputs is None)
         assert not (executed_outputs is None)
         assert len(original_outputs) == len(executed_outputs)
@@ -342,17 +537,14 @@ class Analysizer():
         # Compare two outputs
         matched_cell_idx = []
         unmatched_cell_idx = []
-        unmatched_original_outputs = []
-        unmatched_executed_outputs = []
         num_of_matched_cells, num_of_cells = 0, len(original_outputs)
-        for i in range(num_of_cells):
-            if original_outputs[i] == executed_outputs[i]:
-                num_of_matched_cells += 1
-                matched_cell_idx.append(i)
-            else: 
-                unmatched_cell_idx.append(i)
-                unmatched_original_outputs.append(original_outputs[i])
-                unmatched_executed_outputs.append(executed_outputs[i])
+        with span('compare outputs', category='comparison', notebook=self._index.path, strategy=analyse_strategy, cells=num_of_cells):
+            for i in range(num_of_cells):
+                if original_outputs[i] == executed_outputs[i]:
+                    num_of_matched_cells += 1
+                    matched_cell_idx.append(i)
+                else: 
+                    unmatched_cell_idx.append(i)
 
         # Return (print) the results
         match_ratio = 0
@@ -360,7 +552,7 @@ class Analysizer():
             match_ratio = 1
         else:
             match_ratio = num_of_matched_cells/num_of_cells
-        source_code_of_unmatched_cells = extract_source_code_from_unmatched_cells(self._nb.cells, unmatched_cell_idx)
+        source_code_of_unmatched_cells = extract_source_code_from_unmatched_cells(executed_cells, unmatched_cell_idx)
         
         if len(unmatched_cell_idx) > 0:
             print('The first unmatched cell index:', unmatched_cell_idx[0])
@@ -373,53 +565,295 @@ class Analysizer():
         # Debug & Experiment purpose 
         # Print cells which are unmatched 
         if verbose:
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            if analyse_strategy == 'dependency':
-                print_source_code_of_unmatched_cells(self._nb.cells, analyse_strategy, unmatched_cell_idx, unmatched_original_outputs, unmatched_executed_outputs, execution_order)   
-            else:
-                print_source_code_of_unmatched_cells(self._nb.cells, analyse_strategy, unmatched_cell_idx, unmatched_original_outputs, unmatched_executed_outputs)   
+            # Payloads are only fetched for unmatched cells, fingerprints do not keep them
+            unmatched_original_outputs = [get_output_text(original_cells[i]) for i in unmatched_cell_idx]
+            unmatched_executed_outputs = [get_output_text(executed_cells[i]) for i in unmatched_cell_idx]
+            # executed cells are already in the order of execution
+            print_source_code_of_unmatched_cells(executed_cells, 'normal', unmatched_cell_idx, unmatched_original_outputs, unmatched_executed_outputs)
 
         return num_of_matched_cells, num_of_cells, match_ratio, matched_cell_idx, source_code_of_unmatched_cells          
 
-    def check_repeatablility(self, verbose, analyse_strategy):
+    def check_executability(self, verbose, analyse_strategy):
+        is_executable, error = False, None
+        
+        try:
+            execution_order = None
+            if analyse_strategy == 'dependency':
+                execution_order = self._index.get_execution_order()
+            self._execute_and_extract_outputs(analyse_strategy, execution_order)
+            is_executable = True
+        except Exception as e:
+            error = e
+
+        print('Executability'.ljust(40), ':', is_executable)
+        self._is_executable = is_executable
+        self._report_timeout(error)
+
+        if verbose and (not is_executable):
+            print(error)
+
+        return is_executable
+
+    def _report_timeout(self, error):
+        '''
+        Returns where the execution ran out of its budget, None if the error is not a timeout
+        '''
+        if not isinstance(error, CellTimeoutError):
+            return None
+        print('Timed out at cell'.ljust(40), ':', error.cell_index)
+        return {'cell_index': error.cell_index, 'budget': error.budget, 'seconds': error.timeout}
+
+    def check_reproducibility(self, verbose, analyse_strategy, match_pattern):
+        execution_order = None
+        if analyse_strategy == 'dependency':
+            execution_order = self._index.get_execution_order()
+            print('Execution order:', execution_order)
 
+        # Extract two outputs according to analyse_strategy and strong/weak/best_effort match
+        if match_pattern == 'strong':
+            original_outputs = self._extract_original_outputs(analyse_strategy, execution_order)
+            original_cells = self._get_original_cells(analyse_strategy, execution_order)
+            executed_outputs = self._execute_and_extract_outputs(analyse_strategy, execution_order)
+            executed_cells = self._nb.cells
+        else: # weak and best-effort, both runs are independent of each other
+            (original_outputs, executed_outputs), (original_cells, executed_cells) = self._execute_twice(analyse_strategy, execution_order, is_best_effort=(match_pattern == 'best_effort'))
+            error = self._get_error_of_runs([original_outputs, executed_outputs])
+            if error is not None:
+                raise error
+
+        return self._compare_outputs(verbose, analyse_strategy, execution_order, original_outputs, executed_outputs, original_cells, executed_cells)
+
+    def check_first_unmatched_cell(self, verbose, analyse_strategy, match_pattern, stop_on_mismatch=True):
+        '''
+        Find the first unmatched cell of the given match pattern. Outputs of the executed run are compared cell by
+        cell while it is executed, and if stop_on_mismatch, the run is stopped at the first unmatched cell.
+        Returns a dict with the keys 'executability', None if the run was stopped before its end, and
+        'first_unmatched_cell_idx', None if every cell matched (or if the notebook is not executable).
+        '''
+        results = {'first_unmatched_cell_idx': None}
         execution_order = None
         if analyse_strategy == 'dependency':
-            execution_order = get_execution_order(self._nb_path)
+            execution_order = self._index.get_execution_order()
+            print('Execution order:', execution_order)
+
+        error = None
+        if match_pattern == 'strong':
+            comparison = StreamingComparison(self._extract_original_outputs(analyse_strategy, execution_order), stop_on_mismatch)
+            try:
+                self._execute_and_extract_outputs(analyse_strategy, execution_order, comparison=comparison)
+            except OutputMismatchError:
+                pass
+            except Exception as e:
+                error = e
+        else: # weak and best-effort, the original and executed runs are compared as their outputs arrive
+            comparison = PairedComparison(stop_on_mismatch)
+            error = self._get_error_of_runs(self._execute_twice(analyse_strategy, execution_order, is_best_effort=(match_pattern == 'best_effort'), comparison=comparison)[0])
+
+        is_executable = None if comparison.is_stopped else (error is None)
+        print('Executability'.ljust(40), ':', 'not determined (stopped at the first unmatched cell)' if is_executable is None else is_executable)
+        if is_executable is not None:
+            self._is_executable = is_executable
+        timeout = self._report_timeout(error)
+        if verbose and (error is not None):
+            print(error)
+
+        results['executability'] = is_executable
+        if timeout is not None:
+            results['timeout'] = timeout
+        if is_executable is False:
+            return results
+
+        results['first_unmatched_cell_idx'] = comparison.get_first_unmatched_cell_idx()
+        if results['first_unmatched_cell_idx'] is not None:
+            print('The first unmatched cell index:', results['first_unmatched_cell_idx'])
+        print('Reproducibility'.ljust(40), ':', results['first_unmatched_cell_idx'] is None)
+        return results
+
+    def check_all(self, verbose, analyse_strategy, match_patterns):
+        '''
+        Analyse executability and reproducibility for all given match patterns with the minimal number of executions.
+        The execution checking executability doubles as the executed run for strong match pattern and as the
+        original run for weak match pattern, and best_effort match pattern shares nothing as it repairs the notebook.
+        The executed run of weak match pattern runs along with the one checking executability, see _execute_twice.
+        '''
+        results = {}
+        execution_order = None
+        if analyse_strategy == 'dependency':
+            execution_order = self._index.get_execution_order()
+            print('Execution order:', execution_order)
+
+        # Executability
+        outputs, error = None, None
+        if 'weak' in match_patterns:
+            (outputs, weak_executed_outputs), (executed_cells, weak_executed_cells) = self._execute_twice(analyse_strategy, execution_order)
+            if isinstance(outputs, Exception):
+                # if cancelled, the executed run of weak match pattern failed on the same cells
+                outputs, error = None, self._get_error_of_runs([outputs, weak_executed_outputs])
+        else:
+            try:
+                outputs = self._execute_and_extract_outputs(analyse_strategy, execution_order)
+                executed_cells = self._nb.cells
+            except Exception as e:
+                error = e
+
+        is_executable = outputs is not None
+        print('Executability'.ljust(40), ':', is_executable)
+        self._is_executable = is_executable
+        timeout = self._report_timeout(error)
+        if verbose and (not is_executable):
+            print(error)
+
+        results['executability'] = is_executable
+        if timeout is not None:
+            results['timeout'] = timeout
+        if not is_executable:
+            return results
+
+        # Reproducibility
+        for match_pattern in match_patterns:
+            if match_pattern == 'strong':
+                original_outputs, original_cells = self._extract_original_outputs(analyse_strategy, execution_order), self._get_original_cells(analyse_strategy, execution_order)
+                compared_outputs, compared_cells = outputs, executed_cells
+            elif match_pattern == 'weak':
+                if isinstance(weak_executed_outputs, Exception):
+                    raise weak_executed_outputs
+                original_outputs, original_cells = outputs, executed_cells
+                compared_outputs, compared_cells = weak_executed_outputs, weak_executed_cells
+            else: # best-effort
+                (original_outputs, compared_outputs), (original_cells, compared_cells) = self._execute_twice(analyse_strategy, execution_order, is_best_effort=True)
+                error = self._get_error_of_runs([original_outputs, compared_outputs])
+                if error is not None:
+                    raise error
+
+            results[match_pattern] = self._compare_outputs(verbose, analyse_strategy, execution_order, original_outputs, compared_outputs, original_cells, compared_cells)
+
+        return results
+
+    def check_all_sharing_prefixes(self, verbose, analyse_strategies, match_patterns):
+        '''
+        check_all for several analyse strategies at once. The execution orders of the OEC and dependency strategies
+        are executed together on a prefix trie, so the prefix they share is executed only once per run, and the
+        normal strategy is executed alongside (see _execute_strategies_sharing_prefixes).
+        Returns {analyse strategy: results of check_all}
+        '''
+        execution_orders = [self._get_execution_order_of_strategy(analyse_strategy) for analyse_strategy in analyse_strategies]
+        first_executed_cells, errors = self._execute_strategies_sharing_prefixes(analyse_strategies, execution_orders)
+        if 'weak' in match_patterns:
+            second_executed_cells, _ = self._execute_strategies_sharing_prefixes(analyse_strategies, execution_orders)
+        if 'best_effort' in match_patterns:
+            best_effort_executed_cells = [self._execute_strategies_sharing_prefixes(analyse_strategies, execution_orders, is_best_effort=True)[0] for _ in range(2)]
+
+        results = {}
+        for (idx, analyse_strategy) in enumerate(analyse_strategies):
+            execution_order = execution_orders[idx] if analyse_strategy == 'dependency' else None
+            print('Strategy'.ljust(40), ':', analyse_strategy)
+            if analyse_strategy == 'dependency':
+                print('Execution order:', execution_order)
+
+            is_executable = first_executed_cells[idx] is not None
+            print('Executability'.ljust(40), ':', is_executable)
+            if verbose and (not is_executable):
+                print(errors[idx])
+
+            results[analyse_strategy] = {'executability': is_executable}
+            if not is_executable:
+                continue
+
+            for match_pattern in match_patterns:
+                if match_pattern == 'strong':
+                    original_cells, executed_cells = None, first_executed_cells[idx]
+                elif match_pattern == 'weak':
+                    original_cells, executed_cells = first_executed_cells[idx], second_executed_cells[idx]
+                else: # best-effort
+                    original_cells, executed_cells = best_effort_executed_cells[0][idx], best_effort_executed_cells[1][idx]
+
+                if (match_pattern != 'strong' and original_cells is None) or executed_cells is None:
+                    print('Reproducibility'.ljust(40), ':', 'not executable in all executions')
+                    results[analyse_strategy][match_pattern] = None
+                    continue
+
+                if original_cells is None:
+                    original_outputs = self._extract_original_outputs(analyse_strategy, execution_order)
+                    original_cells = self._get_original_cells(analyse_strategy, execution_order)
+                else:
+                    original_outputs = extract_outputs_based_on_normal_order(original_cells)
+                executed_outputs = extract_outputs_based_on_normal_order(executed_cells)
+
+                results[analyse_strategy][match_pattern] = self._compare_outputs(verbose, analyse_strategy, execution_order, original_outputs, executed_outputs, original_cells, executed_cells)
+
+        self._is_executable = all(results[analyse_strategy]['executability'] for analyse_strategy in analyse_strategies)
+        return results
+
+    def _check_repeatablility_from_snapshots(self, analyse_strategy, execution_order):
+        '''
+        Run the notebook once and fork the kernel at every cell boundary. Both 'execute once' and 'execute twice'
+        variants of a cell start from the same snapshot, hence O(N) cell executions instead of O(N^2).
+        Return the status of variables (once, twice) for each cell, or None if the kernel cannot fork, e.g. on Windows.
+        '''
+        self._nb = copy_on_write_nb(self._deep_copy_nb)
+        self._set_ep_check_repeatablility_snapshot_mode(analyse_strategy)
+        if execution_order is not None:
+            self._set_execution_order_for_ep_check_repeatablility_mode(execution_order)
+        self._execute_nb()
+
+        var_status_lst = []
+        for result in self._ep.snapshot_results:
+            if (result is None) or result.get('unsupported', False):
+                return None
+            if 'error' in result:
+                var_status_lst.append((None, None))
+            else:
+                var_status_lst.append((result['once'], result['twice']))
+        return var_status_lst
+
+    def check_repeatablility(self, verbose, analyse_strategy, snapshot=False):
+
+        execution_order = None
+        if analyse_strategy == 'dependency':
+            execution_order = self._index.get_execution_order()
         
-        self._nb = copy.deepcopy(self._deep_copy_nb)
+        self._nb = copy_on_write_nb(self._deep_copy_nb)
         num_of_cells = len(self._nb.cells)
 
+        var_status_lst = None
+        if snapshot:
+            var_status_lst = self._check_repeatablility_from_snapshots(analyse_strategy, execution_order)
+
         self_reproducible_cell_idx = []
         for i in range(num_of_cells):
             # +1 cuz we will insert a status inspection function as the first cell (with index 0)
             check_cell_idx = i + 1 
 
-            # Get status variables if execute once
-            is_duplicate = False
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            self._set_ep_check_repeatablility_mode(check_cell_idx, analyse_strategy, is_duplicate)
-            if execution_order is not None:
-                self._set_execution_order_for_ep_check_repeatablility_mode(execution_order)
-            self._execute_nb()
-            check_cell_outputs = self._nb.cells[check_cell_idx].outputs
-            var_status_exe_once = check_cell_outputs[-1].data['text/plain']
+            if var_status_lst is not None:
+                var_status_exe_once, var_status_exe_twice = var_status_lst[i]
+            else:
+                # Get status variables if execute once
+                is_duplicate = False
+                self._nb = copy_on_write_nb(self._deep_copy_nb)
+                self._set_ep_check_repeatablility_mode(check_cell_idx, analyse_strategy, is_duplicate)
+                if execution_order is not None:
+                    self._set_execution_order_for_ep_check_repeatablility_mode(execution_order)
+                self._execute_nb()
+                check_cell_outputs = self._nb.cells[check_cell_idx].outputs
+                var_status_exe_once = extract_var_status(check_cell_outputs)
 
-            # Get status variables if execute twice
-            self._nb = copy.deepcopy(self._deep_copy_nb)
-            is_duplicate = True
-            self._set_ep_check_repeatablility_mode(check_cell_idx, analyse_strategy, is_duplicate)
-            if execution_order is not None:
-                self._set_execution_order_for_ep_check_repeatablility_mode(execution_order)
-            self._execute_nb()
-            check_cell_outputs = self._nb.cells[check_cell_idx+1].outputs
-            var_status_exe_twice = check_cell_outputs[-1].data['text/plain']
+                # Get status variables if execute twice
+                self._nb = copy_on_write_nb(self._deep_copy_nb)
+                is_duplicate = True
+                self._set_ep_check_repeatablility_mode(check_cell_idx, analyse_strategy, is_duplicate)
+                if execution_order is not None:
+                    self._set_execution_order_for_ep_check_repeatablility_mode(execution_order)
+                self._execute_nb()
+                check_cell_outputs = self._nb.cells[check_cell_idx+1].outputs
+                var_status_exe_twice = extract_var_status(check_cell_outputs)
 
             # Check whether a cell is reproducible & Print
-            is_self_reproducible = (var_status_exe_once == var_status_exe_twice)
+            is_self_reproducible = (var_status_exe_once is not None) and (var_status_exe_once == var_status_exe_twice)
             if verbose:
                 print("Check the {cell_idx} th cell among {num_of_cells} cells. Self-reproducibility result: {Self_reproduciblity_result}".format(
                     cell_idx=check_cell_idx, num_of_cells=num_of_cells, Self_reproduciblity_result=is_self_reproducible))
+                if (not is_self_reproducible) and (var_status_exe_once is not None):
+                    print('Diverged variables:', find_diverged_variables(var_status_exe_once, var_status_exe_twice))
 
             # Store results for further return
             if is_self_reproducible:
@@ -440,27 +874,86 @@ class Analysizer():
         return self._ep.get_number_of_statements(self._nb)
 
     def _execute_nb_for_inspecting_status_of_certain_line(self, target_line_index):
-        self._ep.preprocess_for_inspecting_status_of_certain_line(
-            self._nb, {'metadata': {'path': './'}}, target_line_index)
+        self._ep.kernel_manager_class = ReportingKernelManager
+        self._ep.budget = self._budget
+        if self._kernel_pool is None:
+            self._ep.preprocess_for_inspecting_status_of_certain_line(
+                self._nb, {'metadata': {'path': './'}}, target_line_index)
+        else:
+            with self._kernel_pool.lease(self._kernel_name()) as km:
+                self._ep.preprocess_for_inspecting_status_of_certain_line(
+                    self._nb, {'metadata': {'path': './'}}, target_line_index, km=km)
+
+    def _execute_nb_for_tracing_statements(self, analyse_strategy, check_cell_idx, execution_order):
+        self._nb = copy_on_write_nb(self._deep_copy_nb)
+        self._set_ep_debug_mode(analyse_strategy, check_cell_idx)
+        if execution_order is not None:
+            self._set_execution_order_for_ep_debug_mode(execution_order)
+        self._ep.kernel_manager_class = ReportingKernelManager
+        self._ep.budget = self._budget
+
+        try:
+            if self._kernel_pool is None:
+                self._ep.preprocess_for_tracing_statements(self._nb, {'metadata': {'path': './'}})
+            else:
+                with self._kernel_pool.lease(self._kernel_name()) as km:
+                    self._ep.preprocess_for_tracing_statements(self._nb, {'metadata': {'path': './'}}, km=km)
+        except Exception:
+            pass
 
-    def check_status_difference_for_a_cell(self, analyse_strategy, check_cell_idx):
+        # cells preceding the inspected cell may have failed, leaving no trace at all
+        if len(self._nb.cells) <= check_cell_idx:
+            return None
+        return self._ep.get_statement_trace(self._nb)
+
+    def _check_status_difference_from_traces(self, analyse_strategy, check_cell_idx, execution_order):
+        '''
+        Two executions in total: each records the status of variables before the cell and after every
+        top-level statement of the cell, then the first divergent statement is located by comparing both traces.
+        '''
+        first_trace = self._execute_nb_for_tracing_statements(analyse_strategy, check_cell_idx, execution_order)
+        second_trace = self._execute_nb_for_tracing_statements(analyse_strategy, check_cell_idx, execution_order)
+
+        if (first_trace is None) or (second_trace is None):
+            return None if first_trace == second_trace else -1
+
+        # Check if the status of self-defined variables has been different before this cell
+        if not (first_trace[0] == second_trace[0]):
+            return -1
+
+        # Check if the status of self-defined variables has been different upon certain statement
+        statements = self._ep.traced_source.split('\n')
+        for i in range(1, max(len(first_trace), len(second_trace))):
+            first_record = first_trace[i] if i < len(first_trace) else None
+            second_record = second_trace[i] if i < len(second_trace) else None
+            if not (first_record == second_record):
+                start_line, end_line, _ = first_record if first_record is not None else second_record
+                supicious_statement = '\n'.join(statements[start_line:end_line+1])
+                return (start_line, supicious_statement)
+
+        return None
+
+    def check_status_difference_for_a_cell(self, analyse_strategy, check_cell_idx, trace=False):
         # +1 cuz we will insert a status inspection function as the first cell (with index 0)
         check_cell_idx += 1
         first_var_status, second_var_status = None, None
 
         execution_order = None
         if analyse_strategy == 'dependency':
-            execution_order = get_execution_order(self._nb_path)
+            execution_order = self._index.get_execution_order()
             print('Execution order:', execution_order)
 
-        self._nb = copy.deepcopy(self._deep_copy_nb)
+        if trace:
+            return self._check_status_difference_from_traces(analyse_strategy, check_cell_idx, execution_order)
+
+        self._nb = copy_on_write_nb(self._deep_copy_nb)
         self._set_ep_debug_mode(analyse_strategy, check_cell_idx)
         if execution_order is not None:
             self._set_execution_order_for_ep_debug_mode(execution_order)
         num_of_statements = self._ep_get_number_of_statements()
 
         # Check if the status of self-defined variables has been different before this cell
-        self._nb = copy.deepcopy(self._deep_copy_nb)
+        self._nb = copy_on_write_nb(self._deep_copy_nb)
         self._set_ep_debug_mode(analyse_strategy, check_cell_idx)
         if execution_order is not None:
             self._set_execution_order_for_ep_debug_mode(execution_order)
@@ -468,11 +961,11 @@ class Analysizer():
         try:
             self._execute_nb_for_inspecting_status_of_certain_line(-1)
             check_cell_outputs = self._nb.cells[check_cell_idx].outputs
-            first_var_status = check_cell_outputs[-1].data['text/plain']
+            first_var_status = extract_var_status(check_cell_outputs)
         except:
             first_var_status = None
             
-        self._nb = copy.deepcopy(self._deep_copy_nb)
+        self._nb = copy_on_write_nb(self._deep_copy_nb)
         self._set_ep_debug_mode(analyse_strategy, check_cell_idx)
         if execution_order is not None:
             self._set_execution_order_for_ep_debug_mode(execution_order)
@@ -480,7 +973,7 @@ class Analysizer():
         try:
             self._execute_nb_for_inspecting_status_of_certain_line(-1)
             check_cell_outputs = self._nb.cells[check_cell_idx].outputs
-            second_var_status = check_cell_outputs[-1].data['text/plain']
+            second_var_status = extract_var_status(check_cell_outputs)
         except:
             second_var_status = None
 
@@ -489,7 +982,7 @@ class Analysizer():
 
         # Check if the status of self-defined variables has been different upon certain statement
         for i in range(num_of_statements):
-            self._nb = copy.deepcopy(self._deep_copy_nb)
+            self._nb = copy_on_write_nb(self._deep_copy_nb)
             self._set_ep_debug_mode(analyse_strategy, check_cell_idx)
             if execution_order is not None:
                 self._set_execution_order_for_ep_debug_mode(execution_order)
@@ -497,19 +990,19 @@ class Analysizer():
             try:
                 self._execute_nb_for_inspecting_status_of_certain_line(i)
                 check_cell_outputs = self._nb.cells[check_cell_idx].outputs
-                first_var_status = check_cell_outputs[-1].data['text/plain']
+                first_var_status = extract_var_status(check_cell_outputs)
             except Exception as e:
                 first_var_status = None
 
 
-            self._nb = copy.deepcopy(self._deep_copy_nb)
+            self._nb = copy_on_write_nb(self._deep_copy_nb)
             self._set_ep_debug_mode(analyse_strategy, check_cell_idx)
             if execution_order is not None:
                 self._set_execution_order_for_ep_debug_mode(execution_order)
             try:
                 self._execute_nb_for_inspecting_status_of_certain_line(i)
                 check_cell_outputs = self._nb.cells[check_cell_idx].outputs
-                second_var_status = check_cell_outputs[-1].data['text/plain']
+                second_var_status = extract_var_status(check_cell_outputs)
             except Exception as e:
                 second_var_status = None
             
@@ -520,7 +1013,7 @@ class Analysizer():
 
             print(i,self._nb.cells[check_cell_idx].source.split('\n')[i], first_var_status, second_var_status)
             if not (first_var_status == second_var_status):
-                self._nb = copy.deepcopy(self._deep_copy_nb)
+                self._nb = copy_on_write_nb(self._deep_copy_nb)
                 self._set_ep_debug_mode(analyse_strategy, check_cell_idx)
                 if execution_order is not None:
                     self._set_execution_order_for_ep_debug_mode(execution_order)
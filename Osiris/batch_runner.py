@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+
+from .user_interface import UserInterface
+from .ExecutePreprocessors import set_kernel_start_listener
+from .CRG import CellCache
+from .result_cache import ResultCache
+
+'''
+Corpus runner. Every (notebook, strategy) job runs in its own worker process, which becomes the leader of
+a new process group, so that the worker and its children can be killed at once when the job exceeds its
+wall-clock limit. Kernels are started in sessions of their own by jupyter_client, so the worker reports the pid
+of every kernel it starts, and the kernels (with the processes they forked) of a job which timed out or crashed
+are killed as well. The memory limit (RLIMIT_AS) is inherited by the kernels.
+Results are appended to a JSON-lines file, one record per job, and jobs already recorded are skipped.
+'''
+
+def read_path_list(path_list_file):
+    with open(path_list_file, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip() != '']
+
+def load_finished_jobs(output_path):
+    finished_jobs = set()
+    if not os.path.exists(output_path):
+        return finished_jobs
+
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                finished_jobs.add((record['path'], record['strategy']))
+            except (ValueError, KeyError, TypeError):
+                pass # a line truncated by a crash of the runner itself, the job will be redone
+    return finished_jobs
+
+def _limit_resources(memory_limit):
+    os.setsid()
+    if memory_limit is not None:
+        import resource
+        memory_limit_in_bytes = int(memory_limit*1024*1024)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_in_bytes, memory_limit_in_bytes))
+
+def _silence_outputs():
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    os.close(devnull)
+
+def _analyse_job(conn, root_path, path, strategy, match_patterns, memory_limit, cell_cache_path, result_cache_dir, budget):
+    _limit_resources(memory_limit)
+    _silence_outputs()
+    os.chdir(root_path)
+
+    # Kernels of concurrent runs are started by several threads
+    conn_lock = threading.Lock()
+    def report_kernel(pid):
+        with conn_lock:
+            conn.send({'kernel_pid': pid})
+    set_kernel_start_listener(report_kernel)
+
+    record = {}
+    try:
+        cell_cache = CellCache(cell_cache_path) if cell_cache_path is not None else None
+        result_cache = ResultCache(result_cache_dir) if result_cache_dir is not None else None
+        interface = UserInterface(path, strategy, False, cell_cache=cell_cache, result_cache=result_cache, budget=budget)
+        results = interface.analyse_all(match_patterns)
+        record['status'] = 'ok'
+        record['executability'] = results['executability']
+        if 'timeout' in results:
+            record['timeout'] = results['timeout']
+        for match_pattern in match_patterns:
+            if match_pattern in results:
+                num_of_matched_cells, num_of_cells, match_ratio, _, _ = results[match_pattern]
+                record[match_pattern] = {'num_of_matched_cells': num_of_matched_cells, 'num_of_cells': num_of_cells, 'match_ratio': match_ratio}
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = '{}: {}'.format(type(e).__name__, e)
+
+    with conn_lock:
+        conn.send(record)
+    conn.close()
+
+def _receive_messages(conn):
+    # The record of the job, if it was sent, and the pids of the kernels it started
+    record, kernel_pids = None, []
+    try:
+        while conn.poll():
+            message = conn.recv()
+            if 'kernel_pid' in message:
+                kernel_pids.append(message['kernel_pid'])
+            else:
+                record = message
+    except (EOFError, OSError):
+        pass
+    return record, kernel_pids
+
+def _kill_process_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def _write_record(f, record):
+    f.write(json.dumps(record)+'\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+def analyse_corpus(paths, output_path, strategies=('normal', 'OEC'), match_patterns=('strong', 'weak'), num_of_workers=None, timeout=1800, memory_limit=4096, verbose=True, cell_cache_path=None, result_cache_dir=None, budget=None):
+    '''
+    Analyse executability and reproducibility of every notebook in paths for every strategy.
+
+    output_path    : JSON-lines file, results are appended and existing records are skipped (resume)
+    num_of_workers : number of jobs running at the same time, default as the number of cores
+    timeout        : wall-clock limit in seconds of a job, None for no limit
+    memory_limit   : address space limit in MB of a worker and each of its kernels, None for no limit
+    cell_cache_path: SQLite file of a CellCache shared by workers, None for no cache
+    result_cache_dir: directory of a ResultCache shared by workers, None for no cache. Notebooks whose results
+                     are cached are not executed again, even if the output file is new.
+    budget         : ExecutionBudget of every execution of a job, None for the default timeout of nbconvert. A job
+                     running out of it is recorded as not executable, with the cell at which it timed out.
+
+    Returns the number of records written.
+    '''
+    num_of_workers = num_of_workers if num_of_workers is not None else (os.cpu_count() or 1)
+    match_patterns = list(match_patterns)
+    root_path = os.getcwd()
+
+    finished_jobs = load_finished_jobs(output_path)
+    pending_jobs = [(path, strategy) for path in paths for strategy in strategies if (path, strategy) not in finished_jobs]
+    if verbose:
+        print('Skipped jobs'.ljust(40), ':', len(paths)*len(strategies)-len(pending_jobs))
+        print('Pending jobs'.ljust(40), ':', len(pending_jobs))
+
+    pending_jobs.reverse()
+    running_jobs = {} # sentinel -> (process, conn, path, strategy, start time)
+    num_of_records = 0
+
+    with open(output_path, 'a', encoding='utf-8') as f:
+        while len(pending_jobs) > 0 or len(running_jobs) > 0:
+            # Keep every worker busy
+            while len(pending_jobs) > 0 and len(running_jobs) < num_of_workers:
+                path, strategy = pending_jobs.pop()
+                parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=_analyse_job, args=(child_conn, root_path, path, strategy, match_patterns, memory_limit, cell_cache_path, result_cache_dir, budget), daemon=True)
+                process.start()
+                child_conn.close()
+                running_jobs[process.sentinel] = (process, parent_conn, path, strategy, time.time())
+
+            # Wait until a job finishes or the earliest deadline expires
+            wait_timeout = None
+            if timeout is not None:
+                earliest_start_time = min(job[4] for job in running_jobs.values())
+                wait_timeout = max(earliest_start_time+timeout-time.time(), 0)
+            finished_sentinels = wait(list(running_jobs.keys()), wait_timeout)
+
+            for sentinel in list(running_jobs.keys()):
+                process, conn, path, strategy, start_time = running_jobs[sentinel]
+                elapsed = time.time()-start_time
+                is_timed_out = (timeout is not None) and elapsed >= timeout
+
+                if sentinel not in finished_sentinels and not is_timed_out:
+                    continue
+
+                # Kill the whole process group of the worker
+                _kill_process_group(process.pid)
+                process.join()
+
+                record, kernel_pids = _receive_messages(conn)
+                if sentinel not in finished_sentinels:
+                    record = None
+                if record is None:
+                    # A worker which sent its record has shut its kernels down, the others leave them behind.
+                    # Every kernel leads a session, hence a process group, of its own.
+                    for kernel_pid in kernel_pids:
+                        _kill_process_group(kernel_pid)
+                    if sentinel in finished_sentinels:
+                        record = {'status': 'crashed', 'exitcode': process.exitcode}
+                    else:
+                        record = {'status': 'timeout'}
+
+                record['path'] = path
+                record['strategy'] = strategy
+                record['elapsed'] = round(elapsed, 3)
+                _write_record(f, record)
+                num_of_records += 1
+
+                conn.close()
+                del running_jobs[sentinel]
+
+                if verbose:
+                    print(str(num_of_records).ljust(8), strategy.ljust(12), record['status'].ljust(10), path)
+
+    return num_of_records
@@ -1,3 +1,5 @@
+OSIRIS_VERSION = '1.0.0'
 VALID_PYTHON_VERSIONS = ['2.7', '3.4', '3.5', '3.6', '3.7']
 STRATEGIES = ['OEC', 'normal', 'dependency']
 MATCH_PATTERNS = ['strong', 'weak', 'best_effort']
+MAX_NUM_OF_EXECUTION_ORDERS = 200
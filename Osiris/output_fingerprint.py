@@ -0,0 +1,83 @@
+import hashlib
+
+# Size of the slices of an output payload fed to hash functions, so that a large payload (e.g. a base64 image)
+# is never encoded as a whole
+CHUNK_SIZE = 1 << 16
+
+# Pseudo mime type of stream outputs (stdout/stderr) and of plain outputs with a 'text' field
+STREAM_MIME_TYPE = 'text/x-stream'
+
+
+def iter_output_payloads(cell):
+    '''
+    Yields (mime type, payload) of every output of a cell considered in comparisons: the text of streams,
+    and for rich outputs the PNG image if any, else the plain text representation
+    '''
+    for output in cell.get('outputs', []):
+        if 'text' in output.keys():
+            yield STREAM_MIME_TYPE, output['text']
+        elif 'data' in output.keys():
+            data = output['data']
+            if 'image/png' in data.keys():
+                yield 'image/png', data['image/png']
+            elif 'text/plain' in data.keys():
+                yield 'text/plain', data['text/plain']
+
+
+def get_output_text(cell):
+    '''
+    Concatenated payloads of a cell considered in comparisons, for printing unmatched cells
+    '''
+    return ''.join(''.join(payload) if isinstance(payload, list) else payload for (_, payload) in iter_output_payloads(cell))
+
+
+class OutputFingerprint():
+    '''
+    Fingerprint of the outputs of a cell. Payloads are hashed incrementally into one digest per mime type, and a
+    layout digest records the sequence of mime types, so two cells are equal iff they produced the same payloads
+    of the same mime types in the same order. Neither the payloads nor the cell are kept, see get_output_text for
+    printing the outputs of unmatched cells.
+    '''
+
+    def __init__(self, cell):
+        mime_digests = {}
+        layout = hashlib.sha1()
+        previous_mime_type = None
+
+        for (mime_type, payload) in iter_output_payloads(cell):
+            if isinstance(payload, list): # multiline strings of unvalidated notebooks
+                payload = ''.join(payload)
+            digest = mime_digests.get(mime_type)
+            if digest is None:
+                digest = mime_digests[mime_type] = hashlib.sha1()
+
+            # Consecutive payloads of the same mime type are concatenated, as a stream may be split into several
+            # outputs at different positions from one execution to another. A new run of a mime type is delimited.
+            if mime_type != previous_mime_type:
+                digest.update(b'\x00')
+                layout.update(mime_type.encode('utf-8') + b'\x00')
+                previous_mime_type = mime_type
+
+            for i in range(0, len(payload), CHUNK_SIZE):
+                digest.update(payload[i:i+CHUNK_SIZE].encode('utf-8', 'surrogatepass'))
+
+        self.mime_digests = {mime_type: digest.hexdigest() for (mime_type, digest) in mime_digests.items()}
+        self.layout_digest = layout.hexdigest()
+
+    def is_empty(self):
+        return len(self.mime_digests) == 0
+
+    def __eq__(self, other):
+        if isinstance(other, OutputFingerprint):
+            return self.layout_digest == other.layout_digest and self.mime_digests == other.mime_digests
+        return NotImplemented
+
+    def __ne__(self, other):
+        is_equal = self.__eq__(other)
+        return is_equal if is_equal is NotImplemented else not is_equal
+
+    def __hash__(self):
+        return hash((self.layout_digest, tuple(sorted(self.mime_digests.items()))))
+
+    def __repr__(self):
+        return 'OutputFingerprint({})'.format(self.layout_digest[:12])
@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+'''
+Opt-in profiler. Analyses record timed spans, e.g. kernel startups, executions of cells, constructions of the
+Cell Dependency Graph or comparisons of outputs, through span(). Spans are only recorded while a Profiler is
+enabled, otherwise span() returns a shared no-op context manager. Recorded spans are written as a JSON trace in
+the Chrome trace event format, which can be opened in chrome://tracing or Perfetto.
+'''
+
+_profiler = None
+
+class _NullSpan():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span():
+
+    def __init__(self, profiler, name, category, args):
+        self._profiler = profiler
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self._args['error'] = exc_type.__name__
+        self._profiler.add_event(self._name, self._category, self._start, end, self._args)
+        return False
+
+    def set(self, **args):
+        # Arguments only known once the span started, e.g. sizes of results
+        self._args.update(args)
+
+class Profiler():
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._events = []
+        self._thread_names = {}
+        self._lock = threading.Lock()
+
+    def add_event(self, name, category, start, end, args):
+        thread = threading.current_thread()
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self._pid, 'tid': thread.ident,
+                 'ts': round((start-self._origin)*1e6, 3), 'dur': round((end-start)*1e6, 3), 'args': args}
+        with self._lock:
+            self._events.append(event)
+            self._thread_names[thread.ident] = thread.name
+
+    def get_events(self):
+        with self._lock:
+            return list(self._events)
+
+    def write(self, path):
+        with self._lock:
+            metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}}
+                        for (tid, name) in self._thread_names.items()]
+            events = metadata+self._events
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+def enable_profiling():
+    '''
+    Start recording spans of all threads into a new Profiler, which is returned
+    '''
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+def disable_profiling():
+    '''
+    Stop recording spans, returns the Profiler which recorded them, if any
+    '''
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+def get_profiler():
+    return _profiler
+
+def span(name, category='osiris', **args):
+    '''
+    Context manager timing its block as a span with the given arguments, e.g. notebook, strategy or cell_index
+    '''
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_SPAN
+    return _Span(profiler, name, category, args)
+
+@contextmanager
+def profiling(path):
+    '''
+    Record spans of the block and write them to path as a JSON trace
+    '''
+    profiler = enable_profiling()
+    try:
+        yield profiler
+    finally:
+        disable_profiling()
+        profiler.write(path)
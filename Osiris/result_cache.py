@@ -0,0 +1,182 @@
+import os
+import io
+import sys
+import json
+import shutil
+import hashlib
+import platform
+import sysconfig
+import tempfile
+import subprocess
+
+from jupyter_client.kernelspec import KernelSpecManager, NoSuchKernel
+
+from .constants import OSIRIS_VERSION
+
+'''
+Persistent cache of analytical results. A result is keyed by the notebook content, the analysis and its
+parameters, the version of Osiris and the identity of the python environments running Osiris and executing
+notebooks, i.e. the interpreter of the kernelspec, so that a result is reused only if nothing it depends on
+has changed. Every result is stored in its own JSON file.
+'''
+
+DEFAULT_RESULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'osiris')
+
+def get_environment_identity():
+    '''
+    Python build and installation of the environment. Installing or removing packages changes the modification
+    time of site-packages.
+    '''
+    identity = {'python': sys.version, 'executable': sys.executable, 'prefix': sys.prefix, 'platform': platform.platform()}
+    for name in ['purelib', 'platlib']:
+        try:
+            identity[name] = os.stat(sysconfig.get_paths()[name]).st_mtime_ns
+        except (KeyError, OSError):
+            identity[name] = None
+    return identity
+
+# Prints the site-packages of the interpreter running it
+_SITE_PACKAGES_STR = "import sysconfig; print(sysconfig.get_paths()['purelib']); print(sysconfig.get_paths()['platlib'])"
+
+def get_kernel_identity(kernel_name):
+    '''
+    Interpreter of the kernelspec executing notebooks, which may belong to another environment than the one
+    running Osiris, and the modification time of its site-packages. Unresolved values are None.
+    '''
+    identity = {'kernel_name': kernel_name, 'kernel_executable': None, 'kernel_purelib': None, 'kernel_platlib': None}
+    try:
+        executable = KernelSpecManager().get_kernel_spec(kernel_name).argv[0]
+    except (NoSuchKernel, IndexError):
+        return identity
+    # as jupyter_client does when launching the kernel
+    if executable in ['python', 'python%i' % sys.version_info[0]]:
+        executable = sys.executable
+    executable = shutil.which(executable) or executable
+    identity['kernel_executable'] = os.path.abspath(executable)
+
+    try:
+        paths = subprocess.run([executable, '-c', _SITE_PACKAGES_STR], capture_output=True, text=True, timeout=60, check=True).stdout.splitlines()
+    except (OSError, subprocess.SubprocessError):
+        return identity
+    for (name, path) in zip(['kernel_purelib', 'kernel_platlib'], paths):
+        try:
+            identity[name] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    return identity
+
+def _encode(result):
+    # JSON has no tuples, which are returned by most analyses
+    if isinstance(result, tuple):
+        return {'__tuple__': [_encode(item) for item in result]}
+    if isinstance(result, list):
+        return [_encode(item) for item in result]
+    if isinstance(result, dict):
+        return {key: _encode(value) for (key, value) in result.items()}
+    return result
+
+def _decode(result):
+    if isinstance(result, dict):
+        if '__tuple__' in result:
+            return tuple(_decode(item) for item in result['__tuple__'])
+        return {key: _decode(value) for (key, value) in result.items()}
+    if isinstance(result, list):
+        return [_decode(item) for item in result]
+    return result
+
+class _Tee(io.StringIO):
+    '''
+    Records everything written to a stream while still writing it through
+    '''
+    def __init__(self, stream):
+        super().__init__()
+        self._stream = stream
+
+    def write(self, s):
+        self._stream.write(s)
+        return super().write(s)
+
+    def flush(self):
+        self._stream.flush()
+
+class ResultCache():
+
+    def __init__(self, cache_dir=DEFAULT_RESULT_CACHE_DIR):
+        self.cache_dir = os.path.abspath(cache_dir) # analyses change the working directory
+        self._environment_identity = get_environment_identity()
+        self._kernel_identities = {} # kernel name -> get_kernel_identity, resolved once per cache
+
+    def _get_kernel_identity(self, kernel_name):
+        if kernel_name not in self._kernel_identities:
+            self._kernel_identities[kernel_name] = get_kernel_identity(kernel_name)
+        return self._kernel_identities[kernel_name]
+
+    def get_key(self, notebook_hash, analysis, parameters, kernel_name):
+        key = json.dumps({
+            'notebook': notebook_hash,
+            'analysis': analysis,
+            'parameters': parameters,
+            'version': OSIRIS_VERSION,
+            'environment': self._environment_identity,
+            'kernel': self._get_kernel_identity(kernel_name),
+        }, sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _get_entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key+'.json')
+
+    def get(self, key):
+        '''
+        Cached entry {'result', 'output'} of key, None if not cached
+        '''
+        try:
+            with open(self._get_entry_path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return {'result': _decode(entry['result']), 'output': entry['output']}
+
+    def put(self, key, result, output=''):
+        '''
+        Returns False if result cannot be stored as JSON, in which case it is not cached
+        '''
+        try:
+            entry = json.dumps({'result': _encode(result), 'output': output})
+        except (TypeError, ValueError):
+            return False
+
+        entry_path = self._get_entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # written to a temporary file first, readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(entry)
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return True
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def get_or_analyse(self, key, analyse):
+        '''
+        The cached result of key if any, else the result of analyse(), which is then cached. Outputs printed
+        during the analysis are cached as well and printed again when the cached result is returned.
+        '''
+        entry = self.get(key)
+        if entry is not None:
+            sys.stdout.write(entry['output'])
+            return entry['result']
+
+        stdout = sys.stdout
+        sys.stdout = _Tee(stdout)
+        try:
+            result = analyse()
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.put(key, result, output)
+        return result
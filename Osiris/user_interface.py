@@ -1,19 +1,29 @@
+import os
+from itertools import islice
+
 from .analysizer import Analysizer
 from .constants import *
-from .utils import move_to_appropriate_location, distinguish_local_modules
+from .profiler import span
+from .utils import NotebookIndex, move_to_appropriate_location, distinguish_local_modules
 
 class UserInterface():
 
-    def __init__(self, path, execute_strategy, verbose, analyse_all_dependency=False):
+    def __init__(self, path, execute_strategy, verbose, analyse_all_dependency=False, kernel_pool=None, num_of_workers=1, share_prefixes=False, reduce_orders=False, cell_cache=None, result_cache=None, budget=None, concurrent_runs=False):
         # Specify analyse settings
         self._nb_path = path 
         self._execute_strategy = execute_strategy
         self._verbose = verbose
         self.analyse_all_dependency = analyse_all_dependency
+        self.num_of_workers = num_of_workers # number of execution orders evaluated concurrently with analyse_all_dependency
+        self.share_prefixes = share_prefixes # execute all execution orders on a prefix trie with analyse_all_dependency
+        self.reduce_orders = reduce_orders # skip execution orders only differing by commuting cells with analyse_all_dependency
+        self.result_cache = result_cache # ResultCache of analytical results, None for no cache
+        self.budget = budget # ExecutionBudget of every execution, None for the default timeout of nbconvert
+        self.concurrent_runs = concurrent_runs # both runs of weak and best_effort execute at the same time, in the same working directory
 
         # Create an analysizer, which takes the responsibility for the low-level manipulation 
-        f = open(self._nb_path, 'r', encoding='utf-8')
-        self.analysizer = Analysizer(path, f)
+        self.notebook_index = NotebookIndex(self._nb_path, cell_cache) # the notebook is loaded and parsed once per session
+        self.analysizer = Analysizer(path, self.notebook_index, kernel_pool, budget, concurrent_runs)
 
         # Extract python version
         self._py_version = self.analysizer.return_py_version()
@@ -32,41 +42,123 @@ class UserInterface():
         import_statements = self.analysizer.return_import_statements()
         return distinguish_local_modules(import_statements)
 
+    def _analyse_with_cache(self, analysis, parameters, analyse):
+        '''
+        Result of analyse(), or the result cached for the same notebook content, analysis and settings if
+        result_cache is given. Printed outputs of the analysis are displayed again for cached results.
+        '''
+        with span(analysis, category='analysis', notebook=self._nb_path, strategy=self._execute_strategy, **parameters):
+            if self.result_cache is None:
+                return analyse()
+
+            parameters = dict(parameters, execute_strategy=self._execute_strategy, verbose=self._verbose,
+                analyse_all_dependency=self.analyse_all_dependency, reduce_orders=self.reduce_orders,
+                budget=None if self.budget is None else self.budget.get_parameters(), concurrent_runs=self.concurrent_runs)
+            key = self.result_cache.get_key(self.notebook_index.content_hash, analysis, parameters, self.analysizer.return_kernel_name())
+            return self.result_cache.get_or_analyse(key, analyse)
+
+    def return_execution_orders(self):
+        '''
+        Execution order of the execute strategy, or every potential execution order analysed with analyse_all_dependency
+        '''
+        def analyse():
+            if (self.analyse_all_dependency is True) and self._execute_strategy == 'dependency':
+                if self.reduce_orders:
+                    return list(islice(self.notebook_index.iter_reduced_execution_orders(), MAX_NUM_OF_EXECUTION_ORDERS))
+                return self.notebook_index.get_all_potential_execution_orders()
+            return [self.analysizer.return_execution_order(self._execute_strategy)]
+        return self._analyse_with_cache('execution_orders', {}, analyse)
+
     def analyse_executability(self):
         move_to_appropriate_location(self._nb_path)
 
-        if (self.analyse_all_dependency is True) and self._execute_strategy == 'dependency':
-            lst_executabilities = self.analysizer.check_executability_on_all_potential_execution_paths(self._verbose)
-            return lst_executabilities
-        else: 
-            is_executable = self.analysizer.check_executability(self._verbose, self._execute_strategy)
-            return is_executable
+        def analyse():
+            if (self.analyse_all_dependency is True) and self._execute_strategy == 'dependency':
+                lst_executabilities = self.analysizer.check_executability_on_all_potential_execution_paths(self._verbose)
+                return lst_executabilities
+            else: 
+                is_executable = self.analysizer.check_executability(self._verbose, self._execute_strategy)
+                return is_executable
+        return self._analyse_with_cache('executability', {}, analyse)
 
     def analyse_reproducibility(self, match_pattern):
         assert match_pattern in MATCH_PATTERNS
         move_to_appropriate_location(self._nb_path)
 
+        def analyse():
+            if (self.analyse_all_dependency is True) and self._execute_strategy == 'dependency':
+                lst_of_matched_ratios = self.analysizer.check_reproducibility_on_all_potential_execution_paths(
+                    self._verbose, match_pattern, self.num_of_workers, share_prefixes=self.share_prefixes, reduce_orders=self.reduce_orders)
+                return lst_of_matched_ratios
+            else: 
+                num_of_matched_cells, num_of_cells, match_ratio, match_cell_idx, source_code_from_unmatched_cells = self.analysizer.check_reproducibility(
+                    self._verbose, self._execute_strategy, match_pattern)
+                return num_of_matched_cells, num_of_cells, match_ratio, match_cell_idx, source_code_from_unmatched_cells
+        return self._analyse_with_cache('reproducibility', {'match_pattern': match_pattern}, analyse)
+
+    def analyse_first_unmatched_cell(self, match_pattern, stop_on_mismatch=True):
+        '''
+        Yes/no reproducibility of the given match pattern, comparing outputs while the notebook is executed and
+        stopping at the first unmatched cell if stop_on_mismatch. Returns a dict with the keys 'executability'
+        and 'first_unmatched_cell_idx', see Analysizer.check_first_unmatched_cell.
+        '''
+        assert match_pattern in MATCH_PATTERNS
+        move_to_appropriate_location(self._nb_path)
+        return self._analyse_with_cache('first_unmatched_cell', {'match_pattern': match_pattern, 'stop_on_mismatch': stop_on_mismatch},
+            lambda: self.analysizer.check_first_unmatched_cell(self._verbose, self._execute_strategy, match_pattern, stop_on_mismatch))
+
+    def analyse_all(self, match_patterns):
+        '''
+        Analyse executability and reproducibility of all given match patterns at once, sharing the executed
+        notebooks between them. Returns a dict with the key 'executability' and one key per match pattern,
+        where the values are identical to the ones of analyse_executability and analyse_reproducibility.
+        '''
+        for match_pattern in match_patterns:
+            assert match_pattern in MATCH_PATTERNS
+
         if (self.analyse_all_dependency is True) and self._execute_strategy == 'dependency':
-            lst_of_matched_ratios = self.analysizer.check_reproducibility_on_all_potential_execution_paths(self._verbose, match_pattern)
-            return lst_of_matched_ratios
-        else: 
-            num_of_matched_cells, num_of_cells, match_ratio, match_cell_idx, source_code_from_unmatched_cells = self.analysizer.check_reproducibility(
-                self._verbose, self._execute_strategy, match_pattern)
-            return num_of_matched_cells, num_of_cells, match_ratio, match_cell_idx, source_code_from_unmatched_cells
+            # every potential execution path is analysed on its own, nothing to share
+            root_path = os.getcwd()
+            results = {'executability': self.analyse_executability()}
+            for match_pattern in match_patterns:
+                os.chdir(root_path)
+                results[match_pattern] = self.analyse_reproducibility(match_pattern)
+            return results
+
+        move_to_appropriate_location(self._nb_path)
+        return self._analyse_with_cache('all', {'match_patterns': list(match_patterns)},
+            lambda: self.analysizer.check_all(self._verbose, self._execute_strategy, match_patterns))
+
+    def analyse_all_strategies(self, match_patterns, strategies=STRATEGIES):
+        '''
+        analyse_all for several execute strategies at once, sharing the common prefix of their execution orders.
+        Returns {execute strategy: results of analyse_all}
+        '''
+        for match_pattern in match_patterns:
+            assert match_pattern in MATCH_PATTERNS
+        for strategy in strategies:
+            assert strategy in STRATEGIES
+
+        move_to_appropriate_location(self._nb_path)
+        return self._analyse_with_cache('all_strategies', {'match_patterns': list(match_patterns), 'strategies': list(strategies)},
+            lambda: self.analysizer.check_all_sharing_prefixes(self._verbose, strategies, match_patterns))
 
-    def analyse_repeatablility(self):
+    def analyse_repeatablility(self, snapshot=False):
         move_to_appropriate_location(self._nb_path)
 
-        num_of_reproducible_cells, num_of_cells, reproducible_ratio, reproducible_cell_idx = self.analysizer.check_repeatablility(
-            self._verbose, self._execute_strategy)
-        return num_of_reproducible_cells, num_of_cells, reproducible_ratio, reproducible_cell_idx
+        def analyse():
+            num_of_reproducible_cells, num_of_cells, reproducible_ratio, reproducible_cell_idx = self.analysizer.check_repeatablility(
+                self._verbose, self._execute_strategy, snapshot)
+            return num_of_reproducible_cells, num_of_cells, reproducible_ratio, reproducible_cell_idx
+        return self._analyse_with_cache('repeatability', {'snapshot': snapshot}, analyse)
 
-    def analyse_status_difference_for_a_cell(self, cell_index):
+    def analyse_status_difference_for_a_cell(self, cell_index, trace=False):
         if cell_index == None:
             raise ValueError('cell_index argument should not be empty (None), please indicate the cell_index.')
     
         move_to_appropriate_location(self._nb_path)
-        result = self.analysizer.check_status_difference_for_a_cell(self._execute_strategy, cell_index)
+        with span('status_difference', category='analysis', notebook=self._nb_path, strategy=self._execute_strategy, cell_index=cell_index, trace=trace):
+            result = self.analysizer.check_status_difference_for_a_cell(self._execute_strategy, cell_index, trace)
         
         if result is None:
             print('Statements in this cell did not cause any status difference of self-defined variables')
@@ -1,42 +1,53 @@
 import os 
+import ast
 
 import nbformat
 import collections
 import numpy as np
 
-from .CRG import CRG
-from .CRG import get_code_list, detect, get_antidote, get_path_by_extension, find_local_modules, get_oec
+from .CRG import CRG, NotebookIndex, CellCache
+from .CRG import get_code_list, detect, detect_many, compile_rules, get_antidote, get_path_by_extension, find_local_modules, find_local_modules_many, get_oec
+from .output_fingerprint import OutputFingerprint, get_output_text
+from .profiler import span
 
 '''
 The following utils functions are high-level usage of Jarix's implementation
 '''
-def distinguish_local_modules(import_statements):
-    result = find_local_modules(import_statements)
+def distinguish_local_modules(import_statements, module_index=None, directory=None):
+    with span('find local modules', category='static', import_statements=len(import_statements)):
+        result = find_local_modules(import_statements, module_index, directory)
     return result
 
+def distinguish_local_modules_many(lst_of_import_statements, module_index=None, directories=None):
+    return find_local_modules_many(lst_of_import_statements, module_index, directories)
+
 def return_traverse_path(root_path):
     return get_path_by_extension(root_path)
 
-def risk_detect(path):
-    return detect(path)
+def risk_detect(path, index=None):
+    return detect(path, index)
+
+def risk_detect_many(paths, rule_files=(), cell_cache=None):
+    '''
+    risk_detect of every notebook in paths, with the whitelist extended by the rules of rule_files (JSON)
+    '''
+    return detect_many(paths, compile_rules(rule_files), cell_cache)
 
 def return_fix_statement_for_random_statement(statement, list_of_import_statements):
     return get_antidote(statement, list_of_import_statements)
 
 def get_execution_order(path):
-    code_list = get_code_list(path)
-    graph = CDG()
-    graph.build(code_list)
-    path = graph.gen_exec_path(mode='single')
-    return path 
+    return NotebookIndex(path).get_execution_order()
 
 def get_all_potential_execution_orders(path):
-    code_list = get_code_list(path)
-    oec = get_oec(path)
-    graph = CDG()
-    graph.build(code_list)
-    paths = graph.gen_exec_path(mode='all', oec=oec)
-    return paths
+    return NotebookIndex(path).get_all_potential_execution_orders()
+
+def iter_reduced_execution_orders(path):
+    '''
+    Lazily yield one potential execution order per equivalence class of orders differing only by commuting
+    cells which share no symbol
+    '''
+    return NotebookIndex(path).iter_reduced_execution_orders()
 
 '''
 This utils function, move_to_appropriate_location, aims to cope with relative path issue
@@ -58,83 +69,41 @@ def store_nb(nb, relative_path):
         nbformat.write(nb, f)
 
 
+'''
+These utils functions, copy_on_write_nb and copy_on_write_cells, replace copy.deepcopy of a notebook before an execution.
+Only the notebook, its metadata and every cell are copied, whereas sources, outputs (e.g. base64 images) and cell metadata
+are shared with the given notebook. Preprocessors and nbconvert only replace these values (cell.source = ..., cell.outputs = [])
+and never modify them in place, so the given notebook is left intact.
+'''
+def copy_on_write_cells(cells):
+    return [nbformat.NotebookNode(cell) for cell in cells]
+
+def copy_on_write_nb(nb):
+    with span('copy notebook', category='notebook', cells=len(nb.cells)):
+        nb_view = nbformat.NotebookNode(nb)
+        nb_view.metadata = nbformat.NotebookNode(nb.metadata)
+        nb_view.cells = copy_on_write_cells(nb.cells)
+    return nb_view
+
+
 '''
 Following utils functions with 'extract_' as prefix aim to parse Jupyter Notebook files and extract useful information for further analyses 
 '''
+def _fingerprint_cells(cells):
+    with span('fingerprint outputs', category='comparison', cells=len(cells)):
+        return [OutputFingerprint(cell) for cell in cells]
+
 def extract_outputs_based_on_normal_order(cells):
-    outputs = []
-    for cell in cells:
-        if len(cell.outputs) > 0:
-            thorough_output_for_the_cell = ''
-            for output in cell.outputs:
-                if 'text' in output.keys():
-                    thorough_output_for_the_cell += output.text
-                elif 'data' in output.keys():
-                    image_data = output.data
-                    if 'image/png' in image_data.keys():
-                        thorough_output_for_the_cell += image_data['image/png']
-                    elif 'text/plain' in image_data.keys():
-                        thorough_output_for_the_cell += image_data['text/plain']
-                    else:
-                        pass
-            outputs.append(thorough_output_for_the_cell)
-        else:
-            outputs.append('')
-
-    return outputs
+    return _fingerprint_cells(cells)
 
 def extract_outputs_based_on_OEC_order(cells):
-    outputs = []
-    cells = cells.copy()
-
     execution_count_lst = [cell.execution_count for cell in cells]
     OEC = sorted(range(len(execution_count_lst)),
                     key=lambda k: execution_count_lst[k])
-    parsed_nb_cells = [cells[idx] for idx in OEC]
-    for cell in parsed_nb_cells:
-        if len(cell.outputs) > 0:
-            thorough_output_for_the_cell = ''
-            for output in cell.outputs:
-                if 'text' in output.keys():
-                    thorough_output_for_the_cell += output.text
-                elif 'data' in output.keys():
-                    image_data = output.data
-                    if 'image/png' in image_data.keys():
-                        thorough_output_for_the_cell += image_data['image/png']
-                    elif 'text/plain' in image_data.keys():
-                        thorough_output_for_the_cell += image_data['text/plain']
-                    else:
-                        pass
-            outputs.append(thorough_output_for_the_cell)
-        else:
-            outputs.append('')
-
-    return outputs
+    return _fingerprint_cells([cells[idx] for idx in OEC])
 
 def extract_outputs_based_on_dependency_order(cells, execution_order):
-    outputs = []
-    cells = cells.copy()
-
-    parsed_nb_cells = [cells[idx] for idx in execution_order]
-    for cell in parsed_nb_cells:
-        if len(cell.outputs) > 0:
-            thorough_output_for_the_cell = ''
-            for output in cell.outputs:
-                if 'text' in output.keys():
-                    thorough_output_for_the_cell += output.text
-                elif 'data' in output.keys():
-                    image_data = output.data
-                    if 'image/png' in image_data.keys():
-                        thorough_output_for_the_cell += image_data['image/png']
-                    elif 'text/plain' in image_data.keys():
-                        thorough_output_for_the_cell += image_data['text/plain']
-                    else:
-                        pass
-            outputs.append(thorough_output_for_the_cell)
-        else:
-            outputs.append('')
-
-    return outputs
+    return _fingerprint_cells([cells[idx] for idx in execution_order])
 
 
 def extract_source_code_from_unmatched_cells(cells, index_lst):
@@ -154,6 +123,22 @@ def extract_source_code_from_unmatched_cells(cells, index_lst):
     return source_code_of_unmatched_cells
 
 
+'''
+Following utils functions handle the status of self-defined variables, i.e. the {name: digest} map returned by extractVars() in the kernel
+'''
+def parse_var_status(text):
+    return ast.literal_eval(text)
+
+def extract_var_status(outputs):
+    # extractVars() is the result of the cell, figures flushed after the cell are display_data outputs
+    execute_results = [output for output in outputs if output.output_type == 'execute_result']
+    return parse_var_status(execute_results[-1].data['text/plain'])
+
+def find_diverged_variables(first_var_status, second_var_status):
+    names = set(first_var_status.keys()) | set(second_var_status.keys())
+    return sorted([name for name in names if first_var_status.get(name) != second_var_status.get(name)])
+
+
 '''
 All remaining utils functions below are for printing purpose (PENDING)
 '''
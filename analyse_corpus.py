@@ -0,0 +1,37 @@
+import argparse
+import os
+
+import Osiris
+
+parser = argparse.ArgumentParser(description='analyse a corpus of Jupyter Notebook files in parallel')
+parser.add_argument('-l', '--path-list', type=str, required=True)
+parser.add_argument('-o', '--output', type=str, default='records.jsonl')
+parser.add_argument('-e', '--execute', type=str, nargs='+', default=['normal', 'OEC'])
+parser.add_argument('-m', '--match-pattern', type=str, nargs='*', default=['strong', 'weak'])
+parser.add_argument('-w', '--workers', type=int, default=os.cpu_count())
+parser.add_argument('--timeout', type=int, default=1800)
+parser.add_argument('--memory-limit', type=int, default=4096)
+parser.add_argument('--cell-cache', type=str, default=None)
+parser.add_argument('--result-cache', type=str, default=None)
+parser.add_argument('--cell-timeout', type=float, default=None)
+parser.add_argument('--timing-factor', type=float, default=None)
+parser.add_argument('--notebook-timeout', type=float, default=None)
+parser.add_argument('--kernel-cpu-limit', type=float, default=None)
+args = parser.parse_args()
+
+for execute in args.execute:
+    assert execute in ['normal', 'OEC', 'dependency']
+for match_pattern in args.match_pattern:
+    assert match_pattern in ['strong', 'weak', 'best_effort']
+
+# 0 disables the corresponding limit
+timeout = args.timeout if args.timeout > 0 else None
+memory_limit = args.memory_limit if args.memory_limit > 0 else None
+
+# Budgets of executions within a job, so that a job running out of them is still recorded
+budget_settings = {'cell_timeout': args.cell_timeout, 'timing_factor': args.timing_factor, 'notebook_timeout': args.notebook_timeout, 'cpu_limit': args.kernel_cpu_limit}
+budget_settings = {key: value for (key, value) in budget_settings.items() if value is not None}
+budget = Osiris.ExecutionBudget(**budget_settings) if len(budget_settings) > 0 else None
+
+paths = Osiris.read_path_list(args.path_list)
+Osiris.analyse_corpus(paths, args.output, args.execute, args.match_pattern, args.workers, timeout, memory_limit, cell_cache_path=args.cell_cache, result_cache_dir=args.result_cache, budget=budget)
@@ -9,8 +9,25 @@ parser.add_argument('-e', '--execute', type=str, required=True)
 parser.add_argument('-v', '--verbose', action='store_true', default=True)
 parser.add_argument('-m', '--match-pattern', type=str, default=None)
 parser.add_argument('-s', '--self-reproduce', action='store_true', default=False)
+parser.add_argument('-f', '--fork', action='store_true', default=False)
 parser.add_argument('-a', '--all', action='store_true', default=False)
+parser.add_argument('-w', '--workers', type=int, default=1)
+parser.add_argument('-p', '--share-prefixes', action='store_true', default=False)
+parser.add_argument('-r', '--reduce-orders', action='store_true', default=False)
 parser.add_argument('-d', '--debug', type=int, default=None)
+parser.add_argument('-t', '--trace', action='store_true', default=False)
+parser.add_argument('-k', '--kernel-pool', type=int, default=0)
+parser.add_argument('-x', '--early-exit', action='store_true', default=False)
+parser.add_argument('-c', '--concurrent-runs', action='store_true', default=False)
+parser.add_argument('--profile', type=str, default=None)
+parser.add_argument('--cache-dir', type=str, default=Osiris.DEFAULT_RESULT_CACHE_DIR)
+parser.add_argument('--no-cache', action='store_true', default=False)
+parser.add_argument('--clear-cache', action='store_true', default=False)
+parser.add_argument('--cell-timeout', type=float, default=None)
+parser.add_argument('--timing-factor', type=float, default=None)
+parser.add_argument('--notebook-timeout', type=float, default=None)
+parser.add_argument('--kernel-memory-limit', type=float, default=None)
+parser.add_argument('--kernel-cpu-limit', type=float, default=None)
 args = parser.parse_args()
 
 # Parameters (required)
@@ -22,33 +39,57 @@ assert execute in ['normal', 'OEC', 'dependency']
 verbose = args.verbose
 match_pattern = args.match_pattern
 self_reproduce = args.self_reproduce
+snapshot = args.fork
 debug = args.debug
+trace = args.trace
+early_exit = args.early_exit
+concurrent_runs = args.concurrent_runs
 analyse_all_dependency = args.all
+num_of_workers = args.workers
+share_prefixes = args.share_prefixes
+reduce_orders = args.reduce_orders
+kernel_pool = Osiris.KernelPool(size=args.kernel_pool) if args.kernel_pool > 0 else None
+result_cache = Osiris.ResultCache(args.cache_dir) if not args.no_cache else None
+if args.clear_cache:
+    Osiris.ResultCache(args.cache_dir).clear()
+budget_settings = {'cell_timeout': args.cell_timeout, 'timing_factor': args.timing_factor, 'notebook_timeout': args.notebook_timeout,
+                   'memory_limit': args.kernel_memory_limit, 'cpu_limit': args.kernel_cpu_limit}
+budget_settings = {key: value for (key, value) in budget_settings.items() if value is not None}
+budget = Osiris.ExecutionBudget(**budget_settings) if len(budget_settings) > 0 else None
 if match_pattern is not None:
     match_pattern = match_pattern.lstrip()
     assert match_pattern in ['strong', 'weak', 'best_effort']
 
 root_path = os.getcwd()
+profile_path = os.path.abspath(args.profile) if args.profile is not None else None # analyses change the working directory
 
-def analyse_nb(path, execute, verbose, match_pattern, self_reproduce, debug, analyse_all_dependency):
-    interface = Osiris.UserInterface(path, execute, verbose, analyse_all_dependency)
-    is_executable = interface.analyse_executability()
+def analyse_nb(path, execute, verbose, match_pattern, self_reproduce, snapshot, debug, trace, analyse_all_dependency, kernel_pool, num_of_workers, share_prefixes, reduce_orders, result_cache, budget, early_exit, concurrent_runs):
+    interface = Osiris.UserInterface(path, execute, verbose, analyse_all_dependency, kernel_pool, num_of_workers, share_prefixes, reduce_orders, result_cache=result_cache, budget=budget, concurrent_runs=concurrent_runs)
 
-    if is_executable:
-        # reproducibility 
-        if match_pattern is not None:
-            os.chdir(root_path)
-            interface.analyse_reproducibility(match_pattern)
+    # executability & reproducibility, sharing executions between them
+    match_patterns = [match_pattern] if match_pattern is not None else []
+    if early_exit and match_pattern is not None:
+        # yes/no reproducibility, the executability is not determined when stopped at the first unmatched cell
+        results = interface.analyse_first_unmatched_cell(match_pattern)
+        is_executable = results['executability'] is True
+    else:
+        results = interface.analyse_all(match_patterns)
+        is_executable = results['executability']
 
+    if is_executable:
         # self-reproducibility 
         if self_reproduce:
             os.chdir(root_path)
-            interface.analyse_self_reproducibility()
+            interface.analyse_repeatablility(snapshot)
 
         # debug 
         if debug is not None:
             os.chdir(root_path)
-            interface.analyse_status_difference_for_a_cell(debug)
+            interface.analyse_status_difference_for_a_cell(debug, trace)
 
-analyse_nb(path, execute, verbose, match_pattern, self_reproduce, debug, analyse_all_dependency)
+if profile_path is not None:
+    with Osiris.profiling(profile_path):
+        analyse_nb(path, execute, verbose, match_pattern, self_reproduce, snapshot, debug, trace, analyse_all_dependency, kernel_pool, num_of_workers, share_prefixes, reduce_orders, result_cache, budget, early_exit, concurrent_runs)
+else:
+    analyse_nb(path, execute, verbose, match_pattern, self_reproduce, snapshot, debug, trace, analyse_all_dependency, kernel_pool, num_of_workers, share_prefixes, reduce_orders, result_cache, budget, early_exit, concurrent_runs)
 
@@ -0,0 +1,197 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import nbformat
+import Osiris
+
+'''
+Performance benchmarks of Osiris. Every public entry point of UserInterface, and the generation of execution
+orders of the Cell Dependency Graph, is timed on the benchbook/ notebooks and on synthetic notebooks of several
+sizes. Median timings are written as JSON, and compared with a baseline written by a previous run: the script
+exits with status 1 if a case got slower than the baseline by more than the regression threshold, or if a case
+timed in the baseline now fails or is missing.
+
+    python3 benchmark.py --save-baseline benchmark_baseline.json
+    python3 benchmark.py --baseline benchmark_baseline.json --threshold 0.2
+'''
+
+# Entry points executing the notebook, called on a new UserInterface for every repetition
+ENTRY_POINTS = {
+    'analyse_executability': lambda interface, num_of_cells: interface.analyse_executability(),
+    'analyse_reproducibility': lambda interface, num_of_cells: interface.analyse_reproducibility('weak'),
+    'analyse_all': lambda interface, num_of_cells: interface.analyse_all(['strong', 'weak']),
+    'analyse_first_unmatched_cell': lambda interface, num_of_cells: interface.analyse_first_unmatched_cell('weak'),
+    'analyse_repeatablility': lambda interface, num_of_cells: interface.analyse_repeatablility(),
+    'analyse_repeatablility.snapshot': lambda interface, num_of_cells: interface.analyse_repeatablility(snapshot=True),
+    'analyse_status_difference_for_a_cell': lambda interface, num_of_cells: interface.analyse_status_difference_for_a_cell(num_of_cells-1),
+}
+
+# Static analyses, called on a new NotebookIndex for every repetition
+STATIC_ENTRY_POINTS = {
+    'CRG.gen_exec_path.single': lambda index: index.get_graph().gen_exec_path(mode='single'),
+    'CRG.gen_exec_path.all': lambda index: index.get_graph().gen_exec_path(mode='all'),
+}
+
+SYNTHETIC_METADATA = {
+    'kernelspec': {'display_name': 'Python 3', 'language': 'python', 'name': 'python3'},
+    'language_info': {'name': 'python', 'version': '3.6.2'},
+}
+
+def make_synthetic_notebook(num_of_cells, path):
+    '''
+    A reproducible notebook of num_of_cells cells, where each cell depends on the cell two cells above it, so
+    that the Cell Dependency Graph has many topological orders
+    '''
+    cells, values = [], []
+    for i in range(num_of_cells):
+        values.append(i if i < 2 else values[i-2]+i)
+        source = 'x_{} = {}'.format(i, i) if i < 2 else 'x_{} = x_{} + {}'.format(i, i-2, i)
+        source += '\nprint(x_{})'.format(i)
+        outputs = [nbformat.v4.new_output('stream', name='stdout', text='{}\n'.format(values[i]))]
+        cells.append(nbformat.v4.new_code_cell(source, execution_count=i+1, outputs=outputs))
+    nb = nbformat.v4.new_notebook(cells=cells, metadata=SYNTHETIC_METADATA)
+    nbformat.write(nb, path)
+    return path
+
+def get_environment():
+    return {'osiris_version': Osiris.constants.OSIRIS_VERSION, 'python_version': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+def count_executed_cells(path):
+    # cells analysed by UserInterface, whose indices are the ones of analyse_status_difference_for_a_cell
+    return sum(1 for cell in Osiris.utils.NotebookIndex(path).get_nb().cells if cell.cell_type == 'code' and cell.execution_count is not None)
+
+def time_case(run, repeat, root_path):
+    '''
+    Median wall-clock seconds of run() over repeat repetitions, with printed outputs of Osiris silenced
+    '''
+    timings = []
+    for _ in range(repeat):
+        os.chdir(root_path)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            timings.append(run())
+    os.chdir(root_path)
+    return statistics.median(timings)
+
+def run_benchmarks(notebooks, strategies, entry_points, repeat, root_path, case_filter=None):
+    '''
+    notebooks: (name, path, is_executed) of every notebook, entry points of UserInterface are only timed on
+               notebooks to be executed
+    Returns {case name: {'seconds': median} or {'error': message}}, where a case name is
+    "<entry point>/<notebook name>/<strategy>" for entry points of UserInterface and "<entry point>/<notebook name>" otherwise
+    '''
+    results = {}
+
+    def record(name, run):
+        if case_filter is not None and case_filter not in name:
+            return
+        try:
+            results[name] = {'seconds': round(time_case(run, repeat, root_path), 4)}
+        except Exception as e:
+            os.chdir(root_path)
+            results[name] = {'error': '{}: {}'.format(type(e).__name__, e)}
+        print(name.ljust(90), results[name].get('seconds', results[name].get('error')))
+
+    for (notebook_name, path, is_executed) in notebooks:
+        num_of_cells = count_executed_cells(path)
+        for (name, entry_point) in STATIC_ENTRY_POINTS.items():
+            def run(entry_point=entry_point):
+                index = Osiris.utils.NotebookIndex(path)
+                start = time.perf_counter()
+                entry_point(index)
+                return time.perf_counter()-start
+            record('{}/{}'.format(name, notebook_name), run)
+
+        if not is_executed:
+            continue
+        for strategy in strategies:
+            for name in entry_points:
+                def run(entry_point=ENTRY_POINTS[name]):
+                    interface = Osiris.UserInterface(path, strategy, False)
+                    start = time.perf_counter()
+                    entry_point(interface, num_of_cells)
+                    return time.perf_counter()-start
+                record('{}/{}/{}'.format(name, notebook_name, strategy), run)
+    return results
+
+def compare_with_baseline(results, baseline, threshold, min_delta, case_filter=None):
+    '''
+    Returns the names of cases slower than in the baseline by more than threshold (a ratio) and min_delta seconds,
+    and of cases timed in the baseline which now fail or were not run (unless they are left out by case_filter)
+    '''
+    regressions = []
+    for (name, base) in sorted(baseline.items()):
+        if 'seconds' not in base or (case_filter is not None and case_filter not in name):
+            continue
+        result = results.get(name)
+        if result is None or 'seconds' not in result:
+            regressions.append(name)
+            print('Failure'.ljust(12), name, ':', base['seconds'], '->', 'missing' if result is None else result.get('error'))
+            continue
+        delta = result['seconds']-base['seconds']
+        if delta > min_delta and result['seconds'] > base['seconds']*(1+threshold):
+            regressions.append(name)
+            print('Regression'.ljust(12), name, ':', base['seconds'], '->', result['seconds'])
+    return regressions
+
+def load_report(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_report(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'environment': get_environment(), 'results': results}, f, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time entry points of Osiris and compare them with a baseline')
+    parser.add_argument('-n', '--notebooks', type=str, nargs='*', default=None, help='default: every notebook of benchbook/')
+    parser.add_argument('-e', '--execute', type=str, nargs='+', default=['normal'])
+    parser.add_argument('--entry-points', type=str, nargs='+', default=list(ENTRY_POINTS.keys()))
+    parser.add_argument('--synthetic-sizes', type=int, nargs='*', default=[10, 50, 500])
+    parser.add_argument('--max-executed-size', type=int, default=50, help='larger synthetic notebooks are only analysed statically')
+    parser.add_argument('-k', '--filter', type=str, default=None, help='only run cases whose name contains this string')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', type=str, default=None)
+    parser.add_argument('--save-baseline', type=str, default=None)
+    parser.add_argument('--baseline', type=str, default=None)
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown ratio, e.g. 0.2 for 20%%')
+    parser.add_argument('--min-delta', type=float, default=0.05, help='slowdowns below this many seconds are noise')
+    args = parser.parse_args()
+
+    for strategy in args.execute:
+        assert strategy in Osiris.constants.STRATEGIES
+    for entry_point in args.entry_points:
+        assert entry_point in ENTRY_POINTS
+
+    root_path = os.getcwd()
+    paths = args.notebooks if args.notebooks is not None else sorted(glob.glob('benchbook/*.ipynb'))
+    notebooks = [(path, path, True) for path in paths]
+    synthetic_dir = tempfile.mkdtemp()
+    for size in args.synthetic_sizes:
+        # synthetic notebooks are named by their size, their directory changes from run to run
+        name = 'synthetic_{}.ipynb'.format(size)
+        notebooks.append((name, make_synthetic_notebook(size, os.path.join(synthetic_dir, name)), size <= args.max_executed_size))
+
+    results = run_benchmarks(notebooks, args.execute, args.entry_points, args.repeat, root_path, args.filter)
+
+    if args.output is not None:
+        write_report(args.output, results)
+    if args.save_baseline is not None:
+        write_report(args.save_baseline, results)
+
+    if args.baseline is not None:
+        baseline = load_report(args.baseline)
+        if baseline.get('environment') != get_environment():
+            print('Note: the baseline was recorded in another environment', baseline.get('environment'))
+        regressions = compare_with_baseline(results, baseline['results'], args.threshold, args.min_delta, args.filter)
+        print('Regressions'.ljust(40), ':', len(regressions))
+        if len(regressions) > 0:
+            sys.exit(1)
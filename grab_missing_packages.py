@@ -1,17 +1,26 @@
 import argparse, sys, os
 import Osiris
 
-parser = argparse.ArgumentParser(description='return python version of a notebook')
-parser.add_argument('-n', '--name', type=str, required=True)
+parser = argparse.ArgumentParser(description='return missing packages of notebooks, one line per notebook')
+parser.add_argument('-n', '--name', type=str, nargs='+', required=True)
 parser.add_argument('-e', '--execute', type=str, required=True)
+parser.add_argument('--module-index', type=str, default=Osiris.CRG.DEFAULT_MODULE_INDEX_PATH)
 args = parser.parse_args()
 
-interface = Osiris.UserInterface(args.name, args.execute, verbose=False)
-missing_packages = interface.return_missing_packages()
-return_str = ''
-for (idx, package) in enumerate(missing_packages):
-    if idx is not 0:
-        return_str+=','
-    return_str += package
-print(return_str)
+# only import statements are needed, outputs of the notebook are not decoded
+assert args.execute in Osiris.constants.STRATEGIES
+lst_of_import_statements = [Osiris.utils.NotebookIndex(name).get_import_statements() for name in args.name]
 
+# modules of search paths are cached across runs, until their directories are modified
+module_index = Osiris.CRG.ModuleIndex(args.module_index)
+# local modules are looked up next to each notebook, notebooks may be in different directories
+lst_of_missing_packages = Osiris.utils.distinguish_local_modules_many(lst_of_import_statements, module_index, [os.path.dirname(name) for name in args.name])
+module_index.save()
+
+for missing_packages in lst_of_missing_packages:
+    return_str = ''
+    for (idx, package) in enumerate(missing_packages):
+        if idx is not 0:
+            return_str+=','
+        return_str += package
+    print(return_str)
@@ -6,5 +6,8 @@ parser.add_argument('-n', '--name', type=str, required=True)
 parser.add_argument('-e', '--execute', type=str, required=True)
 args = parser.parse_args()
 
-interface = Osiris.UserInterface(args.name, args.execute, verbose=False)
-print(interface.return_py_version())
+# only the metadata is needed, outputs of the notebook are not decoded
+assert args.execute in Osiris.constants.STRATEGIES
+py_version = Osiris.utils.NotebookIndex(args.name).get_py_version()
+assert py_version in Osiris.constants.VALID_PYTHON_VERSIONS
+print(py_version)
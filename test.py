@@ -1,5 +1,14 @@
+import gc
+import ast
 import sys
 import os
+import json
+import time
+import signal
+import tempfile
+import threading
+import weakref
+import nbformat
 
 import warnings
 import unittest
@@ -104,6 +113,240 @@ class TestOsiris(unittest.TestCase):
         self.assertEqual(num_of_matched_cells, 8)
         self.assertEqual(num_of_cells, 8)
 
+    # Outputs are compared while executing, and the execution stops at the first unmatched cell
+    def test_top_down_first_unmatched_cell(self):
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'normal', verbose)
+        results = interface.analyse_first_unmatched_cell('strong')
+        self.assertEqual(results, {'executability': None, 'first_unmatched_cell_idx': 5})
+        self.assertEqual(interface.analysizer._ep.comparison.matched_cell_idx, [0, 1, 2, 3, 4])
+
+        os.chdir(root_path)
+        results = interface.analyse_first_unmatched_cell('strong', stop_on_mismatch=False)
+        self.assertEqual(results, {'executability': True, 'first_unmatched_cell_idx': 5})
+        self.assertEqual(interface.analysizer._ep.comparison.matched_cell_idx, [0, 1, 2, 3, 4, 6])
+
+    # Both runs of weak match pattern are executed concurrently and compared as their outputs arrive
+    def test_top_down_concurrent_weak_runs(self):
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell('import random\nprint(random.random())', execution_count=1),
+                    nbformat.v4.new_code_cell('x = 1', execution_count=2),
+                    nbformat.v4.new_code_cell('1/0', execution_count=3)]
+        path = os.path.join(tempfile.mkdtemp(), 'test_concurrent_weak_runs.ipynb')
+        nbformat.write(nb, path)
+
+        interface = Osiris.UserInterface(path, 'normal', verbose, concurrent_runs=True)
+        self.assertEqual(interface.analyse_first_unmatched_cell('weak'), {'executability': None, 'first_unmatched_cell_idx': 0})
+        self.assertEqual(interface.analysizer.num_of_executions, 2)
+
+        os.chdir(root_path)
+        interface = Osiris.UserInterface(path, 'normal', verbose, concurrent_runs=True)
+        self.assertEqual(interface.analyse_all(['strong', 'weak']), {'executability': False})
+
+        # By default, the second run is not started once the first one failed
+        os.chdir(root_path)
+        interface = Osiris.UserInterface(path, 'normal', verbose)
+        self.assertEqual(interface.analyse_first_unmatched_cell('weak'), {'executability': False, 'first_unmatched_cell_idx': None})
+        self.assertEqual(interface.analysizer.num_of_executions, 1)
+
+    # By default, runs of weak match pattern are executed one after the other, as they share the working directory
+    def test_top_down_sequential_weak_runs(self):
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell("import os, time\nprint(os.path.exists('run.lock'))\nopen('run.lock', 'w').close()", execution_count=1),
+                    nbformat.v4.new_code_cell("time.sleep(1)\nos.remove('run.lock')", execution_count=2)]
+        path = os.path.join(tempfile.mkdtemp(), 'test_sequential_weak_runs.ipynb')
+        nbformat.write(nb, path)
+
+        interface = Osiris.UserInterface(path, 'normal', verbose)
+        self.assertEqual(interface.analyse_all(['weak'])['weak'][:3], (2, 2, 1.0))
+        self.assertEqual(interface.analysizer.num_of_executions, 2)
+
+    # Executability, strong and weak match pattern share the executions
+    def test_top_down_analyse_all(self):
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'normal', verbose)
+        results = interface.analyse_all(['strong', 'weak'])
+        self.assertEqual(results['executability'], True)
+        self.assertEqual(results['strong'][:2], (6, 8))
+        self.assertEqual(results['weak'][:2], (8, 8))
+        self.assertEqual(interface.analysizer.num_of_executions, 2)
+
+    # Source code of unmatched cells is taken from the executed cells, not from the cells in their original order
+    def test_top_down_analyse_all_unmatched_source_code(self):
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell('print(1)', execution_count=1, outputs=[nbformat.v4.new_output('stream', name='stdout', text='1\n')]),
+                    nbformat.v4.new_code_cell('import random; print(random.random())', execution_count=3, outputs=[nbformat.v4.new_output('stream', name='stdout', text='2\n')]),
+                    nbformat.v4.new_code_cell('x = 1', execution_count=2)]
+        path = os.path.join(tempfile.mkdtemp(), 'test_unmatched_source_code.ipynb')
+        nbformat.write(nb, path)
+
+        interface = Osiris.UserInterface(path, 'normal', verbose)
+        self.assertEqual(interface.analyse_reproducibility('strong')[4], ['import random; print(random.random())'])
+        os.chdir(root_path)
+        interface = Osiris.UserInterface(path, 'normal', verbose)
+        self.assertEqual(interface.analyse_all(['strong'])['strong'][4], ['import random; print(random.random())'])
+        os.chdir(root_path)
+        interface = Osiris.UserInterface(path, 'normal', verbose)
+        results = interface.analyse_all_strategies(['strong'], ['normal', 'OEC'])
+        self.assertEqual(results['normal']['strong'][4], ['import random; print(random.random())'])
+        self.assertEqual(results['OEC']['strong'][4], ['import random; print(random.random())'])
+
+    # Executions work on copy-on-write views, the notebook kept by the analysizer must stay intact
+    def test_copy_on_write_keeps_notebook_intact(self):
+        interface = Osiris.UserInterface(test_best_effort_notebook_path, 'OEC', verbose)
+        original_nb = nbformat.writes(interface.analysizer._deep_copy_nb)
+        interface.analyse_reproducibility('best_effort')
+        os.chdir(root_path)
+        interface.analyse_repeatablility()
+        self.assertEqual(nbformat.writes(interface.analysizer._deep_copy_nb), original_nb)
+
+    # A cancelled evaluation of all potential execution orders starts no execution at all
+    def test_dependency_reproducibility_on_all_paths_cancelled(self):
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'dependency', verbose, analyse_all_dependency=True, num_of_workers=4)
+        cancel_event = threading.Event()
+        cancel_event.set()
+        Osiris.utils.move_to_appropriate_location(test_reproducibility_notebook_path)
+        results = interface.analysizer.check_reproducibility_on_all_potential_execution_paths(verbose, 'weak', 4, cancel_event)
+        self.assertEqual(results, [])
+        self.assertEqual(interface.analysizer.num_of_executions, 0)
+
+    # Concurrent evaluations report the same ratios as sequential ones, in the order of execution orders,
+    # and leave the cancel event given by the caller untouched
+    def test_dependency_reproducibility_on_all_paths_concurrently(self):
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell('l = []', execution_count=1),
+                    nbformat.v4.new_code_cell('l.append(1); print(len(l))', execution_count=2, outputs=[nbformat.v4.new_output('stream', name='stdout', text='1\n')]),
+                    nbformat.v4.new_code_cell('l.append(2); print(len(l))', execution_count=3, outputs=[nbformat.v4.new_output('stream', name='stdout', text='2\n')])]
+        path = os.path.join(tempfile.mkdtemp(), 'test_all_paths_concurrently.ipynb')
+        nbformat.write(nb, path)
+
+        interface = Osiris.UserInterface(path, 'dependency', verbose, analyse_all_dependency=True)
+        cancel_event = threading.Event()
+        Osiris.utils.move_to_appropriate_location(path)
+        concurrent_results = interface.analysizer.check_reproducibility_on_all_potential_execution_paths(verbose, 'strong', 2, cancel_event)
+        self.assertFalse(cancel_event.is_set())
+        sequential_results = interface.analysizer.check_reproducibility_on_all_potential_execution_paths(verbose, 'strong', 1, cancel_event)
+        os.chdir(root_path)
+        self.assertEqual(sequential_results, [1.0, 1/3])
+        self.assertEqual(concurrent_results, sequential_results)
+
+    # All potential execution orders are executed at once on a prefix trie, twice for weak match pattern
+    def test_dependency_weak_reproducibility_on_all_paths_sharing_prefixes(self):
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'dependency', verbose, analyse_all_dependency=True, share_prefixes=True)
+        lst_of_matched_ratios = interface.analyse_reproducibility('weak')
+        self.assertEqual(len(lst_of_matched_ratios), 200)
+        self.assertEqual(set(lst_of_matched_ratios), {1.0})
+        self.assertEqual(interface.analysizer.num_of_executions, 2)
+
+    # On the prefix trie, warnings are filtered for the OEC and dependency strategies only, as in analyse_all
+    def test_analyse_all_strategies_shows_warnings_of_normal_strategy(self):
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell('import warnings', execution_count=1),
+                    nbformat.v4.new_code_cell("warnings.warn_explicit('careful', UserWarning, 'lib.py', 1); print(1)", execution_count=2, outputs=[
+                        nbformat.v4.new_output('stream', name='stdout', text='1\n'),
+                        nbformat.v4.new_output('stream', name='stderr', text='lib.py:1: UserWarning: careful\n')])]
+        path = os.path.join(tempfile.mkdtemp(), 'test_warnings_of_normal_strategy.ipynb')
+        nbformat.write(nb, path)
+
+        interface = Osiris.UserInterface(path, 'normal', verbose)
+        self.assertEqual(interface.analyse_all(['strong'])['strong'][:3], (2, 2, 1.0))
+        os.chdir(root_path)
+        interface = Osiris.UserInterface(path, 'normal', verbose)
+        results = interface.analyse_all_strategies(['strong'], ['normal', 'OEC'])
+        self.assertEqual(results['normal']['strong'][:3], (2, 2, 1.0))
+        self.assertEqual(results['OEC']['strong'][:3], (1, 2, 0.5))
+
+    # Only one execution order per equivalence class of orders differing by commuting cells is executed
+    def test_dependency_weak_reproducibility_on_reduced_paths(self):
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'dependency', verbose, analyse_all_dependency=True, share_prefixes=True, reduce_orders=True)
+        lst_of_matched_ratios = interface.analyse_reproducibility('weak')
+        self.assertEqual(len(lst_of_matched_ratios), 60)
+        self.assertEqual(set(lst_of_matched_ratios), {1.0})
+
+    def test_analyse_all_strategies(self):
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'normal', verbose)
+        results = interface.analyse_all_strategies(['strong'])
+        self.assertEqual(results['normal']['strong'][:2], (6, 8))
+        self.assertEqual(results['OEC']['strong'][:2], (8, 8))
+        self.assertEqual(results['dependency']['strong'][:2], (6, 8))
+        self.assertEqual(interface.analysizer.num_of_executions, 2) # the prefix trie and the normal strategy
+
+    def test_result_cache(self):
+        result_cache = Osiris.ResultCache(tempfile.mkdtemp())
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'normal', verbose, result_cache=result_cache)
+        results = interface.analyse_all(['strong'])
+        self.assertEqual(interface.return_execution_orders(), [list(range(8))])
+
+        # Cached results are returned without executing the notebook
+        os.chdir(root_path)
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'normal', verbose, result_cache=result_cache)
+        self.assertEqual(interface.analyse_all(['strong']), results)
+        self.assertEqual(interface.analysizer.num_of_executions, 0)
+
+        # Other strategies and match patterns are not cached
+        os.chdir(root_path)
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'OEC', verbose, result_cache=result_cache)
+        self.assertEqual(interface.analyse_reproducibility('strong')[:2], (8, 8))
+        self.assertEqual(interface.analysizer.num_of_executions, 1)
+
+        # Results of a kernelspec whose interpreter belongs to another environment are keyed apart
+        jupyter_path = tempfile.mkdtemp()
+        executable = os.path.join(jupyter_path, 'python')
+        os.symlink(sys.executable, executable)
+        os.makedirs(os.path.join(jupyter_path, 'kernels', 'osiris-test'))
+        with open(os.path.join(jupyter_path, 'kernels', 'osiris-test', 'kernel.json'), 'w') as f:
+            json.dump({'argv': [executable, '-m', 'ipykernel_launcher', '-f', '{connection_file}'], 'display_name': 'osiris-test', 'language': 'python'}, f)
+        previous_jupyter_path = os.environ.get('JUPYTER_PATH')
+        os.environ['JUPYTER_PATH'] = jupyter_path
+        try:
+            identity = Osiris.result_cache.get_kernel_identity('osiris-test')
+            self.assertEqual(identity['kernel_executable'], executable)
+            self.assertIsNotNone(identity['kernel_purelib'])
+            self.assertNotEqual(result_cache.get_key('0', 'analyse_all', {}, 'python3'), result_cache.get_key('0', 'analyse_all', {}, 'osiris-test'))
+        finally:
+            if previous_jupyter_path is None:
+                del os.environ['JUPYTER_PATH']
+            else:
+                os.environ['JUPYTER_PATH'] = previous_jupyter_path
+
+        result_cache.clear()
+        self.assertEqual(os.path.exists(result_cache.cache_dir), False)
+
+    def test_profiler(self):
+        self.assertIs(Osiris.profiler.span('execute cell', cell_index=0), Osiris.profiler._NULL_SPAN)
+
+        path = os.path.join(tempfile.mkdtemp(), 'trace.json')
+        with Osiris.profiling(path):
+            interface = Osiris.UserInterface(test_executability_notebook_path, 'dependency', verbose)
+            interface.analyse_executability()
+        self.assertEqual(Osiris.profiler.get_profiler(), None)
+
+        with open(path, 'r') as f:
+            events = json.load(f)['traceEvents']
+        names = set(event['name'] for event in events)
+        self.assertTrue({'load notebook', 'build CRG', 'gen_exec_path', 'start kernel', 'execute notebook', 'execute cell', 'executability'} <= names)
+        cell_events = [event for event in events if event['name'] == 'execute cell']
+        self.assertEqual(cell_events[0]['ph'], 'X')
+        self.assertEqual([event['args']['cell_index'] for event in cell_events], list(range(len(cell_events))))
+
+    def test_execution_budget(self):
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell('x = 1', execution_count=1),
+                    nbformat.v4.new_code_cell('import time\ntime.sleep(60)', execution_count=2,
+                        metadata={'ExecuteTime': {'start_time': '2020-01-01T00:00:00.000Z', 'end_time': '2020-01-01T00:00:00.250Z'}}),
+                    nbformat.v4.new_code_cell('y = 2', execution_count=3)]
+        self.assertEqual(Osiris.ExecutePreprocessors.budget.get_recorded_cell_duration(nb.cells[1]), 0.25)
+        self.assertEqual(Osiris.ExecutePreprocessors.budget.get_recorded_cell_duration(nb.cells[0]), None)
+
+        # The sleeping cell is granted 4 times its recorded duration, but at least 1 second
+        budget = Osiris.ExecutionBudget(timing_factor=4, min_cell_timeout=1)
+        self.assertEqual(budget.get_cell_timeout(nb.cells[1]), 1)
+        self.assertEqual(budget.get_cell_timeout(nb.cells[0]), 30)
+        path = os.path.join(tempfile.mkdtemp(), 'test_execution_budget.ipynb')
+        nbformat.write(nb, path)
+        interface = Osiris.UserInterface(path, 'normal', verbose, budget=budget)
+        results = interface.analyse_all([])
+        self.assertEqual(results['executability'], False)
+        self.assertEqual(results['timeout'], {'cell_index': 1, 'budget': 'cell', 'seconds': 1})
+
     '''
     The following 3 unit tests focus repeatablility
     '''
@@ -127,6 +370,50 @@ class TestOsiris(unittest.TestCase):
         self.assertEqual(num_of_reproducible_cells, 2)
         self.assertEqual(num_of_cells, 4)
 
+    # Kernels have their own hash seed, the status of a set must not depend on the order of its elements
+    def test_top_down_repeatablility_of_a_set(self):
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell("s = {'apple', 'banana', 'cherry', 'date', 'elder'}", execution_count=1),
+                    nbformat.v4.new_code_cell('n = 1', execution_count=2)]
+        path = os.path.join(tempfile.mkdtemp(), 'test_repeatablility_of_a_set.ipynb')
+        nbformat.write(nb, path)
+        interface = Osiris.UserInterface(path, 'normal', verbose)
+        self.assertEqual(interface.analyse_repeatablility(), (2, 2, 1.0, [0, 1]))
+
+    def test_OEC_repeatablility_with_snapshot(self):
+        interface = Osiris.UserInterface(test_repeatablility_notebook_path, 'OEC', verbose)
+        num_of_reproducible_cells, num_of_cells, _, reproducible_cell_idx = interface.analyse_repeatablility(snapshot=True)
+        self.assertEqual(num_of_reproducible_cells, 2)
+        self.assertEqual(num_of_cells, 4)
+        self.assertEqual(reproducible_cell_idx, [0, 1])
+
+    def test_top_down_repeatablility_with_kernel_pool(self):
+        kernel_pool = Osiris.KernelPool(size=1, max_uses=3, warmup_modules=[])
+        interface = Osiris.UserInterface(test_repeatablility_notebook_path, 'normal', verbose, kernel_pool=kernel_pool)
+        num_of_reproducible_cells, num_of_cells, _, reproducible_cell_idx = interface.analyse_repeatablility()
+        kernel_pool.shutdown()
+        self.assertEqual(num_of_reproducible_cells, 2)
+        self.assertEqual(num_of_cells, 4)
+        self.assertEqual(reproducible_cell_idx, [0, 3])
+
+    def test_kernel_pool_forgets_modules_imported_by_a_lease(self):
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, 'noisy.py'), 'w') as f:
+            f.write("print('imported')\n")
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell('import noisy', execution_count=1, outputs=[nbformat.v4.new_output('stream', name='stdout', text='imported\n')])]
+        path = os.path.join(directory, 'test_kernel_pool.ipynb')
+        nbformat.write(nb, path)
+
+        kernel_pool = Osiris.KernelPool(size=1, warmup_modules=[])
+        results = []
+        for _ in range(2):
+            os.chdir(root_path)
+            interface = Osiris.UserInterface(path, 'normal', verbose, kernel_pool=kernel_pool)
+            results.append(interface.analyse_reproducibility('strong')[:3])
+        kernel_pool.shutdown()
+        self.assertEqual(results, [(1, 1, 1.0), (1, 1, 1.0)])
+
     '''
     The following 3 unit tests focus status difference inspection
     '''
@@ -145,6 +432,11 @@ class TestOsiris(unittest.TestCase):
         problematic_statement_index = interface.analyse_status_difference_for_a_cell(1)
         self.assertEqual(problematic_statement_index, 10)
 
+    def test_top_down_debug_for_a_cell_with_trace(self):
+        interface = Osiris.UserInterface(test_debug_for_a_cell_notebook_path, 'normal', verbose)
+        problematic_statement_index = interface.analyse_status_difference_for_a_cell(1, trace=True)
+        self.assertEqual(problematic_statement_index, 10)
+
     '''
     The following 2 unit tests focus on the correctness of Osiris for images 
     '''
@@ -160,6 +452,258 @@ class TestOsiris(unittest.TestCase):
         self.assertEqual(num_of_matched_cells, 2)
         self.assertEqual(num_of_cells, 2)
 
+    '''
+    Below unit test focus on execution orders generated from the Cell-Dependency Graph
+    '''
+    def test_gen_exec_path(self):
+        graph = Osiris.utils.CRG()
+        graph.build(Osiris.utils.get_code_list('tests/paper-case.ipynb'))
+        self.assertEqual(graph.gen_exec_path(mode='single'), [0, 1, 2, 3, 4])
+        self.assertEqual(graph.gen_exec_path(mode='all'), [[0, 1, 2, 3, 4], [0, 1, 2, 4, 3], [0, 1, 3, 2, 4], [0, 1, 3, 4, 2],
+            [0, 1, 4, 2, 3], [0, 1, 4, 3, 2], [0, 4, 1, 2, 3], [0, 4, 1, 3, 2]])
+
+        oec_paths = graph.gen_exec_path(mode='oec', oec=Osiris.utils.get_oec('tests/paper-case.ipynb'))
+        self.assertEqual(len(oec_paths), 18)
+        self.assertEqual(oec_paths[:2], [[0, 1, 2, 2, 4, 2, 2, 3], [0, 1, 2, 2, 4, 3, 2, 3]])
+
+        # An order stops once no remaining cell is executable
+        graph = Osiris.utils.CRG()
+        graph.build(['a = 1', 'b = z', 'c = a'])
+        self.assertEqual(graph.gen_exec_path(mode='all'), [[0, 2]])
+
+    # Static analyses of a session share the notebook index, which loads and parses the notebook once
+    def test_notebook_index(self):
+        interface = Osiris.UserInterface(test_reproducibility_notebook_path, 'dependency', verbose)
+        index = interface.notebook_index
+        self.assertIs(interface.analysizer._index, index)
+        self.assertEqual(index.get_code_list(), Osiris.utils.get_code_list(test_reproducibility_notebook_path))
+        self.assertEqual(index.get_oec(), [1, 2, 3, 4, 5, 8, 7, 6])
+        self.assertEqual(interface.return_import_statements(), index.get_import_statements())
+
+        trees = index.get_trees()
+        self.assertIs(index.get_execution_order(), index.get_execution_order())
+        self.assertEqual(index.get_execution_order(), Osiris.utils.get_execution_order(test_reproducibility_notebook_path))
+        self.assertEqual(Osiris.utils.risk_detect(test_reproducibility_notebook_path, index), Osiris.utils.risk_detect(test_reproducibility_notebook_path))
+        self.assertIs(index.get_trees(), trees)
+
+    # Outputs are skipped by static analyses and only decoded on demand
+    def test_notebook_loader(self):
+        content = Osiris.CRG.notebook_loader.load_notebook(test_reproducibility_notebook_path)
+        self.assertIsInstance(content['cells'][0]['outputs'], Osiris.CRG.notebook_loader.LazyJSON)
+        with open(test_reproducibility_notebook_path, 'r', encoding='utf-8') as f:
+            self.assertEqual(Osiris.CRG.notebook_loader.decode_lazy_values(content), json.load(f))
+        self.assertEqual(Osiris.utils.NotebookIndex(test_reproducibility_notebook_path).get_nb(), nbformat.read(test_reproducibility_notebook_path, 4))
+
+        # Strings containing quotes, backslashes and brackets
+        path = os.path.join(tempfile.mkdtemp(), 'notebook.ipynb')
+        content = {'cells': [{'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'source': ['a = "]}\\\\"\n', 'b = 1'],
+            'outputs': [{'output_type': 'stream', 'name': 'stdout', 'text': ['\\"[', '{\\\\']}]}], 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 2}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(content, f, indent=1)
+        self.assertEqual(Osiris.CRG.notebook_loader.decode_lazy_values(Osiris.CRG.notebook_loader.load_notebook(path)), content)
+        self.assertEqual(Osiris.utils.get_code_list(path), ['a = "]}\\\\"\nb = 1'])
+
+    def test_api_pattern_index(self):
+        rules = Osiris.CRG.risk_detector.APIPatternIndex({'numpy.random.*': 'numpy', 'a.*.c': 'first', 'a.b': 'second', 'random.*': 'random'})
+        self.assertEqual(rules.match('numpy.random.randint'), 'numpy')
+        self.assertEqual(rules.match('numpy'), 'numpy') # shorter names match the prefix of patterns, as match_api
+        self.assertEqual(rules.match('a.b.c'), 'first')
+        self.assertEqual(rules.match('a.b.d'), 'second')
+        self.assertEqual(rules.match('numpy.linalg.norm'), None)
+
+        # Rule files extend the default whitelist, which keeps its priority
+        path = os.path.join(tempfile.mkdtemp(), 'rules.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'torch.*': 'torch.manual_seed(100)', 'random.*': 'ignored'}, f)
+        rules = Osiris.CRG.compile_rules([path])
+        self.assertEqual(len(rules), 5)
+        self.assertEqual(rules.match('torch.rand'), 'torch.manual_seed(100)')
+        self.assertEqual(rules.match('random.randint'), 'random.seed(100)')
+
+        paths = [test_reproducibility_notebook_path, test_executability_notebook_path, 'tests/not_a_notebook.ipynb']
+        self.assertEqual(Osiris.utils.risk_detect_many(paths, [path]),
+            [Osiris.utils.risk_detect(paths[0]), Osiris.utils.risk_detect(paths[1]), (False, 'FileNotFoundError')])
+
+    # Modules of search paths are cached on disk until their directories are modified
+    def test_module_index(self):
+        directory = tempfile.mkdtemp()
+        os.chdir(directory)
+        import_statements = ['import mymodule', 'import mypackage', 'import os']
+        module_index = Osiris.CRG.ModuleIndex(os.path.join(directory, 'modules.json'))
+        self.assertEqual(sorted(Osiris.utils.distinguish_local_modules(import_statements, module_index)), ['mymodule', 'mypackage'])
+        module_index.save()
+
+        with open('mymodule.py', 'w') as f:
+            f.write('')
+        os.mkdir('mypackage')
+        module_index = Osiris.CRG.ModuleIndex(os.path.join(directory, 'modules.json'))
+        self.assertEqual(Osiris.utils.distinguish_local_modules(import_statements, module_index), ['mypackage'])
+        with open(os.path.join('mypackage', '__init__.py'), 'w') as f:
+            f.write('')
+        self.assertEqual(Osiris.utils.distinguish_local_modules_many([import_statements, ['from .. import x']], module_index),
+            [[], Osiris.utils.distinguish_local_modules(['from .. import x'])])
+
+        # Search paths are resolved against the directory of each notebook, not the working directory
+        other_directory = tempfile.mkdtemp()
+        os.chdir(other_directory)
+        lst_of_missing_packages = Osiris.utils.distinguish_local_modules_many([import_statements, import_statements], module_index, [directory, other_directory])
+        self.assertEqual([sorted(missing_packages) for missing_packages in lst_of_missing_packages], [[], ['mymodule', 'mypackage']])
+        self.assertEqual(Osiris.utils.distinguish_local_modules(import_statements, module_index, directory), [])
+
+    # Static analyses of cells are looked up in the cell cache, identical cells of other notebooks included
+    def test_cell_cache(self):
+        cell_cache = Osiris.utils.CellCache(os.path.join(tempfile.mkdtemp(), 'cells.sqlite'))
+        uncached_index = Osiris.utils.NotebookIndex(test_reproducibility_notebook_path)
+        for _ in range(2):
+            index = Osiris.utils.NotebookIndex(test_reproducibility_notebook_path, cell_cache)
+            self.assertEqual(index.get_graph().producer_list, uncached_index.get_graph().producer_list)
+            self.assertEqual(index.get_graph().consumer_list, uncached_index.get_graph().consumer_list)
+            self.assertEqual(index.get_execution_order(), uncached_index.get_execution_order())
+            self.assertEqual(Osiris.utils.risk_detect(test_reproducibility_notebook_path, index), Osiris.utils.risk_detect(test_reproducibility_notebook_path))
+
+        # Cached cells are not parsed anymore
+        self.assertEqual(index._trees, None)
+        keys = [Osiris.CRG.cell_cache.get_cell_key(code) for code in index.get_code_list()]
+        self.assertNotIn(None, cell_cache.get_records(keys))
+        cell_cache.close()
+
+    def test_search_oec_orders(self):
+        graph = Osiris.utils.CRG()
+        graph.build(Osiris.utils.get_code_list('tests/test_best_effort.ipynb'))
+        oec = Osiris.utils.get_oec('tests/test_best_effort.ipynb')
+        result = graph.search_oec_orders(oec, max_paths=2)
+        self.assertEqual(result.num_of_paths, 180)
+        self.assertEqual(result.paths, [[0, 1, 2, 2, 4, 2, 2, 3, 5, 6, 7], [0, 1, 2, 2, 4, 3, 2, 3, 5, 6, 7]])
+        self.assertEqual(result.truncated, False)
+        self.assertEqual(graph.search_oec_orders(oec, count_only=True), ([], 180, False))
+
+        # Producers of a cell are only available to the cells after it, not to other cells tried at its position
+        graph = Osiris.utils.CRG()
+        graph.build(['a = 1', 'b = a'])
+        self.assertEqual(graph.search_oec_orders([2, 3]).paths, [[0, 0, 1]])
+
+        # The budget runs out, orders found so far are returned
+        graph = Osiris.utils.CRG()
+        graph.build(['v{} = 1'.format(i) for i in range(100)])
+        result = graph.search_oec_orders(list(range(2, 201, 2)), max_paths=1, max_nodes=1000)
+        self.assertEqual(result.truncated, True)
+        self.assertEqual(len(result.paths), 1)
+        self.assertTrue(result.num_of_paths > 0)
+
+    def test_gen_exec_path_reduced(self):
+        graph = Osiris.utils.CRG()
+        graph.build(Osiris.utils.get_code_list('tests/paper-case.ipynb'))
+        self.assertEqual(list(graph.gen_exec_path(mode='reduced')), [[0, 1, 2, 3, 4], [0, 1, 3, 2, 4]])
+
+        # Cells sharing no symbol commute
+        graph = Osiris.utils.CRG()
+        graph.build(['a = 1', 'b = 1', 'c = a + b', 'print(1)'])
+        self.assertEqual(len(graph.gen_exec_path(mode='all')), 8)
+        self.assertEqual(list(graph.gen_exec_path(mode='reduced')), [[0, 1, 2, 3]])
+
+    def test_dependency_graph(self):
+        graph = Osiris.utils.CRG()
+        graph.build(Osiris.utils.get_code_list('tests/paper-case.ipynb'))
+        self.assertEqual(graph.successors, [[1, 3, 4], [2, 3], [], [], []])
+        self.assertEqual(graph.get_topological_order(), [0, 1, 4, 2, 3])
+        self.assertEqual(graph.get_ancestors(3), [0, 1])
+        self.assertEqual(graph.get_descendants(1), [2, 3])
+
+        # A consumer depends on the last writer above it, else on the first writer below it
+        graph = Osiris.utils.CRG()
+        graph.build(['b = a', 'a = 1', 'c = a', 'a = 2'])
+        self.assertEqual(graph.predecessors, [[1], [], [1], []])
+        self.assertEqual(graph.get_topological_order(), [1, 3, 0, 2])
+
+        # Relative imports, whose module may be None, are analysed as well
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell('try:\n    from . import foo\nexcept ImportError:\n    pass', execution_count=1),
+                    nbformat.v4.new_code_cell('x = 1', execution_count=2)]
+        path = os.path.join(tempfile.mkdtemp(), 'test_relative_import.ipynb')
+        nbformat.write(nb, path)
+        self.assertEqual(Osiris.utils.NotebookIndex(path).get_execution_order(), [0, 1])
+        self.assertEqual(Osiris.CRG.dependency_graph_utils.get_api_ref_id(ast.parse('from . import foo\nfrom ..bar import baz as qux')), {'foo': '.foo', 'qux': '..bar.baz'})
+
+    '''
+    Below unit test focus on output fingerprints, which compare cells by digests of their outputs
+    '''
+    def test_output_fingerprint(self):
+        image_cell = nbformat.v4.new_code_cell(outputs=[
+            nbformat.v4.new_output('stream', name='stdout', text='1\n2\n'),
+            nbformat.v4.new_output('display_data', data={'image/png': 'iVBORw0KGgo', 'text/plain': '<Figure>'})])
+        split_stream_cell = nbformat.v4.new_code_cell(outputs=[
+            nbformat.v4.new_output('stream', name='stdout', text='1\n'),
+            nbformat.v4.new_output('stream', name='stdout', text='2\n'),
+            nbformat.v4.new_output('display_data', data={'image/png': 'iVBORw0KGgo', 'text/plain': '<Figure>'})])
+        other_image_cell = nbformat.v4.new_code_cell(outputs=[
+            nbformat.v4.new_output('stream', name='stdout', text='1\n2\n'),
+            nbformat.v4.new_output('display_data', data={'image/png': 'iVBORw0KGgp', 'text/plain': '<Figure>'})])
+
+        fingerprints = Osiris.utils.extract_outputs_based_on_normal_order([image_cell, split_stream_cell, other_image_cell, nbformat.v4.new_code_cell()])
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+        self.assertTrue(fingerprints[3].is_empty())
+        self.assertEqual(Osiris.utils.get_output_text(split_stream_cell), '1\n2\niVBORw0KGgo')
+
+        # Fingerprints do not keep the outputs of their cell alive
+        cell_ref = weakref.ref(image_cell)
+        del image_cell
+        gc.collect()
+        self.assertIsNone(cell_ref())
+
+    '''
+    Below unit test focus on the corpus runner, whose second run should resume from the records of the first run
+    '''
+    def test_analyse_corpus(self):
+        output_path = os.path.join(tempfile.mkdtemp(), 'records.jsonl')
+        num_of_records = Osiris.analyse_corpus([test_reproducibility_notebook_path], output_path, ['normal'], ['strong'], verbose=False)
+        self.assertEqual(num_of_records, 1)
+
+        with open(output_path, 'r', encoding='utf-8') as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record['status'], 'ok')
+        self.assertEqual(record['executability'], True)
+        self.assertEqual(record['strong']['num_of_matched_cells'], 6)
+
+        num_of_records = Osiris.analyse_corpus([test_reproducibility_notebook_path], output_path, ['normal'], ['strong'], verbose=False)
+        self.assertEqual(num_of_records, 0)
+
+    # Kernels run in sessions of their own, the ones of a job which timed out are killed along with its worker
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'reads the state of the kernel from /proc')
+    def test_analyse_corpus_kills_kernels_of_timed_out_jobs(self):
+        directory = tempfile.mkdtemp()
+        pid_path = os.path.join(directory, 'kernel.pid')
+        nb = nbformat.read(test_executability_notebook_path, 4)
+        nb.cells = [nbformat.v4.new_code_cell('import os, time\nopen({!r}, "w").write(str(os.getpid()))\nsum(range(10**12)) # holds the GIL'.format(pid_path), execution_count=1)]
+        path = os.path.join(directory, 'test_timed_out_job.ipynb')
+        nbformat.write(nb, path)
+
+        output_path = os.path.join(directory, 'records.jsonl')
+        Osiris.analyse_corpus([path], output_path, ['normal'], ['strong'], timeout=15, verbose=False)
+        with open(output_path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.loads(f.readline())['status'], 'timeout')
+
+        with open(pid_path, 'r') as f:
+            kernel_pid = int(f.read())
+        time.sleep(1)
+        try:
+            with open('/proc/{}/stat'.format(kernel_pid), 'r') as f:
+                is_alive = f.read().split(')')[-1].split()[0] != 'Z'
+        except FileNotFoundError:
+            is_alive = False
+        if is_alive:
+            os.kill(kernel_pid, signal.SIGKILL)
+        self.assertFalse(is_alive)
+
+    def test_compare_with_baseline(self):
+        import benchmark
+        baseline = {'a/slower': {'seconds': 1.0}, 'a/noise': {'seconds': 1.0}, 'a/failing': {'seconds': 1.0},
+                    'a/missing': {'seconds': 1.0}, 'a/failed': {'error': 'ValueError: '}, 'b/missing': {'seconds': 1.0}}
+        results = {'a/slower': {'seconds': 1.5}, 'a/noise': {'seconds': 1.01}, 'a/failing': {'error': 'ValueError: '},
+                   'a/failed': {'error': 'ValueError: '}, 'a/new': {'seconds': 9.0}}
+        self.assertEqual(benchmark.compare_with_baseline(results, baseline, 0.2, 0.05), ['a/failing', 'a/missing', 'a/slower', 'b/missing'])
+        self.assertEqual(benchmark.compare_with_baseline(results, baseline, 0.2, 0.05, case_filter='a/'), ['a/failing', 'a/missing', 'a/slower'])
+
     '''
     Below unit test focus on the util func: return_fix_statement
     Note that this unit test should be removed in the future